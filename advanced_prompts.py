@@ -1,37 +1,35 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from pydantic import BaseModel, Field
-from typing import List
 from dotenv import load_dotenv
-import os
+import asyncio
+
+from model_factory import get_chat_model
+from streaming import astream_chain, format_metrics
+from template_registry import template_registry
+from chat_history import ChatHistoryManager
+from structured_output import structured_chain
+from model_cascade import cascade_chain, low_confidence
 
 # 加载环境变量
 load_dotenv()
 
 
 # 创建聊天模型
-llm_params = {
-    "model": os.getenv("OPENAI_MODEL", ""),
-    "temperature": 0.1,
-    "streaming": True,
-    "openai_api_key": os.getenv("OPENAI_API_KEY", ""),
-    "openai_api_base": os.getenv("OPENAI_API_BASE", ""),
-}
-chat_model = ChatOpenAI(**llm_params)
+# 这些链温度低、输入经常重复，开启持久化响应缓存
+chat_model = get_chat_model(cached=True)
 
-print("=== PromptTemplate 高级功能演示 ===\n")
+# 模块里只定义模板和链，导入时不会调用模型；演示代码在各个 run_* 函数里
 
 # 1. 结构化输出解析
-print("1. 结构化输出解析")
 class BookRecommendation(BaseModel):
+    """图书推荐"""
     title: str = Field(description="书名")
     author: str = Field(description="作者")
     reason: str = Field(description="推荐理由")
     difficulty: str = Field(description="难度级别")
+    confidence: float = Field(description="推荐的把握程度，0到1之间")
 
-# 创建带输出解析器的模板
+# 创建模板：输出格式由 BookRecommendation 的 JSON Schema 约束，不再写进提示
 structured_template = PromptTemplate.from_template(
     """你是一个专业的图书推荐专家。
 请为学习{topic}的{level}学习者推荐一本书。
@@ -39,57 +37,32 @@ structured_template = PromptTemplate.from_template(
 要求：
 - 书名要准确
 - 推荐理由要具体
-- 难度要适合学习者水平
-
-请以JSON格式返回：
-{{
-    "title": "书名",
-    "author": "作者", 
-    "reason": "推荐理由",
-    "difficulty": "难度级别"
-}}"""
+- 难度要适合学习者水平"""
 )
 
-# 创建输出解析器
-output_parser = JsonOutputParser(pydantic_object=BookRecommendation)
-
-# 组合模板和解析器
-chain = structured_template | chat_model | output_parser
-
-# 执行链式调用
-result = chain.invoke({"topic": "Python编程", "level": "初学者"})
-print(f"结构化输出: {result}")
-print()
+# 组合模板、模型和结构化输出解析，结果是 BookRecommendation 实例；
+# 配置了 CASCADE_MODEL 时先用便宜模型推荐，置信度不足再升级到 OPENAI_MODEL
+chain = cascade_chain(
+    lambda model: structured_chain(structured_template, model, BookRecommendation, "book_recommendation"),
+    "book_recommendation",
+    low_confidence,
+    chat_model,
+    schema=BookRecommendation,
+)
 
 # 2. 多轮对话模板
-print("2. 多轮对话模板")
 chat_template = ChatPromptTemplate.from_messages([
     ("system", "你是一个专业的{role}，请用{style}的方式回答问题。"),
     MessagesPlaceholder(variable_name="chat_history"),
     ("human", "{question}")
 ])
 
-# 模拟对话历史
-chat_history = [
-    HumanMessage(content="什么是Python？"),
-    HumanMessage(content="Python是一种编程语言，特点是语法简洁...")
-]
-
-# 生成多轮对话提示
-messages = chat_template.format_messages(
-    role="编程导师",
-    style="简洁明了",
-    chat_history=chat_history,
-    question="Python有哪些主要应用领域？"
-)
-
-print("多轮对话模板:")
-for msg in messages:
-    print(f"- {msg.type}: {msg.content[:50]}...")
-print()
-
 # 3. 条件模板
-print("3. 条件模板")
+# 模板内容只取决于用户级别，topic 是模板变量，按级别缓存
+def _user_level_key(user_level, topic=None):
+    return user_level if user_level in ("初学者", "进阶") else "默认"
+
+@template_registry.cached("conditional", key=_user_level_key)
 def create_conditional_prompt(user_level, topic):
     if user_level == "初学者":
         template = """你是一个耐心的编程导师。
@@ -107,21 +80,10 @@ def create_conditional_prompt(user_level, topic):
 - 讨论性能优化"""
     else:
         template = """请简单介绍一下{topic}。"""
-    
-    return PromptTemplate.from_template(template)
 
-# 测试不同级别的模板
-beginner_prompt = create_conditional_prompt("初学者", "函数")
-advanced_prompt = create_conditional_prompt("进阶", "函数")
-
-print("初学者模板:")
-print(beginner_prompt.template)
-print("\n进阶模板:")
-print(advanced_prompt.template)
-print()
+    return PromptTemplate.from_template(template)
 
 # 4. 模板组合和复用
-print("4. 模板组合和复用")
 # 基础模板
 base_template = PromptTemplate.from_template(
     "你是一个{role}，专门负责{domain}领域的问题。"
@@ -142,54 +104,146 @@ combined_template = PromptTemplate.from_template(
     "{base_context}\n\n{task_info}\n\n{format_requirement}"
 )
 
-# 使用组合模板
-result = combined_template.format(
-    base_context=base_template.format(role="数据分析师", domain="金融"),
-    task_info=task_template.format(task_description="分析股票价格趋势"),
-    format_requirement=format_template.format(format_style="图表+文字说明")
-)
-
-print("组合模板结果:")
-print(result)
-print()
-
 # 5. 动态内容注入
-print("5. 动态内容注入")
-def create_context_aware_prompt(context_info, user_query):
-    # 根据上下文信息动态构建提示
-    if "error" in context_info.lower():
+def _context_category(context_info):
+    lowered = context_info.lower()
+    if "error" in lowered:
+        return "error"
+    if "performance" in lowered:
+        return "performance"
+    return "default"
+
+@template_registry.cached("context_aware")
+def _context_template(category):
+    if category == "error":
         template = """检测到错误信息：{context}
 请分析这个错误并提供解决方案。
 用户问题：{query}"""
-    elif "performance" in context_info.lower():
+    elif category == "performance":
         template = """性能相关信息：{context}
 请提供性能优化建议。
 用户问题：{query}"""
     else:
         template = """相关信息：{context}
 请回答用户问题：{query}"""
-    
+
     return PromptTemplate.from_template(template)
 
-# 测试不同上下文
-error_context = "TypeError: 'NoneType' object is not callable"
-perf_context = "函数执行时间超过5秒"
-normal_context = "用户正在学习Python"
-
-error_prompt = create_context_aware_prompt(error_context, "如何解决这个问题？")
-perf_prompt = create_context_aware_prompt(perf_context, "如何优化性能？")
-
-print("错误上下文模板:")
-print(error_prompt.template)
-print("\n性能上下文模板:")
-print(perf_prompt.template)
-print()
-
-print("=== 总结 ===")
-print("PromptTemplate 不仅仅是变量替换，它还提供：")
-print("✅ 结构化输出解析")
-print("✅ 多轮对话支持") 
-print("✅ 条件模板生成")
-print("✅ 模板组合和复用")
-print("✅ 动态内容注入")
-print("✅ 与LangChain生态系统的深度集成") 
\ No newline at end of file
+def create_context_aware_prompt(context_info, user_query):
+    # 根据上下文信息选择模板类别，同一类别复用编译好的模板
+    return _context_template(_context_category(context_info))
+
+
+# 预编译条件模板和上下文模板的全部变体，第一次请求不必再编译
+template_registry.precompile(create_conditional_prompt, [("初学者", ""), ("进阶", ""), ("其他", "")])
+template_registry.precompile(_context_template, [("error",), ("performance",), ("default",)])
+
+
+def run_structured_output():
+    print("1. 结构化输出解析")
+    # 执行链式调用
+    result = chain.invoke({"topic": "Python编程", "level": "初学者"})
+    print(f"结构化输出: {result}")
+    print()
+
+    # 流式执行同一条链：解析器随字段到达产出部分 BookRecommendation
+    print("1.1 流式结构化输出")
+    stream_result, stream_metrics = asyncio.run(astream_chain(
+        chain,
+        {"topic": "Python编程", "level": "初学者"},
+        schema=BookRecommendation,
+        on_field=lambda name, value: print(f"  字段 {name}: {value}"),
+    ))
+    print(f"  {format_metrics(stream_metrics)}")
+    print()
+
+
+def run_chat_template():
+    print("2. 多轮对话模板")
+    # 模拟对话历史：按 token 预算保留最近的轮次，超出预算的旧轮次被丢弃
+    history = ChatHistoryManager(max_tokens=200)
+    for i in range(10):
+        history.add_user_message(f"第{i + 1}个问题：什么是Python？")
+        history.add_ai_message("Python是一种编程语言，特点是语法简洁...")
+    chat_history = history.history()
+    print(f"历史统计: {history.stats()}")
+
+    # 生成多轮对话提示
+    messages = chat_template.format_messages(
+        role="编程导师",
+        style="简洁明了",
+        chat_history=chat_history,
+        question="Python有哪些主要应用领域？"
+    )
+
+    print("多轮对话模板:")
+    for msg in messages:
+        print(f"- {msg.type}: {msg.content[:50]}...")
+    print()
+
+
+def run_conditional():
+    print("3. 条件模板")
+    # 测试不同级别的模板
+    beginner_prompt = create_conditional_prompt("初学者", "函数")
+    advanced_prompt = create_conditional_prompt("进阶", "函数")
+
+    print("初学者模板:")
+    print(beginner_prompt.template)
+    print("\n进阶模板:")
+    print(advanced_prompt.template)
+    print()
+
+
+def run_composition():
+    print("4. 模板组合和复用")
+    # 使用组合模板
+    result = combined_template.format(
+        base_context=base_template.format(role="数据分析师", domain="金融"),
+        task_info=task_template.format(task_description="分析股票价格趋势"),
+        format_requirement=format_template.format(format_style="图表+文字说明")
+    )
+
+    print("组合模板结果:")
+    print(result)
+    print()
+
+
+def run_context_aware():
+    print("5. 动态内容注入")
+    # 测试不同上下文
+    error_context = "TypeError: 'NoneType' object is not callable"
+    perf_context = "函数执行时间超过5秒"
+
+    error_prompt = create_context_aware_prompt(error_context, "如何解决这个问题？")
+    perf_prompt = create_context_aware_prompt(perf_context, "如何优化性能？")
+
+    print("错误上下文模板:")
+    print(error_prompt.template)
+    print("\n性能上下文模板:")
+    print(perf_prompt.template)
+    # 同类别的上下文直接命中缓存
+    create_context_aware_prompt("ValueError: invalid literal", "这是什么错误？")
+    print(f"\n模板缓存统计: {template_registry.stats()}")
+    print()
+
+
+def main():
+    print("=== PromptTemplate 高级功能演示 ===\n")
+    run_structured_output()
+    run_chat_template()
+    run_conditional()
+    run_composition()
+    run_context_aware()
+
+    print("=== 总结 ===")
+    print("PromptTemplate 不仅仅是变量替换，它还提供：")
+    print("✅ 结构化输出解析")
+    print("✅ 多轮对话支持")
+    print("✅ 条件模板生成")
+    print("✅ 模板组合和复用")
+    print("✅ 动态内容注入")
+
+
+if __name__ == "__main__":
+    main()
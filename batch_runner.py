@@ -0,0 +1,86 @@
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from collections import deque
+from dotenv import load_dotenv
+import openai
+import asyncio
+import os
+
+# 加载环境变量
+load_dotenv()
+
+# 链的异步批量执行：用信号量限制并发，按输入顺序或按完成顺序产出结果，
+# 遇到限流错误（429）时按指数退避重试
+
+# 需要退避重试的错误类型
+RETRYABLE_ERRORS = (openai.RateLimitError,)
+
+
+async def ainvoke_with_retry(chain, item, config=None, max_attempts=None):
+    """调用一次链，限流时按指数退避加抖动重试"""
+    retrying = AsyncRetrying(
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        stop=stop_after_attempt(max_attempts or int(os.getenv("BATCH_MAX_ATTEMPTS", "5"))),
+        wait=wait_exponential_jitter(initial=1, max=30),
+        reraise=True,
+    )
+    async for attempt in retrying:
+        with attempt:
+            return await chain.ainvoke(item, config)
+
+
+async def abatch_iter(chain, inputs, concurrency=None, ordered=True, return_exceptions=False, config=None):
+    """并发执行链，逐个产出 (输入序号, 结果)
+
+    inputs 可以是任意可迭代对象，按需消费，不会一次性创建所有任务。
+    ordered=True 时按输入顺序产出，否则按完成顺序产出。
+    return_exceptions=True 时失败的输入产出异常对象而不是中断整个批次。
+    """
+    concurrency = concurrency or int(os.getenv("BATCH_CONCURRENCY", "8"))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index, item):
+        async with semaphore:
+            try:
+                return index, await ainvoke_with_retry(chain, item, config)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return index, e
+
+    tasks = deque() if ordered else set()
+    try:
+        for index, item in enumerate(inputs):
+            task = asyncio.create_task(run(index, item))
+            if ordered:
+                tasks.append(task)
+                # 已完成的队头结果立即产出；积压超过两倍并发时等待队头，限制缓冲的结果数量
+                while tasks and (tasks[0].done() or len(tasks) >= concurrency * 2):
+                    yield await tasks.popleft()
+            else:
+                tasks.add(task)
+                if len(tasks) >= concurrency:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for finished in done:
+                        yield finished.result()
+
+        while tasks:
+            if ordered:
+                yield await tasks.popleft()
+            else:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    yield finished.result()
+    finally:
+        # 提前退出或出错时取消尚未完成的任务
+        for task in tasks:
+            task.cancel()
+
+
+async def abatch(chain, inputs, concurrency=None, return_exceptions=False, config=None):
+    """并发执行链，按输入顺序返回结果列表"""
+    return [
+        result
+        async for _, result in abatch_iter(
+            chain, inputs, concurrency=concurrency, return_exceptions=return_exceptions, config=config
+        )
+    ]
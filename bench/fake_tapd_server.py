@@ -0,0 +1,115 @@
+from mcp.server.fastmcp import FastMCP
+import asyncio
+import json
+import os
+
+# 基准测试用的假 TAPD MCP Server，通过 TAPD_MCP_COMMAND 替换 uvx mcp-server-tapd。
+# 工具名和返回结构模仿真实 Server，每个项目带一批无关字段，TAPD_FAKE_LATENCY 控制调用延迟。
+# 工具数超过 TOOL_SELECT_TOP_K，基准测试能覆盖工具子集选择
+
+mcp = FastMCP("fake-tapd", log_level="WARNING")
+
+LATENCY = float(os.getenv("TAPD_FAKE_LATENCY", "0.1"))
+PROJECT_COUNT = int(os.getenv("TAPD_FAKE_PROJECTS", "20"))
+
+
+def _project(index):
+    return {
+        "id": str(10000 + index),
+        "name": f"项目{index}",
+        "status": "normal",
+        "category": "project",
+        "creator": os.getenv("CURRENT_USER_NICK", "bench"),
+        "created": "2025-01-01 10:00:00",
+        "description": "基准测试生成的项目描述。" * 5,
+        "workspace_type": "project",
+        "parent_id": "0",
+        "secret": "0",
+    }
+
+
+@mcp.tool()
+async def get_user_participant_projects(nick: str = "") -> str:
+    """获取用户参与的项目列表"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": [{"Workspace": _project(i)} for i in range(PROJECT_COUNT)]}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def get_stories_or_tasks(workspace_id: int, entity_type: str = "stories", limit: int = 10) -> str:
+    """查询项目下的需求或任务"""
+    await asyncio.sleep(LATENCY)
+    items = [
+        {"Story": {"id": str(i), "name": f"需求{i}", "status": "planning", "owner": "bench", "description": "描述" * 20}}
+        for i in range(limit)
+    ]
+    return json.dumps({"status": 1, "data": items}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def create_story_or_task(workspace_id: int, name: str, entity_type: str = "stories") -> str:
+    """创建需求或任务"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": {"id": "1", "name": name}}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def update_story_or_task(workspace_id: int, id: int, name: str = "", status: str = "", entity_type: str = "stories") -> str:
+    """更新需求或任务的标题、状态"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": {"id": str(id), "name": name, "status": status}}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def get_story_or_task_count(workspace_id: int, entity_type: str = "stories") -> str:
+    """统计项目下的需求或任务数量"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": {"count": 42}}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def get_workspace_info(workspace_id: int) -> str:
+    """获取项目详情"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": {"Workspace": _project(workspace_id % 100)}}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def get_iterations(workspace_id: int, limit: int = 10) -> str:
+    """查询项目的迭代列表"""
+    await asyncio.sleep(LATENCY)
+    items = [{"Iteration": {"id": str(i), "name": f"迭代{i}", "status": "open"}} for i in range(limit)]
+    return json.dumps({"status": 1, "data": items}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def get_bug(workspace_id: int, limit: int = 10) -> str:
+    """查询项目下的缺陷"""
+    await asyncio.sleep(LATENCY)
+    items = [{"Bug": {"id": str(i), "title": f"缺陷{i}", "status": "new", "severity": "normal"}} for i in range(limit)]
+    return json.dumps({"status": 1, "data": items}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def create_bug(workspace_id: int, title: str) -> str:
+    """创建缺陷"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": {"id": "1", "title": title}}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def get_comments(workspace_id: int, entry_id: int, entry_type: str = "stories") -> str:
+    """查询需求、任务或缺陷的评论"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": [{"Comment": {"id": "1", "description": "评论内容"}}]}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def get_workspace_users(workspace_id: int) -> str:
+    """查询项目成员"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps({"status": 1, "data": [{"UserWorkspace": {"user": "bench", "role": "管理员"}}]}, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    mcp.run()
@@ -0,0 +1,298 @@
+from pathlib import Path
+import importlib.util
+import contextlib
+import subprocess
+import tracemalloc
+import argparse
+import asyncio
+import tempfile
+import socket
+import math
+import json
+import time
+import sys
+import io
+import os
+
+# 离线基准测试：启动本地桩服务和假的 TAPD MCP Server，
+# 对 simple_chat、real_world_example 的各个场景和两个 MCP 客户端
+# 重复执行并统计 p50/p95/p99 时延、吞吐和内存
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+
+CUSTOMER_SERVICE_INPUTS = {
+    "user_message": "我想了解一下你们的产品价格",
+    "chat_history": "用户之前询问过产品功能",
+    "product_info": "我们的产品价格从99元起，支持免费试用",
+}
+CODE_REVIEW_INPUTS = {
+    "language": "python",
+    "code": "def calculate_fibonacci(n):\n    if n <= 1:\n        return n\n"
+            "    return calculate_fibonacci(n-1) + calculate_fibonacci(n-2)\n",
+}
+DOCUMENT_INPUTS = {
+    "project_name": "用户管理系统",
+    "tech_stack": "Python + FastAPI + PostgreSQL",
+    "features": "用户注册、登录、权限管理、数据统计",
+    "target_users": "开发者和系统管理员",
+    "doc_type": "API文档",
+    "requirements": "- 接口说明\n- 请求参数\n- 响应格式\n- 错误码",
+    "style": "技术文档",
+    "length": "详细",
+}
+TRANSLATION_TEXT = "我们很高兴地通知您，您的订单已经发货了。"
+BATCH_TEXTS = [f"第{i}条界面文案：您的订单已发货" for i in range(20)]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(args):
+    """在子进程中启动桩服务，避免与被测代码争用 GIL"""
+    import httpx
+
+    port = _free_port()
+    command = [
+        sys.executable, str(BENCH_DIR / "stub_server.py"),
+        "--port", str(port),
+        "--latency", str(args.latency),
+        "--token-rate", str(args.token_rate),
+        "--parallel-tools", str(args.parallel_tools),
+        "--cached-ratio", str(args.cached_ratio),
+        "--error-rate", str(args.error_rate),
+        # 与 CURRENT_USER_NICK 一致，模型的第一个工具调用可以命中预取
+        "--tool-args", '{"nick": "bench"}',
+    ]
+    process = subprocess.Popen(command)
+    base_url = f"http://127.0.0.1:{port}/v1"
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/models", timeout=0.5)
+            return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("桩服务启动失败")
+
+
+def configure_env(base_url, args):
+    """把模型和 MCP Server 指向本地桩服务，必须在导入场景模块之前调用"""
+    os.environ.update({
+        "OPENAI_API_BASE": base_url,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_MODEL": "stub",
+        "TAPD_MCP_COMMAND": f"{sys.executable} {BENCH_DIR / 'fake_tapd_server.py'}",
+        "TAPD_FAKE_LATENCY": str(args.tool_latency),
+        "CURRENT_USER_NICK": "bench",
+        "LLM_CACHE_ENABLED": "true" if args.with_cache else "false",
+        "LLM_CACHE_PATH": str(Path(tempfile.gettempdir()) / "ai_agent_bench_cache.sqlite3"),
+        "MCP_TOOL_CACHE_DIR": str(Path(tempfile.gettempdir()) / "ai_agent_bench_tools"),
+        "CHECKPOINT_PATH": str(Path(tempfile.gettempdir()) / "ai_agent_bench_checkpoints.sqlite3"),
+    })
+    if not args.with_cache:
+        # 关闭工具结果缓存，测量每次真实的工具调用
+        os.environ["TOOL_CACHE_READ_PATTERNS"] = "__none__"
+
+
+def load_script(path, name):
+    """按文件路径加载脚本模块（mcp 目录与 mcp 包同名，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def build_scenarios(selected, args, resources):
+    """返回 {场景名: 无参异步函数}"""
+    from langchain_core.messages import HumanMessage
+    from langchain_core.runnables import RunnableParallel
+    from model_factory import get_chat_model
+    import real_world_example as rwe
+
+    chat_model = get_chat_model()
+
+    async def translation_batch():
+        return [result async for result in rwe.atranslate_batch(BATCH_TEXTS, "中文", "英文", "商务邮件")]
+
+    async def customer_service_stream():
+        return await rwe.astream_chain(rwe.customer_service_chain, CUSTOMER_SERVICE_INPUTS)
+
+    translation = RunnableParallel(formal=rwe.formal_chain, casual=rwe.casual_chain)
+    scenarios = {
+        "simple_chat": lambda: chat_model.ainvoke([HumanMessage(content="你好，我是小明，今天天气怎么样？")]),
+        "customer_service": lambda: rwe.customer_service_chain.ainvoke(CUSTOMER_SERVICE_INPUTS),
+        "customer_service_stream": customer_service_stream,
+        "code_review": lambda: rwe.code_review_chain.ainvoke(CODE_REVIEW_INPUTS),
+        "translation": lambda: translation.ainvoke({"text": TRANSLATION_TEXT}),
+        "translation_batch": translation_batch,
+        "document": lambda: rwe.document_chain.ainvoke(DOCUMENT_INPUTS),
+    }
+
+    if any(name.startswith("mcp_") for name in selected):
+        from mcp_session_pool import MCPSessionPool
+
+        # 会话池只启动一次，测量的是热会话下的单次查询时延
+        pool = await MCPSessionPool(size=args.mcp_pool_size).start()
+        resources.append(pool)
+        langchain_client = load_script(ROOT / "mcp" / "langchain_client.py", "bench_langchain_client")
+        langgraph_client = load_script(ROOT / "mcp" / "langgraph_client.py", "bench_langgraph_client")
+        scenarios["mcp_langchain"] = lambda: langchain_client.run_agent(pool)
+        scenarios["mcp_langgraph"] = lambda: langgraph_client.run_agent(pool)
+
+    return {name: scenarios[name] for name in selected}
+
+
+def percentile(sorted_values, p):
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_scenario(name, fn, args):
+    # 预热：建立连接、填充工具目录等一次性开销不计入结果
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.warmup):
+            await fn()
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await fn()
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    if args.trace_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(one() for _ in range(args.iterations)))
+    wall = time.perf_counter() - started
+    peak = None
+    if args.trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "throughput_rps": len(latencies) / wall if wall else None,
+        "peak_mem_kb": None if peak is None else round(peak / 1024, 1),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+def print_report(results, baseline=None):
+    columns = ["scenario", "p50_ms", "p95_ms", "p99_ms", "mean_ms", "throughput_rps", "peak_mem_kb", "errors"]
+    baseline = {item["scenario"]: item for item in (baseline or [])}
+    print("  ".join(f"{column:>24}" if index == 0 else f"{column:>14}" for index, column in enumerate(columns)))
+    for result in results:
+        cells = []
+        for index, column in enumerate(columns):
+            value = _fmt(result[column])
+            before = baseline.get(result["scenario"], {}).get(column)
+            if index and isinstance(before, (int, float)) and before and isinstance(result[column], (int, float)):
+                # 与基线对比的变化百分比
+                value += f" ({(result[column] - before) / before * 100:+.0f}%)"
+            cells.append(f"{value:>24}" if index == 0 else f"{value:>14}")
+        print("  ".join(cells))
+
+
+SCENARIOS = [
+    "simple_chat", "customer_service", "customer_service_stream", "code_review",
+    "translation", "translation_batch", "document", "mcp_langchain", "mcp_langgraph",
+]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("scenarios", nargs="*", default=SCENARIOS, help=f"要运行的场景，默认全部：{', '.join(SCENARIOS)}")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.2, help="桩服务首包延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="桩服务每秒输出 token 数")
+    parser.add_argument("--parallel-tools", type=int, default=1, help="桩服务每轮返回的工具调用个数")
+    parser.add_argument("--cached-ratio", type=float, default=0.0, help="桩服务报告的 prompt 缓存命中比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务随机返回 429 的概率")
+    parser.add_argument("--tool-latency", type=float, default=0.1, help="假 TAPD 工具的调用延迟（秒）")
+    parser.add_argument("--mcp-pool-size", type=int, default=2)
+    parser.add_argument("--with-cache", action="store_true", help="开启响应缓存和工具结果缓存")
+    parser.add_argument("--trace-memory", action=argparse.BooleanOptionalAction, default=True, help="用 tracemalloc 统计内存峰值")
+    parser.add_argument("--json", dest="json_path", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    return parser
+
+
+async def run(args):
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(sorted(unknown))}")
+
+    resources = []
+    try:
+        scenarios = await build_scenarios(args.scenarios, args, resources)
+        results = []
+        for name, fn in scenarios.items():
+            print(f"运行场景 {name} ...", file=sys.stderr)
+            results.append(await run_scenario(name, fn, args))
+        return results
+    finally:
+        for resource in resources:
+            await resource.close()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    process, base_url = start_stub_server(args)
+    try:
+        configure_env(base_url, args)
+        results = asyncio.run(run(args))
+    finally:
+        process.terminate()
+        process.wait()
+
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_report(results, baseline)
+    if any(name.startswith("mcp_") for name in args.scenarios):
+        # 两个 MCP 客户端的工具子集选择统计：绑定的工具数、回退到全部工具的次数和节省的提示 token
+        from tool_selector import tool_selector_stats
+        for stats in tool_selector_stats():
+            print(f"工具选择: {json.dumps(stats, ensure_ascii=False)}")
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+import argparse
+import asyncio
+import random
+import time
+import json
+import uuid
+import re
+
+# 本地的 OpenAI 兼容桩服务，用于离线基准测试：
+# 支持可配置的首包延迟、token 速率、SSE 流式输出、工具调用和 429 错误注入，
+# 不消耗 API 配额，时延稳定，便于对比优化前后的差异
+
+# 结构化场景统一返回的 JSON，覆盖客服、代码审查和图书推荐的字段
+JSON_REPLY = {
+    "intent": "咨询",
+    "confidence": 0.95,
+    "action": "提供信息",
+    "response": "我们的产品价格从99元起，支持免费试用。",
+    "score": 85,
+    "issues": ["递归实现存在重复计算"],
+    "suggestions": ["使用迭代或缓存优化"],
+    "security_risks": [],
+    "overall_comment": "代码简洁，但性能有待优化",
+    "title": "Python编程：从入门到实践",
+    "author": "Eric Matthes",
+    "reason": "示例丰富，适合初学者",
+    "difficulty": "初级",
+}
+
+TEXT_REPLY = "这是基准测试桩服务返回的回复内容，用于模拟真实模型的输出。"
+FINAL_TOOL_REPLY = "项目A\n项目B\n项目C"
+
+_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+|\s+|.", re.S)
+
+
+def split_tokens(text):
+    """粗略切分 token：英文单词、空白和单个其他字符各算一个"""
+    return _TOKEN_PATTERN.findall(text)
+
+
+def _text_of(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def build_translations(messages, config):
+    """打包翻译：按编号返回每段的「译文」，可按比例随机漏掉段落以验证重试"""
+    segments = json.loads(_text_of(messages[-1]))
+    return {"translations": [
+        {"id": segment_id, "text": f"[译]{text}"}
+        for segment_id, text in segments.items()
+        if random.random() >= config.drop_segments
+    ]}
+
+
+def build_reply(body, config):
+    """根据请求内容决定返回文本还是工具调用"""
+    messages = body.get("messages", [])
+    tools = body.get("tools") or []
+    has_tool_result = any(message.get("role") == "tool" for message in messages)
+
+    forced = body.get("tool_choice")
+    if tools and isinstance(forced, dict):
+        # 强制调用指定工具时（结构化输出的 function_calling 模式），参数就是结构化结果
+        return {
+            "content": "",
+            "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {
+                    "name": forced["function"]["name"],
+                    "arguments": json.dumps(JSON_REPLY, ensure_ascii=False),
+                },
+            }],
+        }
+
+    if tools and not has_tool_result:
+        names = [tool["function"]["name"] for tool in tools]
+        name = config.tool_name if config.tool_name in names else names[0]
+        return {
+            "content": "",
+            "tool_calls": [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": config.tool_args},
+                }
+                for _ in range(config.parallel_tools)
+            ],
+        }
+
+    if has_tool_result:
+        return {"content": FINAL_TOOL_REPLY}
+    prompt_text = "".join(_text_of(message) for message in messages)
+    response_format = body.get("response_format") or {}
+    properties = (response_format.get("json_schema") or {}).get("schema", {}).get("properties", {})
+    if "translations" in properties:
+        return {"content": json.dumps(build_translations(messages, config), ensure_ascii=False)}
+    if body.get("response_format") or "json" in prompt_text.lower():
+        return {"content": json.dumps(JSON_REPLY, ensure_ascii=False)}
+    return {"content": TEXT_REPLY * config.text_repeat}
+
+
+def build_usage(body, completion_tokens, config):
+    prompt_tokens = max(1, len(json.dumps(body.get("messages", []), ensure_ascii=False)) // 3)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": int(prompt_tokens * config.cached_ratio)},
+    }
+
+
+async def chat_completions(request):
+    config = request.app.state.config
+    body = await request.json()
+    if config.error_rate and random.random() < config.error_rate:
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+            status_code=429,
+            headers={"retry-after": "1"},
+        )
+
+    response_format = body.get("response_format") or {}
+    if config.no_json_schema and response_format.get("type") == "json_schema":
+        return JSONResponse(
+            {"error": {"message": "response_format json_schema is not supported (stub)", "type": "invalid_request_error"}},
+            status_code=400,
+        )
+
+    reply = build_reply(body, config)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model") or "stub"
+    tokens = split_tokens(reply.get("content") or "")
+    token_interval = 1.0 / config.token_rate if config.token_rate > 0 else 0.0
+
+    if not body.get("stream"):
+        await asyncio.sleep(config.latency + len(tokens) * token_interval)
+        message = {"role": "assistant", "content": reply.get("content")}
+        if reply.get("tool_calls"):
+            message["tool_calls"] = reply["tool_calls"]
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if reply.get("tool_calls") else "stop",
+            }],
+            "usage": build_usage(body, len(tokens), config),
+        })
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta, finish_reason=None, usage=None):
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def events():
+        await asyncio.sleep(config.latency)
+        yield chunk({"role": "assistant", "content": ""})
+        if reply.get("tool_calls"):
+            for index, tool_call in enumerate(reply["tool_calls"]):
+                yield chunk({"tool_calls": [{"index": index, **tool_call}]})
+            yield chunk({}, "tool_calls")
+        else:
+            for token in tokens:
+                if token_interval:
+                    await asyncio.sleep(token_interval)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+        if include_usage:
+            yield chunk({}, usage=build_usage(body, len(tokens), config))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+async def list_models(request):
+    return JSONResponse({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+
+def create_app(config):
+    app = Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/models", list_models, methods=["GET"]),
+    ])
+    app.state.config = config
+    return app
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的基准测试桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="首包延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="每秒输出的 token 数，0 表示不限速")
+    parser.add_argument("--text-repeat", type=int, default=3, help="普通文本回复重复的次数")
+    parser.add_argument("--tool-name", default="get_user_participant_projects", help="优先调用的工具名")
+    parser.add_argument("--tool-args", default="{}", help="工具调用参数（JSON 字符串）")
+    parser.add_argument("--parallel-tools", type=int, default=1, help="每轮返回的工具调用个数")
+    parser.add_argument("--cached-ratio", type=float, default=0.0, help="usage 中报告为缓存命中的 prompt token 比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 429 的概率")
+    parser.add_argument("--drop-segments", type=float, default=0.0, help="打包翻译时随机漏掉段落的比例")
+    parser.add_argument("--no-json-schema", action="store_true", help="拒绝 response_format=json_schema，模拟不支持结构化输出的服务")
+    return parser
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,168 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from dotenv import load_dotenv
+import logging
+import os
+
+from token_counter import count_message_tokens
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 按 token 预算管理多轮对话历史：每条消息只在加入时计数一次，总数增量维护；
+# 超出预算时从最早的轮次开始丢弃，配置了摘要模型时把丢弃的轮次压缩成一条摘要。
+# 系统消息固定保留，不参与淘汰，长会话下发送给模型的上下文大小保持稳定
+
+SUMMARY_PROMPT = """请把下面的对话压缩成一段简短的摘要，保留用户的身份、需求和已经确认的关键事实，不超过{max_chars}字。
+
+已有摘要：
+{summary}
+
+新增对话：
+{dialogue}"""
+
+
+class ChatHistoryManager:
+    """带 token 预算的对话历史"""
+
+    def __init__(self, max_tokens=None, system_message=None, summarizer=None, min_messages=None, model=None):
+        self.max_tokens = max_tokens or int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "2000"))
+        # 至少保留最近的几条消息，即使它们本身已经超出预算
+        self.min_messages = min_messages if min_messages is not None else int(os.getenv("CHAT_HISTORY_MIN_MESSAGES", "2"))
+        self.summarizer = summarizer
+        self.model = model
+        self.system_message = None
+        self.system_tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self._entries = []  # [(message, tokens)]
+        self._history_tokens = 0
+        self._pending = []  # 已移出窗口、等待摘要的消息
+        self.dropped = 0
+        if system_message is not None:
+            self.set_system_message(system_message)
+
+    def set_system_message(self, message):
+        if isinstance(message, str):
+            message = SystemMessage(content=message)
+        self.system_message = message
+        self.system_tokens = count_message_tokens(message, self.model)
+
+    @property
+    def total_tokens(self):
+        return self.system_tokens + self.summary_tokens + self._history_tokens
+
+    def add_message(self, message):
+        if isinstance(message, SystemMessage):
+            self.set_system_message(message)
+            return
+        tokens = count_message_tokens(message, self.model)
+        self._entries.append((message, tokens))
+        self._history_tokens += tokens
+        self._trim()
+
+    def add_messages(self, messages):
+        for message in messages:
+            self.add_message(message)
+
+    def add_user_message(self, content):
+        self.add_message(HumanMessage(content=content))
+
+    def add_ai_message(self, content):
+        self.add_message(AIMessage(content=content))
+
+    def _drop_oldest(self):
+        message, tokens = self._entries.pop(0)
+        self._history_tokens -= tokens
+        self.dropped += 1
+        if self.summarizer is not None:
+            self._pending.append(message)
+
+    def _trim(self):
+        if self.total_tokens <= self.max_tokens:
+            return
+        while self.total_tokens > self.max_tokens and len(self._entries) > self.min_messages:
+            self._drop_oldest()
+        # 不以孤立的工具结果或 AI 回复开头，保证窗口从一轮对话的开始处截断
+        while len(self._entries) > self.min_messages and not isinstance(self._entries[0][0], HumanMessage):
+            self._drop_oldest()
+
+    def _summary_request(self):
+        dialogue = "\n".join(f"{_speaker(message)}：{message.content}" for message in self._pending)
+        # 摘要最多占预算的四分之一，中文按一个字约一个 token 估算
+        max_chars = max(50, self.max_tokens // 4)
+        return [HumanMessage(content=SUMMARY_PROMPT.format(
+            max_chars=max_chars, summary=self.summary or "无", dialogue=dialogue
+        ))]
+
+    def _apply_summary(self, response):
+        self.summary = response.content.strip()
+        self.summary_tokens = count_message_tokens(self._summary_message(), self.model)
+        self._pending = []
+        self._trim()
+
+    def _summary_message(self):
+        return SystemMessage(content=f"此前对话摘要：{self.summary}")
+
+    def summarize(self):
+        """把等待摘要的消息合并进摘要（同步调用摘要模型）"""
+        if self._pending:
+            try:
+                self._apply_summary(self.summarizer.invoke(self._summary_request()))
+            except Exception as e:
+                # 摘要失败时直接丢弃这些轮次，不影响本次请求
+                logger.warning("对话摘要失败: %s", e)
+                self._pending = []
+
+    async def asummarize(self):
+        if self._pending:
+            try:
+                self._apply_summary(await self.summarizer.ainvoke(self._summary_request()))
+            except Exception as e:
+                logger.warning("对话摘要失败: %s", e)
+                self._pending = []
+
+    def history(self):
+        """不含系统消息的历史（摘要 + 最近的轮次），用于填充 MessagesPlaceholder"""
+        self.summarize()
+        return self._window()
+
+    async def ahistory(self):
+        await self.asummarize()
+        return self._window()
+
+    def _window(self):
+        messages = [message for message, _ in self._entries]
+        if self.summary:
+            messages.insert(0, self._summary_message())
+        return messages
+
+    def messages(self):
+        """完整的消息列表，固定的系统消息在最前面"""
+        history = self.history()
+        return [self.system_message, *history] if self.system_message is not None else history
+
+    def to_text(self):
+        """把历史格式化成纯文本，用于直接写进提示的模板"""
+        lines = [f"{_speaker(message)}：{message.content}" for message in self.history()]
+        return "\n".join(lines)
+
+    def stats(self):
+        return {
+            "messages": len(self._entries),
+            "total_tokens": self.total_tokens,
+            "max_tokens": self.max_tokens,
+            "dropped": self.dropped,
+            "summarized": bool(self.summary),
+        }
+
+
+def _speaker(message):
+    if isinstance(message, HumanMessage):
+        return "用户"
+    if isinstance(message, AIMessage):
+        return "助手"
+    if isinstance(message, SystemMessage):
+        return "系统"
+    return message.type
@@ -0,0 +1,197 @@
+from pathlib import Path
+from typing import List, Optional
+import importlib.util
+import subprocess
+import asyncio
+import sys
+import os
+
+import typer
+
+# 统一的命令行入口：每个演示脚本和工具对应一个子命令。
+# 这里只导入 typer，langchain、langgraph、mcp 等重量级模块在子命令执行时才导入，
+# --help 和不需要模型的命令可以在毫秒级启动
+
+ROOT = Path(__file__).resolve().parent
+
+app = typer.Typer(help="ai_agent 演示与工具", no_args_is_help=True, add_completion=False)
+
+
+def _load_script(relative_path, name):
+    """按文件路径加载脚本（mcp 目录与 mcp 包同名、test.py 与标准库 test 同名，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location(name, ROOT / relative_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@app.command()
+def chat(message: str = typer.Argument("你好，我是小明，今天天气怎么样？", help="发送给模型的消息")):
+    """单轮对话（simple_chat.py）"""
+    import simple_chat
+
+    simple_chat.main(message)
+
+
+@app.command()
+def prompts():
+    """PromptTemplate 与模型结合的几种方式（test.py）"""
+    _load_script("test.py", "prompt_methods").main()
+
+
+@app.command("prompt-examples")
+def prompt_examples():
+    """PromptTemplate 基础示例（prompt_examples.py）"""
+    import prompt_examples as module
+
+    module.main()
+
+
+@app.command()
+def advanced():
+    """PromptTemplate 高级功能（advanced_prompts.py）"""
+    import advanced_prompts
+
+    advanced_prompts.main()
+
+
+@app.command()
+def params():
+    """模型参数构建示例（example_params.py）"""
+    import example_params
+
+    example_params.main()
+
+
+SCENARIOS = ["customer_service", "code_review", "translation", "document"]
+
+
+@app.command()
+def scenarios(
+    only: Optional[List[str]] = typer.Option(None, "--only", help=f"只运行指定场景：{', '.join(SCENARIOS)}"),
+    stream: bool = typer.Option(False, "--stream", help="流式执行并打印 TTFT 和 token 速率"),
+):
+    """实际应用场景演示（real_world_example.py）"""
+    unknown = set(only or []) - set(SCENARIOS)
+    if unknown:
+        raise typer.BadParameter(f"未知场景: {', '.join(sorted(unknown))}", param_hint="--only")
+
+    import real_world_example
+
+    if not only:
+        real_world_example.main(stream)
+        return
+    runners = {
+        "customer_service": lambda: real_world_example.run_customer_service(stream),
+        "code_review": lambda: real_world_example.run_code_review(stream),
+        "translation": real_world_example.run_translation,
+        "document": real_world_example.run_document,
+    }
+    for name in only:
+        runners[name]()
+
+
+@app.command("mcp-langchain")
+def mcp_langchain(query: Optional[str] = typer.Argument(None, help="查询内容，默认使用脚本里的演示查询")):
+    """手写工具循环的 TAPD agent（mcp/langchain_client.py）"""
+    client = _load_script("mcp/langchain_client.py", "langchain_client")
+    result = asyncio.run(client.main(query or client.DEFAULT_QUERY))
+    print("AI 最终内容：", result.content)
+
+
+@app.command("mcp-langgraph")
+def mcp_langgraph(
+    query: Optional[str] = typer.Argument(None, help="查询内容，默认使用脚本里的演示查询"),
+    thread_id: Optional[str] = typer.Option(None, "--thread-id", help="继续之前的会话"),
+):
+    """LangGraph react agent（mcp/langgraph_client.py）"""
+    client = _load_script("mcp/langgraph_client.py", "langgraph_client")
+    thread_id = thread_id or client.new_thread_id()
+    print("会话 ID：", thread_id)
+    result = asyncio.run(client.main(thread_id, query or client.DEFAULT_QUERY))
+    print("AI 最终内容：", result["messages"][-1].content)
+
+
+@app.command(context_settings={"allow_extra_args": True, "ignore_unknown_options": True})
+def bench(ctx: typer.Context):
+    """离线基准测试，参数原样传给 bench/run_bench.py"""
+    _load_script("bench/run_bench.py", "run_bench").main(ctx.args)
+
+
+@app.command()
+def serve(
+    host: Optional[str] = typer.Option(None, "--host", help="监听地址，默认 SERVICE_HOST"),
+    port: Optional[int] = typer.Option(None, "--port", help="监听端口，默认 SERVICE_PORT"),
+):
+    """以 HTTP 服务发布场景链（service.py）"""
+    import service
+
+    service.run(host, port)
+
+
+# profile-imports 可以分析的目标：子命令名 -> 要导入的脚本
+PROFILE_TARGETS = {
+    "cli": "cli.py",
+    "chat": "simple_chat.py",
+    "prompts": "test.py",
+    "prompt-examples": "prompt_examples.py",
+    "advanced": "advanced_prompts.py",
+    "params": "example_params.py",
+    "scenarios": "real_world_example.py",
+    "mcp-langchain": "mcp/langchain_client.py",
+    "mcp-langgraph": "mcp/langgraph_client.py",
+    "serve": "service.py",
+}
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 [(模块名, 嵌套深度, 自身微秒, 累计微秒)]"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # 模块名前每多两个空格表示多一层嵌套导入
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+@app.command("profile-imports")
+def profile_imports(
+    target: str = typer.Argument("cli", help=f"要分析的目标：{', '.join(PROFILE_TARGETS)}"),
+    top: int = typer.Option(20, "--top", help="显示累计耗时最多的前 N 个模块"),
+):
+    """用 python -X importtime 统计导入耗时（只导入，不运行演示）"""
+    if target not in PROFILE_TARGETS:
+        raise typer.BadParameter(f"未知目标: {target}", param_hint="target")
+
+    path = ROOT / PROFILE_TARGETS[target]
+    code = (
+        "import importlib.util, sys;"
+        f"sys.path.insert(0, {str(ROOT)!r});"
+        f"spec = importlib.util.spec_from_file_location('profiled', {str(path)!r});"
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+    )
+    env = dict(os.environ)
+    # 导入时会创建模型实例（不调用 API），没有配置密钥时用占位值
+    env.setdefault("OPENAI_API_KEY", "profile")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=ROOT, env=env,
+    )
+    if completed.returncode != 0:
+        print(completed.stderr[-2000:], file=sys.stderr)
+        raise typer.Exit(completed.returncode)
+
+    entries = parse_importtime(completed.stderr)
+    # 顶层导入的累计耗时之和就是总导入时间
+    total = sum(cumulative_us for _, depth, _, cumulative_us in entries if depth == 0)
+    print(f"{target}：导入 {len(entries)} 个模块，总计 {total / 1000:.1f}ms")
+    print(f"{'累计(ms)':>10}  {'自身(ms)':>10}  模块")
+    for name, _, self_us, cumulative_us in sorted(entries, key=lambda item: item[3], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>10.1f}  {self_us / 1000:>10.1f}  {name}")
+
+
+if __name__ == "__main__":
+    app()
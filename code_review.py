@@ -0,0 +1,208 @@
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+from langchain_core.runnables import RunnableLambda
+from collections import OrderedDict
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import threading
+import xxhash
+import re
+import os
+
+from batch_runner import abatch_iter
+from token_counter import count_tokens
+
+# 加载环境变量
+load_dotenv()
+
+# 大文件的 map-reduce 代码审查：按语法边界（类、函数、空行）把代码切成不超过
+# CODE_REVIEW_CHUNK_TOKENS 的片段，各片段并发审查，再合并去重 issues、suggestions、
+# security_risks，按片段长度加权合并评分。片段结果按内容哈希缓存，
+# 文件小改后重新审查只会重跑改动过的片段
+
+# 常见写法到 langchain_text_splitters.Language 的映射
+_LANGUAGE_ALIASES = {
+    "py": "python",
+    "javascript": "js",
+    "typescript": "ts",
+    "golang": "go",
+    "c++": "cpp",
+    "c#": "csharp",
+    "md": "markdown",
+}
+
+_NORMALIZE_PATTERN = re.compile(r"[\s，。；：,.;:！!？?、\"'`“”‘’()（）]+")
+
+
+@dataclass
+class CodeChunk:
+    text: str
+    start_line: int
+    end_line: int
+    tokens: int
+
+    @property
+    def lines(self):
+        return f"{self.start_line}-{self.end_line}" if self.end_line > self.start_line else str(self.start_line)
+
+
+def _splitter_language(language):
+    name = (language or "").strip().lower()
+    try:
+        return Language(_LANGUAGE_ALIASES.get(name, name))
+    except ValueError:
+        return None
+
+
+def split_code(code, language, chunk_tokens=None, model=None):
+    """按语法边界切分代码，返回 [CodeChunk]；不认识的语言按空行和换行切分"""
+    chunk_tokens = chunk_tokens or int(os.getenv("CODE_REVIEW_CHUNK_TOKENS", "1500"))
+    options = {
+        "chunk_size": chunk_tokens,
+        "chunk_overlap": 0,
+        "length_function": lambda text: count_tokens(text, model),
+        "add_start_index": True,
+    }
+    splitter_language = _splitter_language(language)
+    if splitter_language is not None:
+        splitter = RecursiveCharacterTextSplitter.from_language(splitter_language, **options)
+    else:
+        splitter = RecursiveCharacterTextSplitter(separators=["\n\n", "\n", " ", ""], **options)
+
+    chunks = []
+    for document in splitter.create_documents([code]):
+        start = document.metadata["start_index"]
+        start_line = code.count("\n", 0, start) + 1
+        end_line = start_line + document.page_content.count("\n")
+        chunks.append(CodeChunk(document.page_content, start_line, end_line, count_tokens(document.page_content, model)))
+    return chunks
+
+
+def _normalize(text):
+    return _NORMALIZE_PATTERN.sub("", text).lower()
+
+
+def _merge_items(located_items, with_lines):
+    """按规范化文本去重，保留首次出现的顺序，同一条出现在多个片段时合并行号"""
+    merged = OrderedDict()
+    for lines, item in located_items:
+        key = _normalize(item)
+        if not key:
+            continue
+        if key not in merged:
+            merged[key] = (item.strip(), [])
+        if lines not in merged[key][1]:
+            merged[key][1].append(lines)
+    if not with_lines:
+        return [item for item, _ in merged.values()]
+    return [f"{item}（第 {'、'.join(lines)} 行）" for item, lines in merged.values()]
+
+
+class ChunkReviewCache:
+    """片段审查结果的 LRU 缓存，键是语言和片段内容的哈希，与片段在文件中的位置无关"""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or int(os.getenv("CODE_REVIEW_CACHE_SIZE", "512"))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(language, text):
+        return xxhash.xxh3_128_hexdigest(f"{(language or '').lower()}\0{text}".encode())
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def set(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CodeReviewPipeline:
+    """把 chain（输入 {"language", "code"}，输出 CodeReviewResult）扩展到任意长度的代码"""
+
+    def __init__(self, chain, result_type, chunk_tokens=None, concurrency=None, cache=None, model=None):
+        self.chain = chain
+        self.result_type = result_type
+        self.chunk_tokens = chunk_tokens
+        self.concurrency = concurrency or int(os.getenv("CODE_REVIEW_CONCURRENCY", "0")) or None
+        self.cache = cache or ChunkReviewCache()
+        self.model = model
+
+    async def areview(self, code, language, config=None):
+        chunks = split_code(code, language, self.chunk_tokens, self.model)
+        if not chunks:
+            return self.result_type(score=100, issues=[], suggestions=[], security_risks=[], overall_comment="没有需要审查的代码")
+
+        keys = [self.cache.key(language, chunk.text) for chunk in chunks]
+        results = {}
+        pending = OrderedDict()
+        for key, chunk in zip(keys, chunks):
+            if key in results or key in pending:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                # 同一文件里内容相同的片段只审查一次
+                pending[key] = chunk
+
+        pending_keys = list(pending)
+        async for index, result in abatch_iter(
+            self.chain,
+            ({"language": language, "code": chunk.text} for chunk in pending.values()),
+            concurrency=self.concurrency,
+            config=config,
+        ):
+            results[pending_keys[index]] = result
+            self.cache.set(pending_keys[index], result)
+
+        return self.merge([(chunk, results[key]) for key, chunk in zip(keys, chunks)], reviewed=len(pending))
+
+    def merge(self, reviewed_chunks, reviewed=None):
+        """合并各片段的结果：评分按片段 token 数加权，条目去重并标注行号"""
+        if len(reviewed_chunks) == 1:
+            return reviewed_chunks[0][1]
+
+        total_tokens = sum(max(chunk.tokens, 1) for chunk, _ in reviewed_chunks)
+        score = sum(result.score * max(chunk.tokens, 1) for chunk, result in reviewed_chunks) / total_tokens
+
+        def located(field):
+            return [(chunk.lines, item) for chunk, result in reviewed_chunks for item in getattr(result, field)]
+
+        comments = _merge_items([(chunk.lines, result.overall_comment) for chunk, result in reviewed_chunks], True)
+        summary = f"共 {len(reviewed_chunks)} 个片段"
+        if reviewed is not None:
+            summary += f"，本次审查 {reviewed} 个，其余复用缓存"
+        return self.result_type(
+            score=round(score),
+            issues=_merge_items(located("issues"), True),
+            suggestions=_merge_items(located("suggestions"), False),
+            security_risks=_merge_items(located("security_risks"), True),
+            overall_comment=summary + "。\n" + "\n".join(comments),
+        )
+
+    def as_runnable(self):
+        """包装成与 chain 输入输出相同的 Runnable，可以直接替换原来的审查链"""
+        async def review(inputs, config):
+            return await self.areview(inputs["code"], inputs["language"], config)
+
+        return RunnableLambda(review, name="code_review_pipeline")
+
+    def stats(self):
+        return self.cache.stats()
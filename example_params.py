@@ -1,45 +1,46 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
-import os
+
+from model_factory import build_model_params, get_chat_model
 
 # 加载环境变量
 load_dotenv()
 
 
-# 基础配置
-base_params = {
-    "model": os.getenv("OPENAI_MODEL", ""),
-    "temperature": 0.1,
-    "streaming": True,
-    "openai_api_key": os.getenv("OPENAI_API_KEY", ""),
-    "openai_api_base": os.getenv("OPENAI_API_BASE", ""),
-}
-
-# 方法1：直接使用基础配置
-print("=== 方法1：直接使用基础配置 ===")
-chat_model1 = ChatOpenAI(**base_params)
-
-# 方法2：动态修改参数
-print("\n=== 方法2：动态修改参数 ===")
-creative_params = base_params.copy()
-creative_params["temperature"] = 0.8  # 提高创造性
-chat_model2 = ChatOpenAI(**creative_params)
-
 # 方法3：条件性参数构建
-print("\n=== 方法3：条件性参数构建 ===")
 def create_model_params(use_streaming=True, temperature=0.1):
+    # 只描述模型配置，实际的实例和连接池由 model_factory 统一管理
     params = {
-        "model": os.getenv("OPENAI_MODEL", ""),
         "temperature": temperature,
         "streaming": use_streaming,
-        "openai_api_key": os.getenv("OPENAI_API_KEY", ""),
-        "openai_api_base": os.getenv("OPENAI_API_BASE", ""),
     }
     return params
 
-# 创建不同配置的模型
-streaming_model = ChatOpenAI(**create_model_params(use_streaming=True, temperature=0.1))
-non_streaming_model = ChatOpenAI(**create_model_params(use_streaming=False, temperature=0.8))
 
-print("参数解包示例完成！") 
\ No newline at end of file
+def main():
+    # 基础配置
+    base_params = build_model_params()
+
+    # 方法1：直接使用基础配置
+    print("=== 方法1：直接使用基础配置 ===")
+    chat_model1 = get_chat_model()
+
+    # 方法2：动态修改参数
+    print("\n=== 方法2：动态修改参数 ===")
+    creative_params = base_params.copy()
+    creative_params["temperature"] = 0.8  # 提高创造性
+    chat_model2 = get_chat_model(temperature=creative_params["temperature"])
+    print(f"温度: {chat_model2.temperature}")
+
+    print("\n=== 方法3：条件性参数构建 ===")
+    # 创建不同配置的模型，相同配置会直接复用已有实例
+    streaming_model = get_chat_model(**create_model_params(use_streaming=True, temperature=0.1))
+    non_streaming_model = get_chat_model(**create_model_params(use_streaming=False, temperature=0.8))
+    for model in (streaming_model, non_streaming_model):
+        print(f"streaming={model.streaming}, temperature={model.temperature}")
+    print(f"相同配置复用实例: {get_chat_model() is chat_model1}")
+
+    print("参数解包示例完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+from langchain_core.runnables import RunnableLambda
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import functools
+import threading
+import time
+import re
+import os
+
+# 加载环境变量
+load_dotenv()
+
+# 客服消息的本地预路由：用关键词前缀树和正则识别高置信度的简单意图
+# （问价格、问试用、打招呼、致谢、转人工），直接用预置的回复模板生成
+# CustomerServiceResponse，不调用模型；命中多个意图、含投诉等复杂信号或消息较长时
+# 交给原来的 LLM 链。统计本地处理的比例和节省的时延
+
+
+@dataclass
+class IntentRule:
+    name: str
+    intent: str
+    action: str
+    # 回复模板，可以使用输入里的 {product_info} 等字段
+    answer: str
+    keywords: tuple = ()
+    patterns: tuple = ()
+    confidence: float = 0.95
+    # 客套类意图（打招呼、致谢）和其他意图同时出现时忽略，以其他意图为准
+    courtesy: bool = False
+
+
+DEFAULT_RULES = [
+    IntentRule(
+        "price", "咨询", "提供信息", "{product_info}",
+        keywords=("价格", "多少钱", "价钱", "收费", "报价", "费用", "怎么卖"),
+        patterns=(r"(多少|几)(块|元)",),
+    ),
+    IntentRule(
+        "trial", "咨询", "提供信息", "{product_info}",
+        keywords=("试用", "免费用", "能不能免费"),
+    ),
+    IntentRule(
+        "greeting", "其他", "提供信息", "您好，请问有什么可以帮您？",
+        keywords=("你好", "您好", "在吗", "在不在"),
+        patterns=(r"^\s*(hi|hello|hey)\W*$",),
+        courtesy=True,
+    ),
+    IntentRule(
+        "thanks", "其他", "提供信息", "不客气，还有其他问题随时联系我们。",
+        keywords=("谢谢", "感谢", "多谢", "thanks", "thank you"),
+        courtesy=True,
+    ),
+    IntentRule(
+        "human", "其他", "转人工", "好的，正在为您转接人工客服，请稍候。",
+        keywords=("转人工", "人工客服", "找人工", "真人"),
+    ),
+]
+
+# 出现这些词说明消息需要理解上下文，即使命中了简单意图也交给模型
+DEFAULT_ESCALATION_KEYWORDS = (
+    "投诉", "退款", "退货", "故障", "坏了", "不满意", "差评", "骗", "为什么", "但是", "可是", "还有", "另外",
+)
+
+_END = object()
+
+
+class KeywordTrie:
+    """关键词前缀树，一次扫描找出消息中出现的所有关键词"""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, keyword, value):
+        node = self._root
+        for char in keyword.lower():
+            node = node.setdefault(char, {})
+        node.setdefault(_END, []).append(value)
+
+    def find(self, text):
+        """返回出现的关键词对应的值集合"""
+        text = text.lower()
+        found = set()
+        for start in range(len(text)):
+            node = self._root
+            for char in text[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                found.update(node.get(_END, ()))
+        return found
+
+
+class IntentRouter:
+    """命中高置信度意图时在本地生成回复，否则返回 None 交给模型"""
+
+    def __init__(self, response_type, rules=None, escalation_keywords=None, max_chars=None, min_confidence=None):
+        self.response_type = response_type
+        self.rules = {rule.name: rule for rule in (rules or DEFAULT_RULES)}
+        self.max_chars = max_chars if max_chars is not None else int(os.getenv("INTENT_ROUTER_MAX_CHARS", "40"))
+        if min_confidence is None:
+            min_confidence = float(os.getenv("INTENT_ROUTER_MIN_CONFIDENCE", "0.9"))
+        self.min_confidence = min_confidence
+
+        self._trie = KeywordTrie()
+        for rule in self.rules.values():
+            for keyword in rule.keywords:
+                self._trie.add(keyword, rule.name)
+        for keyword in escalation_keywords or DEFAULT_ESCALATION_KEYWORDS:
+            self._trie.add(keyword, None)
+        self._patterns = [
+            (re.compile(pattern, re.IGNORECASE), rule.name)
+            for rule in self.rules.values()
+            for pattern in rule.patterns
+        ]
+
+        self._lock = threading.Lock()
+        self._stats = {"total": 0, "local": 0, "llm": 0, "local_seconds": 0.0, "llm_seconds": 0.0}
+        # 同一规则、同一产品信息的回复只渲染一次
+        self._answer = functools.lru_cache(maxsize=int(os.getenv("INTENT_ROUTER_ANSWER_CACHE", "256")))(self._render)
+
+    def _render(self, rule_name, product_info):
+        return self.rules[rule_name].answer.format(product_info=product_info)
+
+    def classify(self, message):
+        """返回 (规则, 置信度)；没有命中、命中多个意图或需要升级时规则为 None"""
+        message = message.strip()
+        if not message or len(message) > self.max_chars:
+            return None, 0.0
+        matched = self._trie.find(message)
+        matched.update(name for pattern, name in self._patterns if pattern.search(message))
+        if None in matched:
+            return None, 0.0
+        if len(matched) > 1:
+            matched = {name for name in matched if not self.rules[name].courtesy}
+        if len(matched) != 1:
+            return None, 0.0
+        # 多个问句通常包含多个诉求
+        if len(re.findall(r"[?？]", message)) > 1:
+            return None, 0.0
+        rule = self.rules[matched.pop()]
+        return rule, rule.confidence
+
+    def route(self, inputs):
+        """返回本地生成的回复，需要模型处理时返回 None"""
+        rule, confidence = self.classify(inputs.get("user_message", ""))
+        if rule is None or confidence < self.min_confidence:
+            return None
+        response = self._answer(rule.name, inputs.get("product_info") or "")
+        if not response.strip():
+            # 例如价格、试用规则的回复只有产品信息，没有产品信息时交给模型
+            return None
+        return self.response_type(
+            intent=rule.intent,
+            confidence=confidence,
+            action=rule.action,
+            response=response,
+        )
+
+    def _record(self, path, seconds):
+        with self._lock:
+            self._stats["total"] += 1
+            self._stats[path] += 1
+            self._stats[f"{path}_seconds"] += seconds
+
+    def wrap(self, chain):
+        """在 chain 前面加上本地预路由，输入输出与 chain 相同"""
+        def record_llm(run):
+            self._record("llm", (run.end_time - run.start_time).total_seconds())
+
+        timed_chain = chain.with_listeners(on_end=record_llm)
+
+        def route(inputs):
+            started = time.perf_counter()
+            response = self.route(inputs)
+            if response is None:
+                # 返回 Runnable 时 RunnableLambda 会继续执行它，流式输出逐块传递
+                return timed_chain
+            self._record("local", time.perf_counter() - started)
+            return response
+
+        return RunnableLambda(route, name="intent_router")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        local, llm = stats["local"], stats["llm"]
+        avg_local = stats["local_seconds"] / local if local else 0.0
+        avg_llm = stats["llm_seconds"] / llm if llm else None
+        stats["local_ratio"] = local / stats["total"] if stats["total"] else 0.0
+        stats["avg_local_ms"] = avg_local * 1000
+        stats["avg_llm_ms"] = None if avg_llm is None else avg_llm * 1000
+        # 本地处理的每条消息按模型的平均时延估算节省的时间
+        stats["saved_seconds"] = None if avg_llm is None else local * (avg_llm - avg_local)
+        return stats
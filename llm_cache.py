@@ -0,0 +1,192 @@
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessageChunk
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+from pathlib import Path
+import threading
+import warnings
+import zstandard
+import xxhash
+import json
+import time
+import os
+
+# 加载环境变量
+load_dotenv()
+
+# 基于 SQLite 的精确匹配响应缓存：键是模型、参数和序列化后消息的 xxhash，
+# 值是 zstd 压缩后的生成结果。支持 TTL、条目数和总大小两种淘汰方式，
+# 并统计命中/未命中次数。通过 model_factory.get_chat_model(cached=True) 接入
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    payload BLOB NOT NULL
+)
+"""
+
+
+def _default_cache_path():
+    return Path(os.getenv("LLM_CACHE_PATH", "") or Path.home() / ".cache" / "ai_agent" / "llm_cache.sqlite3")
+
+
+class SQLiteResponseCache(BaseCache):
+    """持久化的 LLM 响应缓存"""
+
+    def __init__(self, path=None, ttl=None, max_entries=None, max_bytes=None, compression_level=None):
+        self.path = Path(path or _default_cache_path())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl or float(os.getenv("LLM_CACHE_TTL", "86400"))
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+        self.max_bytes = max_bytes or int(float(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+        level = compression_level or int(os.getenv("LLM_CACHE_ZSTD_LEVEL", "3"))
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+
+        self.engine = create_engine(
+            f"sqlite:///{self.path}",
+            connect_args={"check_same_thread": False},
+        )
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            conn.exec_driver_sql(_SCHEMA)
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    @staticmethod
+    def make_key(prompt, llm_string):
+        # llm_string 包含模型名和调用参数，prompt 是序列化后的消息列表
+        return xxhash.xxh3_128_hexdigest(f"{llm_string}\0{prompt}")
+
+    def lookup(self, prompt, llm_string):
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                text("SELECT created_at, payload FROM llm_cache WHERE key = :key"), {"key": key}
+            ).first()
+            if row is not None and now - row.created_at > self.ttl:
+                conn.execute(text("DELETE FROM llm_cache WHERE key = :key"), {"key": key})
+                row = None
+            if row is not None:
+                conn.execute(
+                    text("UPDATE llm_cache SET accessed_at = :now WHERE key = :key"),
+                    {"now": now, "key": key},
+                )
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        with warnings.catch_warnings():
+            # langchain_core.load.loads 仍标记为 beta，这里只反序列化自己写入的数据
+            warnings.simplefilter("ignore")
+            return loads(self._decompressor.decompress(row.payload).decode("utf-8"))
+
+    def update(self, prompt, llm_string, return_val):
+        # 命中缓存不消耗 token，存储时去掉 usage_metadata，避免命中后重复统计用量
+        return_val = [
+            generation.model_copy(update={"message": generation.message.model_copy(update={"usage_metadata": None})})
+            if getattr(getattr(generation, "message", None), "usage_metadata", None) else generation
+            for generation in return_val
+        ]
+        payload = self._compressor.compress(dumps(return_val).encode("utf-8"))
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT OR REPLACE INTO llm_cache (key, created_at, accessed_at, size, payload) "
+                    "VALUES (:key, :now, :now, :size, :payload)"
+                ),
+                {"key": self.make_key(prompt, llm_string), "now": now, "size": len(payload), "payload": payload},
+            )
+
+        with self._lock:
+            self._writes += 1
+            # 每写入一定次数才做一次淘汰，避免每次写入都扫表
+            should_evict = self._writes % 50 == 1
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """删除过期条目，并按最近访问时间淘汰超出条目数或总大小上限的条目"""
+        with self.engine.begin() as conn:
+            removed = conn.execute(
+                text("DELETE FROM llm_cache WHERE created_at < :deadline"),
+                {"deadline": time.time() - self.ttl},
+            ).rowcount
+            removed += conn.execute(
+                text(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    " SELECT key FROM ("
+                    "  SELECT key,"
+                    "   ROW_NUMBER() OVER (ORDER BY accessed_at DESC) AS rank,"
+                    "   SUM(size) OVER (ORDER BY accessed_at DESC) AS total"
+                    "  FROM llm_cache"
+                    " ) WHERE rank > :max_entries OR total > :max_bytes"
+                    ")"
+                ),
+                {"max_entries": self.max_entries, "max_bytes": self.max_bytes},
+            ).rowcount
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self, **kwargs):
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM llm_cache"))
+
+    def stats(self):
+        with self.engine.connect() as conn:
+            entries, size = conn.execute(text("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache")).one()
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+def replay_chunks(message, chunk_size=None):
+    """把缓存的完整消息拆成 AIMessageChunk 序列，按流式响应的形式回放"""
+    chunk_size = chunk_size or int(os.getenv("LLM_CACHE_REPLAY_CHUNK", "16"))
+    content = message.content if isinstance(message.content, str) else ""
+    # 第一个分片携带工具调用和元数据，其余分片只有文本
+    tool_call_chunks = [
+        {"name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False), "id": call["id"], "index": index}
+        for index, call in enumerate(getattr(message, "tool_calls", None) or [])
+    ]
+    yield AIMessageChunk(
+        content=content[:chunk_size] if isinstance(message.content, str) else message.content,
+        id=message.id,
+        tool_call_chunks=tool_call_chunks,
+        additional_kwargs={k: v for k, v in message.additional_kwargs.items() if k != "tool_calls"},
+        response_metadata=message.response_metadata,
+    )
+    for start in range(chunk_size, len(content), chunk_size):
+        yield AIMessageChunk(content=content[start:start + chunk_size], id=message.id)
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_response_cache():
+    """进程内共享的响应缓存实例"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = SQLiteResponseCache()
+        return _shared_cache
@@ -1,94 +1,156 @@
-# Create server parameters for stdio connection
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from langchain_mcp_adapters.tools import load_mcp_tools
-from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, ToolMessage
 import asyncio
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import AgentExecutor, create_openai_tools_agent
 from dotenv import load_dotenv
+import sys
 import os
+
+# 让 mcp 目录下的脚本可以引用项目根目录的公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_factory import get_chat_model
+from mcp_session_pool import MCPSessionPool
+from tool_result_cache import get_tool_result_cache
+from metrics import instrument_tools, profiled
+from tool_prefetch import get_tool_prefetcher
+from tool_result_compactor import get_tool_result_compactor
+from tool_selector import get_tool_selector
 # 加载环境变量
 load_dotenv()
 
-# 最朴素的方式，把工具列表发送给 LLM，根据 LLM 返回需要调用的工具，然后手动调用工具，并把工具结果发送给模型，模型返回最终结果
-
-base_params = {
-    "model": os.getenv("OPENAI_MODEL", ""),
-    "temperature": 0.1,
-    "streaming": True,
-    "openai_api_key": os.getenv("OPENAI_API_KEY", ""),
-    "openai_api_base": os.getenv("OPENAI_API_BASE", ""),
-}
-model = ChatOpenAI(**base_params)
-
-
-server_params = StdioServerParameters(
-    command="uvx",
-    # Make sure to update to the full absolute path to your math_server.py file
-    args=["mcp-server-tapd"],
-    env={
-        "TAPD_ACCESS_TOKEN": os.getenv("TAPD_ACCESS_TOKEN", ""),
-        "TAPD_API_BASE_URL": os.getenv("TAPD_API_BASE_URL", ""),
-        "TAPD_BASE_URL": os.getenv("TAPD_BASE_URL", ""),
-        "CURRENT_USER_NICK": os.getenv("CURRENT_USER_NICK", ""),
-        "BOT_URL": os.getenv("BOT_URL", "")
-    }
-)
-
-async def run_agent():
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            # Initialize the connection
-            await session.initialize()
-
-            # Get tools
-            tools = await load_mcp_tools(session)
-            # 直接绑定工具到模型
-            model_with_tools = model.bind_tools(tools)
-            
-              # 第一轮：调用模型
-            messages = [HumanMessage(content="获取我参与的项目，只返回项目名称列表，不要返回其他内容")]
+# 最朴素的方式，把工具列表发送给 LLM，根据 LLM 返回需要调用的工具，然后手动并发调用工具，并把工具结果发送给模型，循环直到模型返回最终结果
+
+model = get_chat_model()
+# 只读 TAPD 工具的结果缓存，同一进程内的多次查询共享
+tool_cache = get_tool_result_cache()
+# 第一轮模型调用的同时预取可能的第一个工具调用（例如当前用户参与的项目）
+prefetcher = get_tool_prefetcher()
+# 工具结果按工具投影字段、截断长列表后再交给模型，后续轮次的提示保持精简
+compactor = get_tool_result_compactor()
+
+
+# 单次查询最多的模型轮数，以及单个工具调用的超时时间（秒）
+MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "8"))
+TOOL_TIMEOUT = float(os.getenv("AGENT_TOOL_TIMEOUT", "30"))
+
+
+async def call_tool(tool_index, tool_call):
+    """执行单个工具调用，超时和异常都转换成 ToolMessage 交还给模型"""
+    tool_name = tool_call["name"]
+    tool = tool_index.get(tool_name)
+    if tool is None:
+        return ToolMessage(
+            content=f"未找到工具: {tool_name}",
+            tool_call_id=tool_call["id"],
+            name=tool_name,
+            status="error",
+        )
+
+    print(f"执行工具: {tool_name}")
+    try:
+        # 传入完整的 tool_call，工具会直接返回带 tool_call_id 的 ToolMessage
+        return await asyncio.wait_for(tool.ainvoke(tool_call), TOOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        content = f"工具 {tool_name} 执行超时（{TOOL_TIMEOUT} 秒）"
+    except Exception as e:
+        content = f"工具 {tool_name} 执行失败: {e}"
+    return ToolMessage(
+        content=content,
+        tool_call_id=tool_call["id"],
+        name=tool_name,
+        status="error",
+    )
+
+
+async def execute_tool_calls(tool_index, tool_calls):
+    """并发执行同一轮里的所有工具调用，结果顺序与 tool_calls 一致"""
+    return await asyncio.gather(*(call_tool(tool_index, tool_call) for tool_call in tool_calls))
+
+
+async def agent_loop(model_with_tools, tool_index, messages, first_response=None, selector=None, names=None):
+    """循环调用模型和工具，直到模型不再调用工具或达到轮数上限
+
+    first_response 为已经提前发起的第一轮模型调用任务（可选）；
+    names 为 model_with_tools 绑定的工具子集，每轮拿到工具结果后按结果重新选择，
+    模型请求了子集外的工具时改为绑定全部工具
+    """
+    fallback = False
+    for _ in range(MAX_ITERATIONS):
+        if selector is not None:
+            selector.record_call(names, fallback)
+        if first_response is not None:
+            result, first_response = await first_response, None
+        else:
             result = await model_with_tools.ainvoke(messages)
-            
-            # 检查是否有工具调用
-            if result.tool_calls:
-                print("检测到工具调用，正在执行...")
-                
-                # 执行工具调用
-                tool_results = []
-                for tool_call in result.tool_calls:
-                    tool_name = tool_call['name']
-                    tool_args = tool_call['args']
-                    
-                    # 找到对应的工具
-                    for tool in tools:
-                        if tool.name == tool_name:
-                            print(f"执行工具: {tool_name}")
-                            tool_result = await tool.ainvoke(tool_args)
-                            tool_results.append(tool_result)
-                            break
-                
-                # 第二轮：将工具结果发送给模型
-                if tool_results:
-                    # 添加工具结果到消息列表
-                    new_messages = messages + [result] + [
-                        ToolMessage(
-                            content=str(tool_results[0]),  # 假设只有一个工具调用
-                            tool_call_id=result.tool_calls[0]['id']
-                        )
-                    ]
-                    print("将工具结果发送给模型...")
-                    final_result = await model_with_tools.ainvoke(new_messages)
-                    return final_result
-            
+        messages.append(result)
+        if not result.tool_calls:
             return result
+        if selector is not None and selector.missing(result.tool_calls, names):
+            # 工具仍然可以执行，之后的轮次绑定全部工具
+            names, fallback = None, True
+            model_with_tools = model.bind_tools(list(tool_index.values()))
+
+        print(f"检测到 {len(result.tool_calls)} 个工具调用，正在并发执行...")
+        messages.extend(await execute_tool_calls(tool_index, result.tool_calls))
+        if selector is not None and names is not None:
+            # 按工具结果重新选择，结果里提到的工具在下一轮也能用上
+            selected = selector.select_messages(messages)
+            if selected != names:
+                names = selected
+                model_with_tools = model.bind_tools(selector.subset(list(tool_index.values()), names))
+        print("将工具结果发送给模型...")
+
+    print(f"达到最大轮数 {MAX_ITERATIONS}，停止调用工具")
+    return result
+
+
+# 演示查询
+DEFAULT_QUERY = "获取我参与的项目，只返回项目名称列表，不要返回其他内容"
+
+
+# 按 PROFILE_SAMPLE_RATE 抽样分析慢查询
+@profiled("langchain_agent")
+async def run_agent(pool, query=DEFAULT_QUERY):
+    messages = [HumanMessage(content=query)]
+    model_with_tools = None
+    first_response = None
+    selector = names = None
+    tool_specs = pool.catalog.tool_specs()
+    if tool_specs:
+        # 有缓存的工具目录时直接绑定，第一轮模型调用不必等待会话借出和 MCP 握手；
+        # 只绑定与查询相关的工具子集
+        selector = get_tool_selector(tool_specs)
+        names = selector.select(query)
+        model_with_tools = model.bind_tools(selector.subset(tool_specs, names))
+        first_response = asyncio.create_task(model_with_tools.ainvoke(list(messages)))
+
+    try:
+        # 从会话池借出一个已初始化的会话，工具在会话启动时已经加载好
+        async with pool.session() as slot:
+            if model_with_tools is None:
+                # 直接绑定与查询相关的工具子集到模型
+                selector = get_tool_selector(slot.tools)
+                names = selector.select(query)
+                model_with_tools = model.bind_tools(selector.subset(slot.tools, names))
+            tools = compactor.wrap_tools(tool_cache.wrap_tools(instrument_tools(slot.tools)))
+            async with prefetcher.start(tools, query) as prefetch:
+                tool_index = {tool.name: tool for tool in prefetch.wrap_tools(tools)}
+                return await agent_loop(model_with_tools, tool_index, messages, first_response, selector, names)
+    finally:
+        if first_response is not None and not first_response.done():
+            first_response.cancel()
+
+
+async def main(query=DEFAULT_QUERY):
+    # 会话池在整个进程内常驻，多次查询复用同一批 MCP Server；
+    # 这里只在后台启动会话池，握手期间就可以开始第一轮模型调用
+    pool = MCPSessionPool().launch()
+    try:
+        return await run_agent(pool, query)
+    finally:
+        await pool.close()
 
 # Run the async function
 if __name__ == "__main__":
-    result = asyncio.run(run_agent())
+    result = asyncio.run(main())
     # 最简单的方法：直接获取最后一个有内容的 AI 消息
     print("AI 最终内容：", result.content)
     # print(result)
\ No newline at end of file
@@ -1,58 +1,97 @@
-# Create server parameters for stdio connection
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from langchain_mcp_adapters.tools import load_mcp_tools
 from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
 import asyncio
 from dotenv import load_dotenv
+import uuid
+import sys
 import os
+
+# 让 mcp 目录下的脚本可以引用项目根目录的公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_factory import get_chat_model
+from mcp_session_pool import MCPSessionPool
+from tool_result_cache import get_tool_result_cache
+from metrics import instrument_tools, profiled
+from tool_prefetch import get_tool_prefetcher
+from tool_result_compactor import get_tool_result_compactor
+from tool_selector import get_tool_selector, selecting_model
+from sqlite_checkpointer import get_checkpointer
 # 加载环境变量
 load_dotenv()
 
 # 使用 langgraph 的 react agent，组合 tapd 的 mcp server
 
-base_params = {
-    "model": os.getenv("OPENAI_MODEL", ""),
-    "temperature": 0.1,
-    "streaming": True,
-    "openai_api_key": os.getenv("OPENAI_API_KEY", ""),
-    "openai_api_base": os.getenv("OPENAI_API_BASE", ""),
-}
-model = ChatOpenAI(**base_params)
-
-
-server_params = StdioServerParameters(
-    command="uvx",
-    # Make sure to update to the full absolute path to your math_server.py file
-    args=["mcp-server-tapd"],
-    env={
-        "TAPD_ACCESS_TOKEN": os.getenv("TAPD_ACCESS_TOKEN", ""),
-        "TAPD_API_BASE_URL": os.getenv("TAPD_API_BASE_URL", ""),
-        "TAPD_BASE_URL": os.getenv("TAPD_BASE_URL", ""),
-        "CURRENT_USER_NICK": os.getenv("CURRENT_USER_NICK", ""),
-        "BOT_URL": os.getenv("BOT_URL", "")
-    }
-)
-
-async def run_agent():
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            # Initialize the connection
-            await session.initialize()
-
-            # Get tools
-            tools = await load_mcp_tools(session)
-            # print(tools)
+model = get_chat_model()
+# 只读 TAPD 工具的结果缓存，同一进程内的多次查询共享
+tool_cache = get_tool_result_cache()
+# 第一轮模型调用的同时预取可能的第一个工具调用（例如当前用户参与的项目）
+prefetcher = get_tool_prefetcher()
+# 工具结果按工具投影字段、截断长列表后再交给模型，后续轮次的提示保持精简
+compactor = get_tool_result_compactor()
+# 每一步的状态持久化到 SQLite，中断后按 thread_id 从最后完成的步骤继续
+checkpointer = get_checkpointer()
+
+
+# 演示查询
+DEFAULT_QUERY = "获取我参与的项目，只返回项目名称列表，不要返回其他内容"
+
+
+def new_thread_id():
+    return uuid.uuid4().hex
+
+
+def _thread_config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+# 按 PROFILE_SAMPLE_RATE 抽样分析慢查询
+@profiled("langgraph_agent")
+async def run_agent(pool, query=DEFAULT_QUERY, thread_id=None):
+    """在会话 thread_id 中执行一次查询，同一会话的后续提问会带上之前的对话
+
+    如果该会话上次的执行被中断，先从最后完成的步骤继续执行完，再处理新的查询
+    """
+    config = _thread_config(thread_id or new_thread_id())
+    # 从会话池借出一个已初始化的会话，工具列表在会话启动时已经加载好
+    async with pool.session() as slot:
+        tools = compactor.wrap_tools(tool_cache.wrap_tools(instrument_tools(slot.tools)))
+        # 预取与第一轮模型调用同时进行，模型请求相同的调用时直接拿到结果
+        async with prefetcher.start(tools, query) as prefetch:
+            tools = prefetch.wrap_tools(tools)
             # Create and run the agent
-            agent = create_react_agent(model, tools)
-            agent_response = await agent.ainvoke({"messages": "获取我参与的项目，只返回项目名称列表，不要返回其他内容"})
-            return agent_response
+            # 每轮模型调用只绑定与用户问题相关的工具子集，工具节点仍然可以执行全部工具
+            agent_model = selecting_model(model, tools, get_tool_selector(tools))
+            agent = create_react_agent(agent_model, tools, checkpointer=checkpointer)
+            if checkpointer is not None and (await agent.aget_state(config)).next:
+                await agent.ainvoke(None, config)
+            agent_response = await agent.ainvoke({"messages": query}, config)
+        return agent_response
+
+
+async def resume_agent(pool, thread_id):
+    """从最后完成的步骤继续执行被中断的会话，已完成的模型调用和工具调用不会重做"""
+    config = _thread_config(thread_id)
+    async with pool.session() as slot:
+        tools = compactor.wrap_tools(tool_cache.wrap_tools(instrument_tools(slot.tools)))
+        agent_model = selecting_model(model, tools, get_tool_selector(tools))
+        agent = create_react_agent(agent_model, tools, checkpointer=checkpointer)
+        state = await agent.aget_state(config)
+        if not state.next:
+            # 会话已经执行完，直接返回最终状态
+            return state.values
+        return await agent.ainvoke(None, config)
+
+
+async def main(thread_id=None, query=DEFAULT_QUERY):
+    # 会话池在整个进程内常驻，多次查询复用同一批 MCP Server
+    async with MCPSessionPool() as pool:
+        return await run_agent(pool, query, thread_id=thread_id)
 
 # Run the async function
 if __name__ == "__main__":
-    result = asyncio.run(run_agent())
+    # 传入上次打印的会话 ID 可以继续之前的会话（包括被中断的执行）
+    thread_id = sys.argv[1] if len(sys.argv) > 1 else new_thread_id()
+    print("会话 ID：", thread_id)
+    result = asyncio.run(main(thread_id))
     # 最简单的方法：直接获取最后一个有内容的 AI 消息
     ai_final_content = result['messages'][-1].content if result and 'messages' in result else None
     print("AI 最终内容：", ai_final_content)
@@ -0,0 +1,222 @@
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+from dotenv import load_dotenv
+from tool_catalog_cache import ToolCatalogCache
+from metrics import get_metrics
+import contextlib
+import logging
+import asyncio
+import shlex
+import time
+import os
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 常驻的 MCP 会话池：启动时拉起若干个已初始化的 mcp-server-tapd 会话，
+# 请求从池里借出会话、用完归还，避免每次查询都付出 uvx 解析、进程启动、
+# initialize 和加载工具的冷启动开销。工具目录由 ToolCatalogCache 持久化缓存
+
+
+def build_server_params():
+    """根据环境变量创建 TAPD MCP Server 的启动参数"""
+    command = shlex.split(os.getenv("TAPD_MCP_COMMAND", "") or "uvx mcp-server-tapd")
+    return StdioServerParameters(
+        command=command[0],
+        args=command[1:],
+        env={
+            "TAPD_ACCESS_TOKEN": os.getenv("TAPD_ACCESS_TOKEN", ""),
+            "TAPD_API_BASE_URL": os.getenv("TAPD_API_BASE_URL", ""),
+            "TAPD_BASE_URL": os.getenv("TAPD_BASE_URL", ""),
+            "CURRENT_USER_NICK": os.getenv("CURRENT_USER_NICK", ""),
+            "BOT_URL": os.getenv("BOT_URL", ""),
+        },
+    )
+
+
+class MCPSessionSlot:
+    """池中的一个会话槽位，由独立的后台任务负责启动、守护和重启 MCP Server"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.session = None
+        self.tools = []
+        self.tool_index = {}
+        self.catalog_version = 0
+        self.restarts = 0
+        self.last_checked = 0.0
+        self._ready = asyncio.Event()
+        self._restart = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name=f"mcp-session-{self.index}")
+
+    async def _run(self):
+        # stdio_client 和 ClientSession 的上下文必须在同一个任务里进入和退出，
+        # 所以每个槽位都在自己的任务里持有连接，其他任务只借用 session
+        backoff = 1.0
+        while not self.pool.closing:
+            # 在握手之前清除重启信号，握手期间 stop() 发出的信号不会被覆盖
+            self._restart.clear()
+            try:
+                # 启动耗时包括拉起 MCP Server 进程、initialize 和加载工具
+                started = time.perf_counter()
+                async with stdio_client(self.pool.server_params) as (read, write):
+                    async with ClientSession(read, write) as session:
+                        init_result = await session.initialize()
+                        tools = await self.pool.catalog.load_tools(session, init_result.serverInfo.version)
+                        elapsed = time.perf_counter() - started
+                        get_metrics().observe("mcp_session_setup_seconds", elapsed)
+                        logger.info("MCP 会话 %s 就绪，耗时 %.2fs，工具数 %s", self.index, elapsed, len(tools))
+                        self.session = session
+                        self._set_tools(tools)
+                        self.last_checked = time.monotonic()
+                        self._ready.set()
+                        backoff = 1.0
+                        if not self.pool.closing:
+                            await self._restart.wait()
+            except Exception:
+                if self.pool.closing:
+                    # 关闭会话池时连接被中断，不算异常，也不再退避等待
+                    break
+                get_metrics().inc("mcp_session_failures")
+                logger.exception("MCP 会话 %s 异常退出，%.0fs 后重启", self.index, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                self._ready.clear()
+                self.session = None
+
+            if not self.pool.closing:
+                self.restarts += 1
+
+    def _set_tools(self, tools):
+        self.tools = tools
+        self.tool_index = {tool.name: tool for tool in tools}
+        self.catalog_version = self.pool.catalog.version
+
+    def sync_tools(self):
+        """工具目录在后台校验后发生变化时，用新的定义重建本会话的工具"""
+        if self.session is not None and self.catalog_version != self.pool.catalog.version:
+            self._set_tools(self.pool.catalog.build_tools(self.session))
+
+    async def wait_ready(self, timeout):
+        if self._task is None or self._task.done():
+            # 守护任务意外结束时重新拉起
+            self.start()
+        await asyncio.wait_for(self._ready.wait(), timeout)
+
+    def restart(self):
+        """通知守护任务关闭当前连接并重新启动 MCP Server"""
+        self._ready.clear()
+        self._restart.set()
+
+    async def check_health(self, timeout):
+        """用 ping 检查会话是否存活，失败时触发重启"""
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout)
+        except Exception:
+            logger.warning("MCP 会话 %s 健康检查失败，正在重启", self.index)
+            self.restart()
+            return False
+        self.last_checked = time.monotonic()
+        return True
+
+    async def stop(self, timeout=10.0):
+        self._restart.set()
+        if self._task is not None:
+            # 正在退避等待重启的任务不会响应关闭信号，超时后直接取消
+            with contextlib.suppress(Exception, asyncio.CancelledError):
+                await asyncio.wait_for(self._task, timeout)
+
+
+class MCPSessionPool:
+    """可借出/归还的 MCP 会话池"""
+
+    def __init__(
+        self,
+        server_params=None,
+        size=None,
+        health_check_interval=None,
+        ping_timeout=None,
+        startup_timeout=None,
+    ):
+        self.server_params = server_params or build_server_params()
+        self.catalog = ToolCatalogCache(self.server_params)
+        self.size = size or int(os.getenv("MCP_POOL_SIZE", "1"))
+        # 会话空闲超过该时间（秒）后，借出前先 ping 一次
+        self.health_check_interval = health_check_interval or float(
+            os.getenv("MCP_POOL_HEALTH_CHECK_INTERVAL", "30")
+        )
+        self.ping_timeout = ping_timeout or float(os.getenv("MCP_POOL_PING_TIMEOUT", "5"))
+        self.startup_timeout = startup_timeout or float(os.getenv("MCP_POOL_STARTUP_TIMEOUT", "60"))
+        self.closing = False
+        self.slots = []
+        self._idle = None
+
+    def launch(self):
+        """在后台启动所有槽位，不等待初始化完成"""
+        self.closing = False
+        self._idle = asyncio.Queue()
+        self.slots = [MCPSessionSlot(self, index) for index in range(self.size)]
+        for slot in self.slots:
+            slot.start()
+            self._idle.put_nowait(slot)
+        return self
+
+    async def start(self):
+        """启动所有槽位并等待它们完成初始化"""
+        self.launch()
+        await asyncio.gather(*(slot.wait_ready(self.startup_timeout) for slot in self.slots))
+        return self
+
+    async def close(self):
+        self.closing = True
+        await asyncio.gather(*(slot.stop() for slot in self.slots))
+        self.slots = []
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _checkout(self):
+        slot = await self._idle.get()
+        try:
+            for _ in range(3):
+                await slot.wait_ready(self.startup_timeout)
+                if (
+                    time.monotonic() - slot.last_checked < self.health_check_interval
+                    or await slot.check_health(self.ping_timeout)
+                ):
+                    slot.sync_tools()
+                    return slot
+            raise RuntimeError(f"MCP 会话 {slot.index} 多次重启后仍不可用")
+        except BaseException:
+            self._idle.put_nowait(slot)
+            raise
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """借出一个已初始化的会话槽位，退出上下文时自动归还"""
+        slot = await self._checkout()
+        try:
+            yield slot
+        except Exception:
+            # 使用过程中出错时，下次借出前强制做一次健康检查
+            slot.last_checked = 0.0
+            raise
+        finally:
+            self._idle.put_nowait(slot)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "restarts": sum(slot.restarts for slot in self.slots),
+        }
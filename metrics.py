@@ -0,0 +1,338 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from contextvars import ContextVar
+from collections import deque
+from bisect import bisect_left
+from dotenv import load_dotenv
+import contextlib
+import threading
+import asyncio
+import inspect
+import functools
+import logging
+import cProfile
+import pstats
+import random
+import atexit
+import orjson
+import time
+import os
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 热路径埋点：模型调用时长、TTFT、prompt/completion/缓存 token 数、解析器耗时
+# （通过全局注册的回调处理器，所有链和模型自动记录），MCP 工具按工具名的执行时长
+# （包装工具），以及 MCP 会话启动耗时。每个指标保留最近 METRICS_WINDOW 个观测值的
+# 环形缓冲区用于计算分位数，另有累计的分桶计数，可以导出为 Prometheus 文本或 JSON 快照。
+# 慢请求可以按比例抽样用 cProfile 分析
+
+PREFIX = "ai_agent_"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+
+class Histogram:
+    """累计分桶计数 + 最近观测值的环形缓冲区"""
+
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self, points=(0.5, 0.9, 0.99)):
+        values = sorted(self.recent)
+        if not values:
+            return {}
+        return {f"p{int(point * 100)}": values[min(int(point * len(values)), len(values) - 1)] for point in points}
+
+
+class MetricsRegistry:
+    """按 (指标名, 标签) 保存直方图和计数器"""
+
+    def __init__(self, window=None):
+        self.window = window or int(os.getenv("METRICS_WINDOW", "1024"))
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, metric, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets, self.window)
+            histogram.observe(value)
+
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, metric, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(metric, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        """JSON 快照：每个直方图的次数、总和、均值和最近窗口的分位数"""
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+        result = {"timestamp": time.time(), "histograms": {}, "counters": {}}
+        for (name, labels), histogram in histograms:
+            result["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                **histogram.quantiles(),
+            })
+        for (name, labels), value in counters:
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return result
+
+    def prometheus(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            counters = sorted(self._counters.items(), key=lambda item: item[0])
+
+        lines = []
+        declared = set()
+        for (name, labels), histogram in histograms:
+            metric = PREFIX + name
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.bucket_counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            metric = PREFIX + name
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}_total{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path):
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(self.snapshot(), option=orjson.OPT_INDENT_2))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _labels(labels, **extra):
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in items
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    """进程内共享的指标注册表"""
+    return _registry
+
+
+def _model_name(serialized, kwargs):
+    metadata = kwargs.get("metadata") or {}
+    if metadata.get("ls_model_name"):
+        return metadata["ls_model_name"]
+    return ((serialized or {}).get("kwargs") or {}).get("model_name", "unknown")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """记录模型调用和解析器的耗时与 token 用量"""
+
+    # 直接在事件循环里执行，避免每个 token 都切换到线程池
+    run_inline = True
+
+    def __init__(self, registry):
+        self.registry = registry
+        # run_id -> [开始时间, 首 token 时间, 模型名或解析器名]
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), None, _model_name(serialized, kwargs)]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), None, _model_name(serialized, kwargs)]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run[1] is None and token:
+            run[1] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        started, first_token, model = run
+        usage = None
+        cache_hit = False
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or usage
+                cache_hit = cache_hit or bool((getattr(message, "response_metadata", None) or {}).get("llm_cache_hit"))
+        # 命中本地响应缓存的调用只有 total_cost=0（流式回放带 llm_cache_hit 标记），没有 token 用量，
+        # 只计数，不计入时延分布
+        if cache_hit or (usage and "input_tokens" not in usage):
+            self.registry.inc("llm_cache_hits", model=model)
+            return
+
+        self.registry.observe("llm_call_seconds", time.perf_counter() - started, model=model)
+        if first_token is not None:
+            self.registry.observe("llm_ttft_seconds", first_token - started, model=model)
+        if not usage:
+            return
+        details = usage.get("input_token_details") or {}
+        self.registry.observe("llm_prompt_tokens", usage["input_tokens"], TOKEN_BUCKETS, model=model)
+        self.registry.observe("llm_completion_tokens", usage.get("output_tokens", 0), TOKEN_BUCKETS, model=model)
+        self.registry.observe("llm_cached_tokens", details.get("cache_read", 0) or 0, TOKEN_BUCKETS, model=model)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        model = run[2] if run else "unknown"
+        self.registry.inc("llm_errors", model=model, error=type(error).__name__)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        # 输出解析器以 run_type="parser" 运行，只记录解析器，不记录每一层链
+        if kwargs.get("run_type") == "parser":
+            self._runs[run_id] = [time.perf_counter(), None, kwargs.get("name") or "parser"]
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.registry.observe("parser_seconds", time.perf_counter() - run[0], parser=run[2])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+def instrument_tool(tool, registry=None):
+    """返回记录执行时长的工具副本，按工具名和结果状态（ok/error/timeout）分别统计"""
+    registry = registry or _registry
+    coroutine = tool.coroutine
+
+    async def timed_call(**arguments):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await coroutine(**arguments)
+            status = "ok"
+            return result
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            status = "timeout"
+            raise
+        finally:
+            registry.observe("tool_call_seconds", time.perf_counter() - started, tool=tool.name, status=status)
+
+    return tool.model_copy(update={"coroutine": timed_call})
+
+
+def instrument_tools(tools, registry=None):
+    return [instrument_tool(tool, registry) for tool in tools]
+
+
+# 全局注册回调处理器：设置了这个上下文变量后，所有 Runnable 调用都会自动带上它
+_handler_var = ContextVar(
+    "ai_agent_metrics_handler",
+    default=MetricsCallbackHandler(_registry)
+    if os.getenv("METRICS_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+    else None,
+)
+register_configure_hook(_handler_var, inheritable=True)
+
+# 进程退出时把快照写到 METRICS_SNAPSHOT_PATH，便于脚本运行后查看
+if os.getenv("METRICS_SNAPSHOT_PATH", "").strip():
+    atexit.register(_registry.write_snapshot, os.getenv("METRICS_SNAPSHOT_PATH").strip())
+
+
+# cProfile 同一时间只能有一个在运行
+_profiling = threading.Lock()
+
+
+@contextlib.contextmanager
+def profile_if_slow(name, sample_rate=None, threshold=None):
+    """按 PROFILE_SAMPLE_RATE 的比例抽样用 cProfile 分析，耗时超过 PROFILE_SLOW_SECONDS 时
+    把结果写到 PROFILE_DIR；未抽中时几乎没有开销
+
+    cProfile 记录的是整个线程：包住 await 时，等待期间事件循环上其他协程的调用也会计入。
+    只在同一时间只处理一个请求时使用（服务要求 SERVICE_MAX_CONCURRENCY=1）
+    """
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0")) if sample_rate is None else sample_rate
+    if sample_rate <= 0 or random.random() >= sample_rate or not _profiling.acquire(blocking=False):
+        yield
+        return
+
+    threshold = float(os.getenv("PROFILE_SLOW_SECONDS", "2.0")) if threshold is None else threshold
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profiling.release()
+        duration = time.perf_counter() - started
+        if duration >= threshold:
+            _dump_profile(profiler, name, duration)
+
+
+def _dump_profile(profiler, name, duration):
+    directory = os.getenv("PROFILE_DIR", "") or os.path.join(os.path.expanduser("~"), ".cache", "ai_agent", "profiles")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    # 最耗时函数的文本摘要写在 .prof 旁边，日志里只记录路径
+    with open(path[:-len(".prof")] + ".txt", "w", encoding="utf-8") as output:
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+    logger.warning("%s 耗时 %.2fs，cProfile 结果已保存到 %s", name, duration, path)
+    _registry.inc("slow_requests_profiled", name=name)
+
+
+def profiled(name):
+    """profile_if_slow 的装饰器形式，同时支持同步和异步函数"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with profile_if_slow(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_if_slow(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,348 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import merge_configs
+from pydantic import ValidationError
+from types import SimpleNamespace
+from dotenv import load_dotenv
+import threading
+import asyncio
+import openai
+import logging
+import time
+import os
+
+from model_factory import get_chat_model
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 模型级联：先用便宜、快速的 CASCADE_MODEL 执行链，结果置信度低于阈值、JSON 校验失败
+# 或者需要转人工时，再用 OPENAI_MODEL 重新执行。阈值可以按链配置。
+# 统计升级比例、两级模型各自的平均时延和成本，估算相对全部使用强模型节省的时延和成本。
+# 没有配置 CASCADE_MODEL 时只使用强模型，链的行为与原来一致
+
+# 便宜模型的输出无法解析或不符合 schema 时升级
+INVALID_OUTPUT_ERRORS = (OutputParserException, ValidationError)
+# 便宜模型调用失败（超时、连接错误、5xx、模型不存在等）时同样升级
+API_ERRORS = (openai.APIError, asyncio.TimeoutError)
+ESCALATE_ERRORS = INVALID_OUTPUT_ERRORS + API_ERRORS
+# accept 读取结果字段时的错误（ValidationError 是 ValueError 的子类）
+ACCEPT_ERRORS = (AttributeError, KeyError, TypeError, ValueError)
+
+
+def _error_reason(error):
+    return "invalid" if isinstance(error, INVALID_OUTPUT_ERRORS) else "error"
+
+
+def _parse_pairs(value):
+    """解析 "a=1,b=2" 形式的配置"""
+    pairs = {}
+    for item in value.split(","):
+        key, _, number = item.strip().partition("=")
+        if key and number:
+            pairs[key.strip()] = number.strip()
+    return pairs
+
+
+def confidence_threshold(name):
+    """按链名读取阈值：CASCADE_THRESHOLDS 中的配置，否则 CASCADE_MIN_CONFIDENCE"""
+    thresholds = _parse_pairs(os.getenv("CASCADE_THRESHOLDS", ""))
+    return float(thresholds.get(name) or os.getenv("CASCADE_MIN_CONFIDENCE", "0.8"))
+
+
+def model_prices():
+    """MODEL_PRICES="模型=输入单价:输出单价,..."，单价按每千 token 计"""
+    prices = {}
+    for model, value in _parse_pairs(os.getenv("MODEL_PRICES", "")).items():
+        prompt_price, _, completion_price = value.partition(":")
+        prices[model] = (float(prompt_price), float(completion_price or prompt_price))
+    return prices
+
+
+class _UsageCollector(BaseCallbackHandler):
+    """收集一次链调用里所有模型调用的 token 用量"""
+
+    run_inline = True
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage and "input_tokens" in usage:
+                    self.input_tokens += usage["input_tokens"]
+                    self.output_tokens += usage.get("output_tokens", 0)
+
+
+class CascadeStats:
+    """两级模型的调用次数、时延、成本和升级原因"""
+
+    def __init__(self, cheap_model, strong_model):
+        self.cheap_model = cheap_model
+        self.strong_model = strong_model
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.reasons = {}
+        self.tiers = {
+            tier: {"calls": 0, "seconds": 0.0, "cost": 0.0}
+            for tier in ("cheap", "strong")
+        }
+        # 便宜模型的结果被采用的请求，在便宜模型上花费的时间和成本
+        self.accepted = {"calls": 0, "seconds": 0.0, "cost": 0.0}
+        # 升级的请求额外花在便宜模型上的时间和成本
+        self.wasted = {"seconds": 0.0, "cost": 0.0}
+
+    def cost(self, model, usage):
+        prompt_price, completion_price = model_prices().get(model, (0.0, 0.0))
+        return (usage.input_tokens * prompt_price + usage.output_tokens * completion_price) / 1000
+
+    def record(self, tier, seconds, cost, accepted=None, reason=None):
+        with self._lock:
+            stats = self.tiers[tier]
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["cost"] += cost
+            if tier != "cheap":
+                return
+            self.requests += 1
+            if accepted:
+                self.accepted["calls"] += 1
+                self.accepted["seconds"] += seconds
+                self.accepted["cost"] += cost
+            else:
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+                self.wasted["seconds"] += seconds
+                self.wasted["cost"] += cost
+
+    def stats(self):
+        with self._lock:
+            tiers = {tier: dict(stats) for tier, stats in self.tiers.items()}
+            accepted, wasted, requests = dict(self.accepted), dict(self.wasted), self.requests
+            reasons = dict(self.reasons)
+        for stats in tiers.values():
+            stats["avg_seconds"] = stats["seconds"] / stats["calls"] if stats["calls"] else None
+        strong = tiers["strong"]
+        result = {
+            "cheap_model": self.cheap_model,
+            "strong_model": self.strong_model,
+            "requests": requests,
+            "escalated": requests - accepted["calls"],
+            "escalation_rate": (requests - accepted["calls"]) / requests if requests else 0.0,
+            "reasons": reasons,
+            "tiers": tiers,
+            "saved_seconds": None,
+            "saved_cost": None,
+        }
+        if strong["calls"]:
+            # 采用便宜模型结果的请求，按强模型的平均时延和成本估算节省，再减去升级请求白花的部分
+            avg_cost = strong["cost"] / strong["calls"]
+            result["saved_seconds"] = (
+                accepted["calls"] * strong["avg_seconds"] - accepted["seconds"] - wasted["seconds"]
+            )
+            result["saved_cost"] = accepted["calls"] * avg_cost - accepted["cost"] - wasted["cost"]
+        return result
+
+
+class ModelCascade(Runnable):
+    """对同一条链的两个模型版本做级联
+
+    流式调用时先缓存便宜模型的输出块，decision_fields 里的字段都生成完
+    （后面的字段开始输出）就判断是否采用：采用时先补发缓存的块再继续流式输出，
+    不采用时停止便宜模型，改为流式输出强模型的结果
+    """
+
+    def __init__(self, build_chain, name, accept, strong_model, cheap_model, decision_fields=("confidence",), schema=None):
+        self.chain_name = name
+        self.name = f"{name}_cascade"
+        # accept(result, threshold) -> 升级原因，返回 None 表示采用便宜模型的结果
+        self.accept = accept
+        self.decision_fields = tuple(decision_fields)
+        # 流式输出的块是没有校验过的部分字典，输出结束时用 schema 校验后再决定是否采用
+        self.schema = schema
+        self.cheap_chain = build_chain(cheap_model)
+        self.strong_chain = build_chain(strong_model)
+        self.stats_ = CascadeStats(cheap_model.model_name, strong_model.model_name)
+        self._models = {"cheap": cheap_model.model_name, "strong": strong_model.model_name}
+
+    def _config(self, config, usage):
+        # 调用方传入的回调保留，再加上本次调用的用量收集
+        return merge_configs(config, {"callbacks": [usage]})
+
+    def _check(self, result, final=False):
+        """返回升级原因；结果不符合 schema 或 accept 读不到需要的字段时按 invalid 升级"""
+        try:
+            if isinstance(result, dict):
+                # 流式输出的部分结果是字典
+                if final and self.schema is not None:
+                    result = self.schema.model_validate(result)
+                else:
+                    result = SimpleNamespace(**result)
+            return self.accept(result, confidence_threshold(self.chain_name))
+        except ACCEPT_ERRORS as e:
+            logger.info("%s 的便宜模型结果无法判断：%s", self.chain_name, e)
+            return "invalid"
+
+    def _decidable(self, partial):
+        """部分结果里判断所需的字段都已完整：它们都出现了，并且后面已经开始输出其他字段"""
+        if not isinstance(partial, dict) or not all(field in partial for field in self.decision_fields):
+            return False
+        keys = list(partial)
+        return max(keys.index(field) for field in self.decision_fields) < len(keys) - 1
+
+    def _record(self, tier, started, usage, accepted=None, reason=None):
+        seconds = time.perf_counter() - started
+        cost = self.stats_.cost(self._models[tier], usage)
+        self.stats_.record(tier, seconds, cost, accepted, reason)
+
+    def _escalate(self, started, usage, reason):
+        self._record("cheap", started, usage, accepted=False, reason=reason)
+        logger.info("%s 升级到强模型：%s", self.chain_name, reason)
+
+    def _invoke(self, inputs, config):
+        usage = _UsageCollector()
+        started = time.perf_counter()
+        try:
+            result = self.cheap_chain.invoke(inputs, self._config(config, usage))
+            reason = self._check(result)
+        except ESCALATE_ERRORS as e:
+            result, reason = None, _error_reason(e)
+        if reason is None:
+            self._record("cheap", started, usage, accepted=True)
+            return result
+
+        self._escalate(started, usage, reason)
+        usage = _UsageCollector()
+        started = time.perf_counter()
+        result = self.strong_chain.invoke(inputs, self._config(config, usage))
+        self._record("strong", started, usage)
+        return result
+
+    async def _ainvoke(self, inputs, config):
+        usage = _UsageCollector()
+        started = time.perf_counter()
+        try:
+            result = await self.cheap_chain.ainvoke(inputs, self._config(config, usage))
+            reason = self._check(result)
+        except ESCALATE_ERRORS as e:
+            result, reason = None, _error_reason(e)
+        if reason is None:
+            self._record("cheap", started, usage, accepted=True)
+            return result
+
+        self._escalate(started, usage, reason)
+        usage = _UsageCollector()
+        started = time.perf_counter()
+        result = await self.strong_chain.ainvoke(inputs, self._config(config, usage))
+        self._record("strong", started, usage)
+        return result
+
+    async def _astream(self, input_iterator, config):
+        inputs = None
+        async for chunk in input_iterator:
+            inputs = chunk
+        usage = _UsageCollector()
+        started = time.perf_counter()
+        buffered = []
+        decided = False
+        reason = None
+        stream = self.cheap_chain.astream(inputs, self._config(config, usage))
+        try:
+            async for chunk in stream:
+                if decided:
+                    yield chunk
+                    continue
+                buffered.append(chunk)
+                if self._decidable(chunk):
+                    reason = self._check(chunk)
+                    if reason is not None:
+                        break
+                    # 已经采用便宜模型的结果，之后的输出直接转发
+                    decided = True
+                    for item in buffered:
+                        yield item
+                    buffered = []
+            if not decided and reason is None:
+                # 输出结束才能判断（例如置信度是最后一个字段）
+                reason = self._check(buffered[-1], final=True) if buffered else "empty"
+                if reason is None:
+                    decided = True
+                    for item in buffered:
+                        yield item
+        except ESCALATE_ERRORS as e:
+            if decided:
+                # 已经输出了便宜模型的部分结果，不能再换模型
+                raise
+            reason = _error_reason(e)
+        finally:
+            await stream.aclose()
+        if decided:
+            self._record("cheap", started, usage, accepted=True)
+            return
+
+        self._escalate(started, usage, reason)
+        usage = _UsageCollector()
+        started = time.perf_counter()
+        async for chunk in self.strong_chain.astream(inputs, self._config(config, usage)):
+            yield chunk
+        self._record("strong", started, usage)
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._call_with_config(self._invoke, input, config)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self._acall_with_config(self._ainvoke, input, config)
+
+    async def astream(self, input, config=None, **kwargs):
+        async def single_input():
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(single_input(), self._astream, config):
+            yield chunk
+
+    def stats(self):
+        return self.stats_.stats()
+
+
+# 已创建的级联，按链名查看统计
+_cascades = {}
+
+
+def cascade_chain(build_chain, name, accept, strong_model, decision_fields=("confidence",), schema=None):
+    """返回级联后的链；没有配置 CASCADE_MODEL 时直接返回 build_chain(strong_model)
+
+    build_chain(model) 用给定的模型构建链，accept(result, threshold) 返回升级原因或 None，
+    decision_fields 是 accept 用到的字段，流式输出时这些字段生成完就可以做出判断；
+    schema 是链输出的 Pydantic 模型，流式输出结束时用它校验便宜模型的结果
+    """
+    cheap_name = os.getenv("CASCADE_MODEL", "").strip()
+    if not cheap_name or cheap_name == strong_model.model_name:
+        return build_chain(strong_model)
+    # 便宜模型沿用强模型的温度、流式和响应缓存配置
+    cheap_model = get_chat_model(
+        model=cheap_name,
+        temperature=strong_model.temperature,
+        streaming=strong_model.streaming,
+        cached=strong_model.cache is not None,
+    )
+    cascade = ModelCascade(build_chain, name, accept, strong_model, cheap_model, decision_fields, schema)
+    _cascades[name] = cascade
+    return cascade
+
+
+def cascade_stats():
+    """各级联链的统计"""
+    return {name: cascade.stats() for name, cascade in _cascades.items()}
+
+
+def low_confidence(result, threshold):
+    """通用的升级判断：置信度低于阈值"""
+    confidence = getattr(result, "confidence", None)
+    if confidence is None or confidence < threshold:
+        return "low_confidence"
+    return None
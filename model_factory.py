@@ -0,0 +1,326 @@
+from langchain_openai import ChatOpenAI
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps
+from langchain_core.messages import message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk
+from dotenv import load_dotenv
+import importlib.util
+import contextvars
+import threading
+import weakref
+import asyncio
+import warnings
+import httpx
+import os
+
+# 导入时注册全局的指标回调，工厂创建的模型及其所在的链自动记录时延和 token 用量
+import metrics  # noqa: F401
+
+# 加载环境变量
+load_dotenv()
+
+# 统一的模型工厂：所有脚本通过 get_chat_model 获取模型实例，
+# 同一个 (model, temperature, streaming) 配置只创建一次，
+# 所有实例共享同一个 keep-alive 的 httpx 连接池，避免每条链都重新握手建连
+
+_lock = threading.Lock()
+_models = {}
+_http_client = None
+_http_async_client = None
+
+# stream/astream 命中缓存时要回放的消息。交给 BaseChatModel.stream 内部调用的 _stream/_astream 回放，
+# 回放和 _generate 命中缓存一样经过回调（on_chat_model_start、on_llm_new_token、on_llm_end），
+# 指标、前缀缓存统计和级联的用量收集都能看到这次调用
+_replay_message = contextvars.ContextVar("replay_message", default=None)
+# 回放的消息在 response_metadata 里带这个标记
+CACHE_HIT_KEY = "llm_cache_hit"
+
+
+def _env_int(name, default):
+    value = os.getenv(name, "")
+    return int(value) if value.strip() else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name, "")
+    return float(value) if value.strip() else default
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name, "")
+    if not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _pool_options():
+    """根据环境变量生成连接池参数"""
+    http2 = _env_bool("LLM_HTTP2")
+    if http2 and importlib.util.find_spec("h2") is None:
+        # HTTP/2 依赖可选的 h2 包，没有安装时退回 HTTP/1.1
+        warnings.warn("LLM_HTTP2 已开启但未安装 h2，退回 HTTP/1.1")
+        http2 = False
+
+    return {
+        "limits": httpx.Limits(
+            max_connections=_env_int("LLM_POOL_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=_env_int("LLM_POOL_MAX_KEEPALIVE", 20),
+            keepalive_expiry=_env_float("LLM_POOL_KEEPALIVE_EXPIRY", 30.0),
+        ),
+        "timeout": httpx.Timeout(
+            _env_float("LLM_TIMEOUT", 60.0),
+            connect=_env_float("LLM_CONNECT_TIMEOUT", 10.0),
+        ),
+        "http2": http2,
+    }
+
+
+class _PerLoopAsyncTransport(httpx.AsyncBaseTransport):
+    """按事件循环分别维护连接池
+
+    连接绑定在创建它的事件循环上，脚本里多次 asyncio.run 时，
+    每个事件循环使用自己的 keep-alive 连接池，避免复用已关闭循环的连接
+    """
+
+    def __init__(self, limits, http2):
+        self._limits = limits
+        self._http2 = http2
+        self._transports = weakref.WeakKeyDictionary()
+
+    def _transport(self):
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(limits=self._limits, http2=self._http2)
+            self._transports[loop] = transport
+        return transport
+
+    async def handle_async_request(self, request):
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+def get_http_client():
+    """进程内共享的同步 httpx 客户端"""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(**_pool_options())
+        return _http_client
+
+
+def get_http_async_client():
+    """进程内共享的异步 httpx 客户端，每个事件循环一个连接池"""
+    global _http_async_client
+    with _lock:
+        if _http_async_client is None:
+            options = _pool_options()
+            _http_async_client = httpx.AsyncClient(
+                transport=_PerLoopAsyncTransport(options["limits"], options["http2"]),
+                timeout=options["timeout"],
+            )
+        return _http_async_client
+
+
+class PooledChatOpenAI(ChatOpenAI):
+    """工厂创建的模型类型
+
+    开启响应缓存时，stream/astream 也会先查缓存：命中时把缓存结果拆成分片，经过回调回放，
+    未命中时边流式输出边累积，结束后写入缓存。invoke 路径由 LangChain 自身处理
+    """
+
+    def _cache_key(self, input, stop, kwargs):
+        # 与 BaseChatModel._generate_with_cache 使用相同的键，流式和非流式调用共享缓存
+        messages = self._convert_input(input).to_messages()
+        return dumps(messages), self._get_llm_string(stop=stop, **kwargs)
+
+    def stream(self, input, config=None, *, stop=None, **kwargs):
+        if not isinstance(self.cache, BaseCache):
+            yield from super().stream(input, config, stop=stop, **kwargs)
+            return
+
+        prompt, llm_string = self._cache_key(input, stop, kwargs)
+        cached = self.cache.lookup(prompt, llm_string)
+        if cached:
+            _replay_message.set(cached[0].message)
+            try:
+                yield from super().stream(input, config, stop=stop, **kwargs)
+            finally:
+                _replay_message.set(None)
+            return
+
+        merged = None
+        for chunk in super().stream(input, config, stop=stop, **kwargs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            self.cache.update(prompt, llm_string, [ChatGeneration(message=message_chunk_to_message(merged))])
+
+    async def astream(self, input, config=None, *, stop=None, **kwargs):
+        if not isinstance(self.cache, BaseCache):
+            async for chunk in super().astream(input, config, stop=stop, **kwargs):
+                yield chunk
+            return
+
+        prompt, llm_string = self._cache_key(input, stop, kwargs)
+        cached = await self.cache.alookup(prompt, llm_string)
+        if cached:
+            _replay_message.set(cached[0].message)
+            try:
+                async for chunk in super().astream(input, config, stop=stop, **kwargs):
+                    yield chunk
+            finally:
+                _replay_message.set(None)
+            return
+
+        merged = None
+        async for chunk in super().astream(input, config, stop=stop, **kwargs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            await self.cache.aupdate(prompt, llm_string, [ChatGeneration(message=message_chunk_to_message(merged))])
+
+
+    # 限流：所有真实的 API 调用都经过 rate_limiter 的调度器，命中响应缓存的调用不占用预算。
+    # streaming=True 时 _generate 内部会走 _stream，只在 _stream 里申请名额，避免重复申请
+
+    def _limiter_and_estimate(self, messages, kwargs):
+        from rate_limiter import get_rate_limiter, estimate_tokens
+
+        limiter = get_rate_limiter(self.openai_api_base)
+        if limiter is None:
+            return None, 0
+        return limiter, estimate_tokens(messages, kwargs.get("max_tokens") or self.max_tokens, self.model_name)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        limiter, estimated = (None, 0) if self.streaming else self._limiter_and_estimate(messages, kwargs)
+        if limiter is None:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        with limiter.slot(estimated) as permit:
+            result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            permit.record_usage(getattr(result.generations[0].message, "usage_metadata", None))
+            return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        limiter, estimated = (None, 0) if self.streaming else self._limiter_and_estimate(messages, kwargs)
+        if limiter is None:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        async with limiter.aslot(estimated) as permit:
+            result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            permit.record_usage(getattr(result.generations[0].message, "usage_metadata", None))
+            return result
+
+    @staticmethod
+    def _replay():
+        """取出 stream/astream 设置的缓存消息，返回回放的分片；没有时返回 None"""
+        message = _replay_message.get()
+        if message is None:
+            return None
+        _replay_message.set(None)
+        from llm_cache import replay_chunks
+
+        chunks = [ChatGenerationChunk(message=chunk) for chunk in replay_chunks(message)]
+        # 分片的 usage_metadata 必须带完整的 token 数，命中标记放在 response_metadata 里，指标据此计为缓存命中
+        first = chunks[0].message
+        first.response_metadata = {**first.response_metadata, CACHE_HIT_KEY: True}
+        return chunks
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        replay = self._replay()
+        if replay is not None:
+            # 命中缓存的调用不占用限流预算
+            yield from replay
+            return
+        limiter, estimated = self._limiter_and_estimate(messages, kwargs)
+        if limiter is None:
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+        with limiter.slot(estimated) as permit:
+            for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                permit.mark_first_token()
+                permit.record_usage(getattr(chunk.message, "usage_metadata", None))
+                yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        replay = self._replay()
+        if replay is not None:
+            for chunk in replay:
+                yield chunk
+            return
+        limiter, estimated = self._limiter_and_estimate(messages, kwargs)
+        if limiter is None:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+        async with limiter.aslot(estimated) as permit:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                permit.mark_first_token()
+                permit.record_usage(getattr(chunk.message, "usage_metadata", None))
+                yield chunk
+
+
+def build_model_params(model=None, temperature=0.1, streaming=True):
+    """生成创建 ChatOpenAI 所需的参数"""
+    return {
+        "model": model or os.getenv("OPENAI_MODEL", ""),
+        "temperature": temperature,
+        "streaming": streaming,
+        # 流式响应末尾也返回 usage，用于统计 token 用量和前缀缓存命中
+        "stream_usage": _env_bool("LLM_STREAM_USAGE", True),
+        "openai_api_key": os.getenv("OPENAI_API_KEY", ""),
+        "openai_api_base": os.getenv("OPENAI_API_BASE", ""),
+    }
+
+
+def get_chat_model(model=None, temperature=0.1, streaming=True, cached=False):
+    """按 (model, temperature, streaming) 返回缓存的模型实例
+
+    cached=True 时为模型挂上持久化的响应缓存，适合输入重复、低温度的确定性链；
+    LLM_CACHE_ENABLED=false 时全局关闭（例如基准测试）
+    """
+    cached = cached and _env_bool("LLM_CACHE_ENABLED", True)
+    params = build_model_params(model, temperature, streaming)
+    key = (params["model"], temperature, streaming, params["openai_api_base"], cached)
+
+    with _lock:
+        chat_model = _models.get(key)
+    if chat_model is not None:
+        return chat_model
+
+    if cached:
+        from llm_cache import get_response_cache
+
+        params["cache"] = get_response_cache()
+    chat_model = PooledChatOpenAI(
+        **params,
+        http_client=get_http_client(),
+        http_async_client=get_http_async_client(),
+    )
+    with _lock:
+        # 并发创建时以先写入的实例为准
+        return _models.setdefault(key, chat_model)
+
+
+def close_http_clients():
+    """关闭共享连接池（同步部分）并清空模型缓存"""
+    global _http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+        _models.clear()
+
+
+async def aclose_http_clients():
+    """关闭共享连接池（异步部分）"""
+    global _http_async_client
+    with _lock:
+        client, _http_async_client = _http_async_client, None
+    if client is not None:
+        await client.aclose()
+    close_http_clients()
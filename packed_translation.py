@@ -0,0 +1,184 @@
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel, Field, ValidationError
+from typing import List
+from dotenv import load_dotenv
+import threading
+import logging
+import orjson
+import os
+
+from batch_runner import abatch_iter
+from model_factory import get_chat_model
+from prompt_cache import prefix_cached_prompt, track_prompt_cache
+from structured_output import structured_chain
+from template_registry import template_registry
+from token_counter import count_tokens
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 打包翻译：把大量短文本（界面文案等）按 token 预算打包进一个请求，
+# 每段带一个稳定的编号，模型按编号返回结构化的译文。拆回结果后逐段核对，
+# 漏掉或为空的段落重新打包重试，多次重试仍然缺失的段落退回逐条翻译。
+# 相同的原文只翻译一次
+
+# 整包译文无法解析，或者补全截断的输出后不符合 schema（例如最后一段缺少 text）时，整包重试
+INVALID_PACK_ERRORS = (OutputParserException, ValidationError)
+
+# 每段在打包 JSON 中除正文外的开销（编号、引号、逗号）
+SEGMENT_OVERHEAD = 6
+
+
+class TranslatedSegment(BaseModel):
+    id: str = Field(description="原文段落的编号，原样返回")
+    text: str = Field(description="该段的译文")
+
+
+class PackedTranslation(BaseModel):
+    """打包翻译的结果"""
+    translations: List[TranslatedSegment] = Field(description="每个编号一项译文，不能合并或遗漏")
+
+
+@template_registry.cached("packed_translation")
+def create_packed_translation_prompt(source_lang, target_lang, context=""):
+    """打包翻译模板，输入 {"segments": '{"编号": "原文", ...}'}"""
+    context_line = f"\n上下文：{context}\n" if context else ""
+    return prefix_cached_prompt(
+        f"""你是一个专业的翻译专家，精通{source_lang}和{target_lang}。
+{context_line}
+用户会给出一个JSON对象，键是段落编号，值是{source_lang}原文。
+请把每一段分别翻译成{target_lang}：
+- 每个编号返回一项译文，编号原样返回
+- 各段相互独立，不要合并、拆分或遗漏
+- 保留原文中的占位符（如 {{{{name}}}}、%s）和标点格式""",
+        "{segments}",
+    )
+
+
+def pack_segments(items, max_tokens=None, max_segments=None, model=None):
+    """把 [(编号, 原文)] 按顺序贪心打包，每包的原文 token 数不超过 max_tokens
+
+    单段超过预算时独占一包
+    """
+    max_tokens = max_tokens or int(os.getenv("TRANSLATION_PACK_TOKENS", "1000"))
+    max_segments = max_segments or int(os.getenv("TRANSLATION_PACK_MAX_SEGMENTS", "50"))
+    packs, current, current_tokens = [], [], 0
+    for segment_id, text in items:
+        tokens = count_tokens(text, model) + SEGMENT_OVERHEAD
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_segments):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append((segment_id, text))
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+class PackedTranslator:
+    """按语言对打包翻译大量文本"""
+
+    def __init__(self, model, single_chain_factory=None, max_tokens=None, max_segments=None,
+                 max_attempts=None, concurrency=None):
+        self.model = model
+        # single_chain_factory(source_lang, target_lang, context) 返回逐条翻译的链，用于最后的兜底
+        self.single_chain_factory = single_chain_factory
+        self.max_tokens = max_tokens
+        self.max_segments = max_segments
+        self.max_attempts = max_attempts or int(os.getenv("TRANSLATION_PACK_MAX_ATTEMPTS", "3"))
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._stats = {"segments": 0, "unique": 0, "requests": 0, "retried": 0, "fallback": 0}
+
+    def _record(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def chain(self, source_lang, target_lang, context="", model=None):
+        prompt = create_packed_translation_prompt(source_lang, target_lang, context)
+        return track_prompt_cache(
+            structured_chain(prompt, model or self.model, PackedTranslation, "packed_translation"), "packed_translation"
+        )
+
+    def _retry_model(self):
+        """重试用不带响应缓存的同一模型，否则缓存会原样重放上次无法解析的输出"""
+        if self.model.cache is None:
+            return self.model
+        return get_chat_model(
+            model=self.model.model_name,
+            temperature=self.model.temperature,
+            streaming=self.model.streaming,
+            cached=False,
+        )
+
+    async def _translate_packs(self, chain, packs):
+        """翻译一批包，返回 {编号: 译文}，只收录请求过且非空的编号"""
+        translated = {}
+        inputs = (
+            {"segments": orjson.dumps(dict(pack)).decode()}
+            for pack in packs
+        )
+        self._record(requests=len(packs))
+        async for index, result in abatch_iter(chain, inputs, concurrency=self.concurrency, return_exceptions=True):
+            if isinstance(result, INVALID_PACK_ERRORS):
+                logger.warning("第 %d 包的译文无法解析，稍后重试", index)
+                continue
+            if isinstance(result, Exception):
+                raise result
+            requested = dict(packs[index])
+            for segment in result.translations:
+                if segment.id in requested and segment.text.strip():
+                    translated[segment.id] = segment.text
+        return translated
+
+    async def atranslate(self, texts, source_lang, target_lang, context=""):
+        """翻译文本列表，按输入顺序返回译文列表"""
+        texts = list(texts)
+        # 相同原文只翻译一次，编号是首次出现的位置，重试时保持不变
+        first_index = {}
+        for index, text in enumerate(texts):
+            first_index.setdefault(text, str(index))
+        pending = {segment_id: text for text, segment_id in first_index.items() if text.strip()}
+        self._record(segments=len(texts), unique=len(pending))
+
+        chain = self.chain(source_lang, target_lang, context)
+        retry_chain = None
+        max_tokens = self.max_tokens or int(os.getenv("TRANSLATION_PACK_TOKENS", "1000"))
+        max_segments = self.max_segments or int(os.getenv("TRANSLATION_PACK_MAX_SEGMENTS", "50"))
+        translated = {}
+        for attempt in range(self.max_attempts):
+            if not pending:
+                break
+            if attempt:
+                self._record(retried=len(pending))
+                logger.info("%d 段译文缺失，第 %d 次重试", len(pending), attempt)
+                if retry_chain is None:
+                    retry_chain = self.chain(source_lang, target_lang, context, self._retry_model())
+                chain = retry_chain
+                # 每次重试把包缩小一半，整包无法解析时换一种切分，也减轻长输出被截断的问题
+                max_tokens = max(max_tokens // 2, 1)
+                max_segments = max(max_segments // 2, 1)
+            packs = pack_segments(pending.items(), max_tokens, max_segments, self.model.model_name)
+            translated.update(await self._translate_packs(chain, packs))
+            pending = {segment_id: text for segment_id, text in pending.items() if segment_id not in translated}
+
+        if pending:
+            if self.single_chain_factory is None:
+                raise ValueError(f"{len(pending)} 段多次重试后仍未返回译文: {list(pending)[:10]}")
+            # 打包多次仍然缺失的段落逐条翻译
+            self._record(fallback=len(pending))
+            single_chain = self.single_chain_factory(source_lang, target_lang, context)
+            ids = list(pending)
+            async for index, result in abatch_iter(
+                single_chain, ({"text": pending[segment_id]} for segment_id in ids), concurrency=self.concurrency
+            ):
+                translated[ids[index]] = result
+
+        return [translated.get(first_index[text], text) for text in texts]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
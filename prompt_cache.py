@@ -0,0 +1,90 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+import threading
+
+# 适配服务端前缀缓存的提示布局：OpenAI 等服务按请求的最长公共前缀复用已计算的 prompt，
+# 只有前缀完全一致才能命中。把角色、规则、输出格式这些不变的内容放进开头的系统消息，
+# 每次请求变化的内容放在最后的用户消息里，同一条链的所有请求就共享同一个前缀。
+# 命中情况通过 usage_metadata 里的 input_token_details.cache_read 按链统计
+
+
+def prefix_cached_prompt(system_prefix, variable_suffix):
+    """组装「静态系统前缀 + 变量后缀」的聊天模板
+
+    system_prefix 中不能有模板变量，否则前缀会随请求变化，无法命中缓存
+    """
+    prefix_variables = PromptTemplate.from_template(system_prefix).input_variables
+    if prefix_variables:
+        raise ValueError(f"系统前缀中不能包含模板变量: {prefix_variables}")
+    return ChatPromptTemplate.from_messages([
+        ("system", system_prefix),
+        ("human", variable_suffix),
+    ])
+
+
+class PromptCacheStats:
+    """按链名汇总输入 token 和缓存命中的 token"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chains = {}
+
+    def record(self, name, usage):
+        details = usage.get("input_token_details") or {}
+        with self._lock:
+            stats = self._chains.setdefault(name, {"calls": 0, "input_tokens": 0, "cached_tokens": 0})
+            stats["calls"] += 1
+            stats["input_tokens"] += usage.get("input_tokens", 0)
+            stats["cached_tokens"] += details.get("cache_read", 0) or 0
+
+    def stats(self):
+        with self._lock:
+            chains = {name: dict(stats) for name, stats in self._chains.items()}
+        for stats in chains.values():
+            stats["cache_hit_rate"] = stats["cached_tokens"] / stats["input_tokens"] if stats["input_tokens"] else 0.0
+        return chains
+
+    def reset(self):
+        with self._lock:
+            self._chains.clear()
+
+
+class PromptCacheHandler(BaseCallbackHandler):
+    """从模型返回的 usage_metadata 中记录缓存命中的 token 数"""
+
+    run_inline = True
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                # 命中本地响应缓存的结果没有 token 用量（只有 total_cost=0），不计入
+                if usage and "input_tokens" in usage:
+                    self.stats.record(self.name, usage)
+
+
+_shared_stats = PromptCacheStats()
+
+
+def get_prompt_cache_stats():
+    """进程内共享的前缀缓存统计"""
+    return _shared_stats
+
+
+def track_prompt_cache(chain, name):
+    """为链挂上前缀缓存统计，回调会传递给链内的模型调用"""
+    return chain.with_config(run_name=name, callbacks=[PromptCacheHandler(_shared_stats, name)])
+
+
+def format_prompt_cache_stats(stats=None):
+    stats = get_prompt_cache_stats().stats() if stats is None else stats
+    lines = [
+        f"{name}: {item['calls']} 次调用，输入 {item['input_tokens']} tokens，"
+        f"缓存命中 {item['cached_tokens']} tokens（{item['cache_hit_rate']:.0%}）"
+        for name, item in stats.items()
+    ]
+    return "\n".join(lines) or "暂无调用记录"
@@ -0,0 +1,329 @@
+from contextlib import asynccontextmanager, contextmanager
+from collections import deque
+from dotenv import load_dotenv
+import threading
+import asyncio
+import logging
+import time
+import os
+
+import openai
+
+from token_counter import count_message_tokens
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 客户端限流：每个 OPENAI_API_BASE 一个调度器，所有模型调用先在这里排队。
+# - RPM / TPM：两个按秒匀速补充的令牌桶。token 用 tiktoken 事先估算（prompt + 预计输出），
+#   调用结束后按 usage 中的实际用量补差；余额不足时预约并等待，而不是立刻失败
+# - 并发：AIMD 调整并发上限。成功且时延正常时缓慢加一，收到 429 时减半，
+#   时延明显高于基线时小幅下调；429 带 retry-after 时整个调度器暂停到指定时间
+# 同步调用（线程）和异步调用（事件循环）共用同一个调度器
+
+
+class _Waiter:
+    """等待并发名额的调用方，同步调用用 Event，异步调用用所在事件循环的 Future"""
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _TokenBucket:
+    """每分钟 capacity 个令牌的匀速令牌桶，允许预约（余额变成负数）"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """扣除令牌，返回需要等待的秒数"""
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+        # 单次请求超过桶容量时按容量计，否则永远等不到
+        self.available -= min(amount, self.capacity)
+        return 0.0 if self.available >= 0 else -self.available / self.rate
+
+    def refund(self, amount):
+        self.available = min(self.capacity, self.available + amount)
+
+
+class Permit:
+    """一次模型调用占用的名额，调用结束后用实际用量修正 TPM 预算"""
+
+    def __init__(self, limiter, estimated_tokens):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.actual_tokens = None
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def record_usage(self, usage):
+        if usage and "total_tokens" in usage:
+            self.actual_tokens = (self.actual_tokens or 0) + usage["total_tokens"]
+
+    @property
+    def latency(self):
+        # 流式调用用首 token 时间衡量服务端压力，非流式调用用总时长
+        return (self.first_token_at or time.monotonic()) - self.started_at
+
+
+class AdaptiveRateLimiter:
+    """单个 API 地址的 RPM/TPM 预算和 AIMD 并发控制"""
+
+    def __init__(self, name="", rpm=None, tpm=None, max_concurrency=None, min_concurrency=None):
+        self.name = name
+        rpm = rpm if rpm is not None else int(os.getenv("LLM_RPM", "0"))
+        tpm = tpm if tpm is not None else int(os.getenv("LLM_TPM", "0"))
+        # 0 表示不限制
+        self._requests = _TokenBucket(rpm) if rpm else None
+        self._tokens = _TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+        self.min_concurrency = min_concurrency or int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+        self.latency_factor = float(os.getenv("LLM_LATENCY_FACTOR", "2.0"))
+        self.limit = float(int(os.getenv("LLM_INITIAL_CONCURRENCY", "8")))
+        self.limit = min(max(self.limit, self.min_concurrency), self.max_concurrency)
+
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self.baseline_latency = None
+        self.stats_counters = {"requests": 0, "rate_limited": 0, "errors": 0, "waited": 0.0}
+
+    # --- 预算 ---
+
+    def _reserve(self, estimated_tokens):
+        """预约 RPM/TPM 预算，返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            delay = max(0.0, self.paused_until - now)
+            if self._requests is not None:
+                delay = max(delay, self._requests.reserve(1, now))
+            if self._tokens is not None:
+                delay = max(delay, self._tokens.reserve(estimated_tokens, now))
+            self.stats_counters["waited"] += delay
+        return delay
+
+    def _settle(self, permit):
+        """按实际用量退还或补扣 TPM 预算"""
+        if self._tokens is None or permit.actual_tokens is None:
+            return
+        with self._lock:
+            self._tokens.refund(permit.estimated_tokens - permit.actual_tokens)
+
+    # --- 并发名额 ---
+
+    def _try_acquire(self, waiter):
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        # 调用方持有 _lock；名额直接转交给排队最久的调用方
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            waiter = self._waiters.popleft()
+            try:
+                waiter.wake()
+            except RuntimeError:
+                # 等待方的事件循环已经关闭，收回名额，继续唤醒下一个
+                self.in_flight -= 1
+                logger.debug("跳过事件循环已关闭的等待方")
+
+    def _abandon(self, waiter):
+        """等待被取消：还在队列里就移除，已经被唤醒则把名额还回去"""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return
+            except ValueError:
+                pass
+        self._release()
+
+    # --- AIMD ---
+
+    def _on_success(self, permit):
+        latency = permit.latency
+        with self._lock:
+            self.stats_counters["requests"] += 1
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            else:
+                self.baseline_latency = 0.9 * self.baseline_latency + 0.1 * latency
+            if latency > self.baseline_latency * self.latency_factor:
+                self._decrease(0.9)
+            else:
+                # 加性增：每完成约 limit 个请求，上限加一
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+                self._wake_waiters()
+
+    def _on_rate_limited(self, error):
+        retry_after = _retry_after(error)
+        with self._lock:
+            self.stats_counters["rate_limited"] += 1
+            self._decrease(0.5)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        logger.warning("%s 返回 429，并发上限降为 %d", self.name or "LLM", int(self.limit))
+
+    def _decrease(self, factor):
+        # 调用方持有 _lock；同一批失败的并发请求只减一次
+        now = time.monotonic()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * factor)
+
+    def _on_error(self, error):
+        if isinstance(error, openai.RateLimitError):
+            self._on_rate_limited(error)
+        else:
+            with self._lock:
+                self.stats_counters["errors"] += 1
+
+    # --- 对外接口 ---
+
+    @contextmanager
+    def slot(self, estimated_tokens=0):
+        """同步调用获取名额"""
+        delay = self._reserve(estimated_tokens)
+        if delay:
+            time.sleep(delay)
+        waiter = _Waiter()
+        if not self._try_acquire(waiter):
+            try:
+                waiter.event.wait()
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        permit = Permit(self, estimated_tokens)
+        try:
+            yield permit
+        except Exception as e:
+            self._on_error(e)
+            raise
+        else:
+            self._on_success(permit)
+        finally:
+            self._settle(permit)
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, estimated_tokens=0):
+        """异步调用获取名额"""
+        delay = self._reserve(estimated_tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        waiter = _Waiter(asyncio.get_running_loop())
+        if not self._try_acquire(waiter):
+            try:
+                await waiter.future
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        permit = Permit(self, estimated_tokens)
+        try:
+            yield permit
+        except Exception as e:
+            self._on_error(e)
+            raise
+        else:
+            self._on_success(permit)
+        finally:
+            self._settle(permit)
+            self._release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "baseline_latency": self.baseline_latency,
+                **self.stats_counters,
+            }
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def estimate_tokens(messages, max_tokens=None, model=None):
+    """预估一次调用的 token 数：prompt 按 tiktoken 计数，输出按 max_tokens 或默认值估算"""
+    prompt_tokens = sum(count_message_tokens(message, model) for message in messages)
+    completion_tokens = max_tokens or int(os.getenv("LLM_ESTIMATED_COMPLETION_TOKENS", "512"))
+    return prompt_tokens + completion_tokens
+
+
+def _parse_limits(value):
+    """解析 LLM_RATE_LIMITS：'地址=RPM:TPM,地址=RPM:TPM'"""
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        base, budget = item.rsplit("=", 1)
+        rpm, _, tpm = budget.partition(":")
+        limits[base.strip().rstrip("/")] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_base=None):
+    """每个 API 地址共享一个调度器；LLM_RATE_LIMIT_ENABLED=false 时返回 None"""
+    if os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() not in ("1", "true", "yes", "on"):
+        return None
+    key = (api_base or os.getenv("OPENAI_API_BASE", "")).rstrip("/")
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            rpm, tpm = _parse_limits(os.getenv("LLM_RATE_LIMITS", "")).get(key, (None, None))
+            limiter = AdaptiveRateLimiter(key, rpm=rpm, tpm=tpm)
+            _limiters[key] = limiter
+        return limiter
+
+
+def rate_limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
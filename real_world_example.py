@@ -1,166 +1,175 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.prompts import PromptTemplate, ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableParallel
 from pydantic import BaseModel, Field
-import json
-from dotenv import load_dotenv
+from typing import List
+import asyncio
 import os
+from dotenv import load_dotenv
+
+from model_factory import get_chat_model
+from batch_runner import abatch_iter
+from streaming import astream_chain, format_metrics
+from template_registry import template_registry
+from chat_history import ChatHistoryManager
+from prompt_cache import prefix_cached_prompt, track_prompt_cache, format_prompt_cache_stats
+from structured_output import structured_chain, get_structured_output_stats
+from code_review import CodeReviewPipeline
+from packed_translation import PackedTranslator
+from intent_router import IntentRouter
+from model_cascade import cascade_chain, low_confidence
 
 # 加载环境变量
 load_dotenv()
 
 
 # 创建聊天模型
-llm_params = {
-    "model": os.getenv("OPENAI_MODEL", ""),
-    "temperature": 0.1,
-    "streaming": True,
-    "openai_api_key": os.getenv("OPENAI_API_KEY", ""),
-    "openai_api_base": os.getenv("OPENAI_API_BASE", ""),
-}
-chat_model = ChatOpenAI(**llm_params)
+# 这些链温度低、输入经常重复，开启持久化响应缓存
+chat_model = get_chat_model(cached=True)
 
-print("=== PromptTemplate 实际应用价值演示 ===\n")
+# 模块里只定义模板和链，导入时不会调用模型；演示代码在各个 run_* 函数里
 
 # 场景1：客服机器人系统
-print("场景1：客服机器人系统")
+# 字段顺序就是输出顺序：action 放在 response 之前，流式输出时不必等回复生成完就能拿到 intent 和 action
 class CustomerServiceResponse(BaseModel):
-    intent: str = Field(description="用户意图")
-    confidence: float = Field(description="置信度")
+    """客服机器人的分析结果"""
+    intent: str = Field(description="用户意图（咨询/投诉/购买/其他）")
+    confidence: float = Field(description="置信度，0到1之间")
+    action: str = Field(description="需要执行的动作（转人工/提供信息/记录问题）")
     response: str = Field(description="回复内容")
-    action: str = Field(description="需要执行的动作")
 
 # 客服模板
-customer_service_template = PromptTemplate.from_template(
+# 不变的角色、规则放在系统前缀里，用户消息等变量放在最后，
+# 所有请求共享同一个前缀，可以命中服务端的前缀缓存。
+# 输出格式由 CustomerServiceResponse 的 JSON Schema 约束，不再写进提示
+customer_service_template = prefix_cached_prompt(
     """你是一个专业的客服机器人。
 
-用户消息：{user_message}
-用户历史：{chat_history}
+请根据用户消息、用户历史和产品信息分析用户意图并提供合适的回复。""",
+    """用户历史：{chat_history}
 产品信息：{product_info}
-
-请分析用户意图并提供合适的回复。返回JSON格式：
-{{
-    "intent": "用户意图（咨询/投诉/购买/其他）",
-    "confidence": 0.95,
-    "response": "回复内容",
-    "action": "需要执行的动作（转人工/提供信息/记录问题）"
-}}"""
+用户消息：{user_message}"""
 )
 
-# 模拟客服场景
-user_message = "我想了解一下你们的产品价格"
-chat_history = "用户之前询问过产品功能"
-product_info = "我们的产品价格从99元起，支持免费试用"
 
-# 创建输出解析器
-parser = JsonOutputParser(pydantic_object=CustomerServiceResponse)
+def build_customer_service_chain(model):
+    """组合模板、模型和结构化输出解析，结果是 CustomerServiceResponse 实例"""
+    return track_prompt_cache(
+        structured_chain(customer_service_template, model, CustomerServiceResponse, "customer_service"),
+        "customer_service",
+    )
+
 
-# 组合模板、模型和解析器
-customer_service_chain = customer_service_template | chat_model | parser
+def customer_service_escalation(result, threshold):
+    """便宜模型置信度不足或判断需要转人工时，交给强模型再确认一次"""
+    if result.action == "转人工":
+        return "transfer"
+    return low_confidence(result, threshold)
 
-# 执行
-result = customer_service_chain.invoke({
-    "user_message": user_message,
-    "chat_history": chat_history,
-    "product_info": product_info
-})
 
-print(f"客服机器人分析结果: {result}")
-print()
+# 配置了 CASCADE_MODEL 时先用便宜模型回答，不够确定再升级到 OPENAI_MODEL；
+# 流式输出时 confidence 和 action 生成完就决定是否升级，response 不必等到最后
+customer_service_chain = cascade_chain(
+    build_customer_service_chain,
+    "customer_service",
+    customer_service_escalation,
+    chat_model,
+    decision_fields=("confidence", "action"),
+    schema=CustomerServiceResponse,
+)
+
+# 问价格、打招呼这类简单消息由本地预路由直接回复，其余消息才调用模型
+intent_router = IntentRouter(CustomerServiceResponse)
+routed_customer_service_chain = intent_router.wrap(customer_service_chain)
 
 # 场景2：代码审查助手
-print("场景2：代码审查助手")
-code_review_template = PromptTemplate.from_template(
+class CodeReviewResult(BaseModel):
+    """代码审查结果"""
+    score: int = Field(description="代码质量评分，0到100")
+    issues: List[str] = Field(description="发现的问题")
+    suggestions: List[str] = Field(description="改进建议")
+    security_risks: List[str] = Field(description="安全风险，没有时为空列表")
+    overall_comment: str = Field(description="总体评价")
+
+code_review_template = prefix_cached_prompt(
     """你是一个资深的代码审查专家。
 
-代码语言：{language}
-代码内容：
-```{language}
-{code}
-```
-
-请进行代码审查，重点关注：
+请对用户提供的代码进行审查，重点关注：
 1. 代码质量
 2. 潜在问题
 3. 性能优化
-4. 安全风险
-
-请以JSON格式返回：
-{{
-    "score": 85,
-    "issues": ["问题1", "问题2"],
-    "suggestions": ["建议1", "建议2"],
-    "security_risks": ["风险1"],
-    "overall_comment": "总体评价"
-}}"""
+4. 安全风险""",
+    """代码语言：{language}
+代码内容：
+```{language}
+{code}
+```"""
 )
 
-# 模拟代码审查
-python_code = """
-def calculate_fibonacci(n):
-    if n <= 1:
-        return n
-    return calculate_fibonacci(n-1) + calculate_fibonacci(n-2)
-
-result = calculate_fibonacci(100)
-print(result)
-"""
-
-# 执行代码审查
-code_review_chain = code_review_template | chat_model | StrOutputParser()
-review_result = code_review_chain.invoke({
-    "language": "python",
-    "code": python_code
-})
+code_review_chain = track_prompt_cache(
+    structured_chain(code_review_template, chat_model, CodeReviewResult, "code_review"), "code_review"
+)
 
-print("代码审查结果:")
-print(review_result)
-print()
+# 大文件按语法边界切成片段并发审查再合并，片段结果按内容哈希缓存
+code_review_pipeline = CodeReviewPipeline(code_review_chain, CodeReviewResult, model=chat_model.model_name)
 
 # 场景3：多语言翻译系统
-print("场景3：多语言翻译系统")
+# 同一语言对和上下文的模板只构建一次，批量翻译和每次请求都复用编译好的模板
+@template_registry.cached("translation")
 def create_translation_prompt(source_lang, target_lang, context=""):
     """根据语言对和上下文创建翻译模板"""
-    
+
     if context:
-        template = f"""你是一个专业的翻译专家，精通{source_lang}和{target_lang}。
+        # 语言对和上下文在构建时写入系统前缀，同一组合的请求前缀完全一致
+        return prefix_cached_prompt(
+            f"""你是一个专业的翻译专家，精通{source_lang}和{target_lang}。
 
-原文（{source_lang}）：{{text}}
 上下文：{context}
 
-请将原文翻译成{target_lang}，注意：
+请将用户提供的{source_lang}原文翻译成{target_lang}，注意：
 - 保持原文的语气和风格
 - 考虑上下文语境
-- 确保翻译准确自然"""
-    else:
-        template = f"""请将以下{source_lang}文本翻译成{target_lang}：
+- 确保翻译准确自然
+- 只输出译文""",
+            "{text}",
+        )
 
-{{text}}"""
-    
-    return PromptTemplate.from_template(template)
+    return prefix_cached_prompt(f"请将用户提供的{source_lang}文本翻译成{target_lang}。", "{text}")
 
-# 测试不同场景的翻译
+# 不同场景的翻译
 formal_translation = create_translation_prompt("中文", "英文", "商务邮件")
 casual_translation = create_translation_prompt("中文", "英文", "社交媒体")
 
-# 执行翻译
-formal_chain = formal_translation | chat_model | StrOutputParser()
-casual_chain = casual_translation | chat_model | StrOutputParser()
+# 预编译常用的语言对
+template_registry.precompile(create_translation_prompt, [
+    ("中文", "英文", ""),
+    ("英文", "中文", ""),
+    ("中文", "日文", ""),
+])
+
+formal_chain = track_prompt_cache(formal_translation | chat_model | StrOutputParser(), "formal_translation")
+casual_chain = track_prompt_cache(casual_translation | chat_model | StrOutputParser(), "casual_translation")
+
 
-text = "我们很高兴地通知您，您的订单已经发货了。"
+def create_translation_chain(source_lang, target_lang, context="", name="translation"):
+    """任意语言对的翻译链，输入 {"text": 原文}"""
+    return track_prompt_cache(
+        create_translation_prompt(source_lang, target_lang, context) | chat_model | StrOutputParser(), name
+    )
 
-formal_result = formal_chain.invoke({"text": text})
-casual_result = casual_chain.invoke({"text": text})
 
-print("正式翻译（商务邮件）:")
-print(formal_result)
-print("\n非正式翻译（社交媒体）:")
-print(casual_result)
-print()
+async def atranslate_batch(texts, source_lang, target_lang, context="", concurrency=None, ordered=True):
+    """批量翻译同一语言对的文本，逐个产出 (序号, 译文)"""
+    chain = create_translation_chain(source_lang, target_lang, context, name="translation_batch")
+    async for index, result in abatch_iter(
+        chain, ({"text": text} for text in texts), concurrency=concurrency, ordered=ordered
+    ):
+        yield index, result
+
+# 大量短文本（界面文案等）按 token 预算打包成少量请求，缺失的段落单独重试
+packed_translator = PackedTranslator(chat_model, create_translation_chain)
 
 # 场景4：智能文档生成
-print("场景4：智能文档生成")
 document_template = PromptTemplate.from_template(
     """你是一个专业的文档撰写专家。
 
@@ -177,27 +186,168 @@ document_template = PromptTemplate.from_template(
 文档长度：{length}"""
 )
 
-# 生成API文档
-api_doc = document_template.format(
-    project_name="用户管理系统",
-    tech_stack="Python + FastAPI + PostgreSQL",
-    features="用户注册、登录、权限管理、数据统计",
-    target_users="开发者和系统管理员",
-    doc_type="API文档",
-    requirements="- 接口说明\n- 请求参数\n- 响应格式\n- 错误码",
-    style="技术文档",
-    length="详细"
-)
+document_chain = track_prompt_cache(document_template | chat_model | StrOutputParser(), "document")
+
+
+def run_customer_service(stream=False):
+    print("场景1：客服机器人系统")
+    # 模拟客服场景
+    user_message = "我想了解一下你们的产品价格"
+    # 历史按 token 预算截断，长会话下提示长度保持稳定
+    history = ChatHistoryManager()
+    history.add_user_message("你们的产品有哪些功能？")
+    history.add_ai_message("我们的产品支持项目管理、任务跟踪和数据统计。")
+    chat_history = history.to_text()
+    product_info = "我们的产品价格从99元起，支持免费试用"
+    inputs = {
+        "user_message": user_message,
+        "chat_history": chat_history,
+        "product_info": product_info
+    }
+
+    if stream:
+        # 流式执行：intent、action 一解析完就可以开始处理，不用等 response 生成完
+        def on_field(name, value):
+            if name in ("intent", "action"):
+                print(f"  已确定 {name}: {value}")
+
+        result, metrics = asyncio.run(
+            astream_chain(routed_customer_service_chain, inputs, schema=CustomerServiceResponse, on_field=on_field)
+        )
+        print(f"  {format_metrics(metrics)}")
+    else:
+        # 执行
+        result = routed_customer_service_chain.invoke(inputs)
+
+    print(f"客服机器人分析结果: {result}")
+
+    # 需要理解上下文的消息交给模型
+    complaint = routed_customer_service_chain.invoke({**inputs, "user_message": "价格太贵了，我要投诉，还要退款"})
+    print(f"复杂消息（模型处理）: {complaint}")
+    print(f"预路由统计: {intent_router.stats()}")
+    print()
 
-print("生成的API文档模板:")
-print(api_doc)
-print()
-
-print("=== 总结 ===")
-print("PromptTemplate 的实际价值：")
-print("🔧 构建可复用的提示工程组件")
-print("🔗 与LangChain生态系统无缝集成")
-print("🎯 实现复杂的业务逻辑和条件判断")
-print("📊 支持结构化输出和数据解析")
-print("🌍 支持多语言和多场景适配")
-print("⚡ 提高开发效率和代码可维护性") 
\ No newline at end of file
+
+def run_code_review(stream=False):
+    print("场景2：代码审查助手")
+    # 模拟代码审查
+    python_code = """
+def calculate_fibonacci(n):
+    if n <= 1:
+        return n
+    return calculate_fibonacci(n-1) + calculate_fibonacci(n-2)
+
+result = calculate_fibonacci(100)
+print(result)
+"""
+
+    inputs = {
+        "language": "python",
+        "code": python_code
+    }
+
+    print("代码审查结果:")
+    if stream:
+        # 流式执行：每个字段解析完整后立即打印
+        review_result, metrics = asyncio.run(
+            astream_chain(
+                code_review_chain, inputs, schema=CodeReviewResult,
+                on_field=lambda name, value: print(f"  {name}: {value}"),
+            )
+        )
+        print(f"  {format_metrics(metrics)}")
+    else:
+        # 执行代码审查，代码较短时只有一个片段，与直接调用 code_review_chain 相同
+        review_result = asyncio.run(code_review_pipeline.areview(python_code, "python"))
+        print(review_result)
+
+        # 大文件：审查本脚本，改动一处后再审查一次，未改动的片段直接复用结果
+        with open(__file__, encoding="utf-8") as f:
+            source = f.read()
+        large_result = asyncio.run(code_review_pipeline.areview(source, "python"))
+        print(f"\n大文件审查评分: {large_result.score}，问题 {len(large_result.issues)} 条")
+        edited = source.replace("def run_document():", "def run_document():\n    # 修改后重新审查")
+        edited_result = asyncio.run(code_review_pipeline.areview(edited, "python"))
+        print(edited_result.overall_comment.splitlines()[0])
+        print(f"片段缓存统计: {code_review_pipeline.stats()}")
+    print()
+
+
+def run_translation():
+    print("场景3：多语言翻译系统")
+    text = "我们很高兴地通知您，您的订单已经发货了。"
+
+    # 两种翻译互不依赖，并行执行
+    results = RunnableParallel(formal=formal_chain, casual=casual_chain).invoke({"text": text})
+
+    print("正式翻译（商务邮件）:")
+    print(results["formal"])
+    print("\n非正式翻译（社交媒体）:")
+    print(results["casual"])
+    print()
+
+    # 批量翻译：同一语言对的多条文本并发执行，按输入顺序输出
+    texts = ["您的订单已发货", "感谢您的耐心等待", "如有问题请联系客服"]
+
+    async def translate_all():
+        async for index, result in atranslate_batch(texts, "中文", "英文", "商务邮件"):
+            print(f"[{index}] {texts[index]} -> {result}")
+
+    print("批量翻译（商务邮件）:")
+    asyncio.run(translate_all())
+    print()
+
+    # 打包翻译：几十条界面文案合并成一个请求，按编号拆回结果
+    ui_strings = ["保存", "取消", "删除", "确认删除该项目？", "设置", "保存"] * 5 + [f"第 {i} 页" for i in range(20)]
+    translations = asyncio.run(packed_translator.atranslate(ui_strings, "中文", "英文", "软件界面"))
+    print("打包翻译（软件界面）:")
+    for text, translation in list(zip(ui_strings, translations))[:6]:
+        print(f"  {text} -> {translation}")
+    print(f"  打包翻译统计: {packed_translator.stats()}")
+    print()
+
+
+def run_document():
+    print("场景4：智能文档生成")
+    # 生成API文档
+    api_doc = document_template.format(
+        project_name="用户管理系统",
+        tech_stack="Python + FastAPI + PostgreSQL",
+        features="用户注册、登录、权限管理、数据统计",
+        target_users="开发者和系统管理员",
+        doc_type="API文档",
+        requirements="- 接口说明\n- 请求参数\n- 响应格式\n- 错误码",
+        style="技术文档",
+        length="详细"
+    )
+
+    print("生成的API文档模板:")
+    print(api_doc)
+    print()
+
+
+def main(stream=False):
+    print("=== PromptTemplate 实际应用价值演示 ===\n")
+    run_customer_service(stream)
+    run_code_review(stream)
+    run_translation()
+    run_document()
+
+    print("前缀缓存命中统计：")
+    print(format_prompt_cache_stats())
+    print(f"结构化输出统计：{get_structured_output_stats().stats()}")
+    print()
+
+    print("=== 总结 ===")
+    print("PromptTemplate 的实际价值：")
+    print("🔧 构建可复用的提示工程组件")
+    print("🔗 与LangChain生态系统无缝集成")
+    print("🎯 实现复杂的业务逻辑和条件判断")
+    print("📊 支持结构化输出和数据解析")
+    print("🌍 支持多语言和多场景适配")
+    print("⚡ 提高开发效率和代码可维护性")
+
+
+if __name__ == "__main__":
+    # STREAM_OUTPUT=true 时使用流式执行并打印 TTFT 和 token 速率
+    main(stream=os.getenv("STREAM_OUTPUT", "").lower() in ("1", "true", "yes"))
@@ -0,0 +1,407 @@
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from sse_starlette import EventSourceResponse
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+import asyncio
+import logging
+import xxhash
+import orjson
+import time
+import os
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 把 real_world_example 的场景链发布成异步 HTTP 服务：
+# - POST /v1/{scenario} 返回 JSON，POST /v1/{scenario}/stream 以 SSE 流式返回
+# - 相同的请求在执行中时合并（single-flight），后来的请求直接共享同一次上游调用，
+#   流式请求从头回放已经收到的分片再继续接收
+# - 同时执行的上游调用数有上限，排队数也有上限，超出时立即返回 503 和 Retry-After
+# - 关闭时不再接收新请求，等待执行中的调用完成后再退出
+# 场景链在启动时才导入，导入本模块只加载 starlette
+
+
+class Overloaded(Exception):
+    """排队已满或排队超时"""
+
+
+@dataclass
+class Scenario:
+    name: str
+    required: list
+    # prepare(inputs) -> (runnable, runnable_inputs)
+    prepare: object
+    schema: object = None
+
+
+def build_scenarios():
+    import real_world_example as rwe
+
+    def passthrough(chain):
+        return lambda inputs: (chain, inputs)
+
+    def translation(inputs):
+        chain = rwe.create_translation_chain(
+            inputs.get("source_lang", "中文"), inputs.get("target_lang", "英文"), inputs.get("context", "")
+        )
+        return chain, {"text": inputs["text"]}
+
+    return {
+        "customer_service": Scenario(
+            "customer_service", ["user_message", "chat_history", "product_info"],
+            passthrough(rwe.routed_customer_service_chain), rwe.CustomerServiceResponse,
+        ),
+        "code_review": Scenario(
+            "code_review", ["language", "code"], passthrough(rwe.code_review_pipeline.as_runnable()), rwe.CodeReviewResult,
+        ),
+        "translation": Scenario("translation", ["text"], translation),
+        "document": Scenario(
+            "document",
+            ["project_name", "tech_stack", "features", "target_users", "doc_type", "requirements", "style", "length"],
+            passthrough(rwe.document_chain),
+        ),
+    }
+
+
+class Flight:
+    """一次正在执行的上游调用，所有合并进来的请求共享它的分片和结果"""
+
+    def __init__(self):
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Condition()
+        self.task = None
+
+    async def publish(self, chunk):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, result=None, error=None):
+        async with self._changed:
+            self.result, self.error, self.done = result, error, True
+            self._changed.notify_all()
+
+    async def wait(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    async def subscribe(self):
+        """从头回放已有分片，然后继续接收新分片，直到调用结束"""
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.chunks) > index or self.done)
+                pending = self.chunks[index:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                break
+        if self.error is not None:
+            raise self.error
+
+
+class Admission:
+    """限制同时执行的上游调用数和排队数"""
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.running = 0
+
+    def full(self):
+        return self.waiting >= self.max_queue and self._semaphore.locked()
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.full():
+            raise Overloaded("排队已满")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded("排队超时") from None
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+
+@dataclass
+class ServiceState:
+    scenarios: dict
+    admission: Admission
+    flights: dict = field(default_factory=dict)
+    draining: bool = False
+    counters: dict = field(default_factory=lambda: {
+        "requests": 0, "coalesced": 0, "upstream_calls": 0, "rejected": 0, "errors": 0,
+    })
+
+
+def request_key(scenario, inputs, stream):
+    """合并请求的键：场景、模式和按键排序后的输入"""
+    payload = orjson.dumps(inputs, option=orjson.OPT_SORT_KEYS)
+    return f"{scenario}:{int(stream)}:{xxhash.xxh3_128_hexdigest(payload)}"
+
+
+def _to_jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "content"):
+        return value.content
+    return value
+
+
+async def _run_flight(state, flight, key, scenario, inputs, stream):
+    """领头请求在后台执行上游调用，结果写入 flight"""
+    from metrics import profile_if_slow
+
+    try:
+        async with state.admission.slot():
+            # cProfile 会记录事件循环上所有协程，只有串行处理请求时结果才只属于这一个请求
+            sample_rate = None if state.admission.max_concurrency == 1 else 0
+            with profile_if_slow(f"service_{scenario.name}", sample_rate):
+                state.counters["upstream_calls"] += 1
+                runnable, runnable_inputs = scenario.prepare(inputs)
+                if stream:
+                    final = None
+                    async for chunk in runnable.astream(runnable_inputs):
+                        final = chunk if final is None or isinstance(chunk, dict) else final + chunk
+                        await flight.publish(chunk)
+                    if scenario.schema is not None and isinstance(final, dict):
+                        final = scenario.schema.model_validate(final)
+                    await flight.finish(result=final)
+                else:
+                    await flight.finish(result=await runnable.ainvoke(runnable_inputs))
+    except BaseException as e:
+        if not isinstance(e, (Overloaded, asyncio.CancelledError)):
+            state.counters["errors"] += 1
+            logger.exception("场景 %s 执行失败", scenario.name)
+        await flight.finish(error=e if isinstance(e, Exception) else Overloaded("服务正在关闭"))
+        if isinstance(e, asyncio.CancelledError):
+            raise
+    finally:
+        state.flights.pop(key, None)
+
+
+def _join_flight(state, scenario, inputs, stream):
+    """返回 (flight, 是否合并到已有调用)"""
+    key = request_key(scenario.name, inputs, stream)
+    flight = state.flights.get(key)
+    if flight is not None:
+        state.counters["coalesced"] += 1
+        return flight, True
+    flight = Flight()
+    state.flights[key] = flight
+    # 上游调用与发起请求的连接解耦，客户端断开不会取消其他合并进来的请求
+    flight.task = asyncio.create_task(_run_flight(state, flight, key, scenario, inputs, stream))
+    return flight, False
+
+
+async def _parse_request(request):
+    """返回 (scenario, inputs)，请求不合法时返回 (None, 错误响应)"""
+    state = request.app.state.service
+    state.counters["requests"] += 1
+    if state.draining:
+        state.counters["rejected"] += 1
+        return None, JSONResponse({"error": "服务正在关闭"}, status_code=503, headers={"Retry-After": "5"})
+
+    scenario = state.scenarios.get(request.path_params["scenario"])
+    if scenario is None:
+        return None, JSONResponse({"error": f"未知场景: {request.path_params['scenario']}"}, status_code=404)
+    try:
+        inputs = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        return None, JSONResponse({"error": "请求体不是合法的 JSON"}, status_code=400)
+    if not isinstance(inputs, dict):
+        return None, JSONResponse({"error": "请求体必须是 JSON 对象"}, status_code=400)
+    missing = [name for name in scenario.required if name not in inputs]
+    if missing:
+        return None, JSONResponse({"error": f"缺少字段: {', '.join(missing)}"}, status_code=422)
+    return scenario, inputs
+
+
+def _overloaded_response(state, error):
+    state.counters["rejected"] += 1
+    return JSONResponse({"error": str(error)}, status_code=503, headers={"Retry-After": "1"})
+
+
+async def invoke_endpoint(request):
+    scenario, inputs = await _parse_request(request)
+    if scenario is None:
+        return inputs
+    state = request.app.state.service
+    flight, coalesced = _join_flight(state, scenario, inputs, stream=False)
+    started = time.perf_counter()
+    try:
+        result = await flight.wait()
+    except Overloaded as e:
+        return _overloaded_response(state, e)
+    except Exception as e:
+        return JSONResponse({"error": f"上游调用失败: {e}"}, status_code=502)
+    return JSONResponse({
+        "scenario": scenario.name,
+        "result": _to_jsonable(result),
+        "coalesced": coalesced,
+        "duration": time.perf_counter() - started,
+    })
+
+
+async def stream_endpoint(request):
+    scenario, inputs = await _parse_request(request)
+    if scenario is None:
+        return inputs
+    state = request.app.state.service
+    # 排队已满时直接拒绝，不建立 SSE 连接
+    if state.admission.full():
+        return _overloaded_response(state, Overloaded("排队已满"))
+    flight, coalesced = _join_flight(state, scenario, inputs, stream=True)
+
+    async def events():
+        started = time.perf_counter()
+        first_at = None
+        try:
+            async for chunk in flight.subscribe():
+                if first_at is None:
+                    first_at = time.perf_counter()
+                # JSON 链产出累积的部分对象，文本链产出增量文本
+                event = "partial" if isinstance(chunk, dict) or hasattr(chunk, "model_dump") else "token"
+                yield {"event": event, "data": orjson.dumps(_to_jsonable(chunk)).decode()}
+        except Overloaded as e:
+            state.counters["rejected"] += 1
+            yield {"event": "error", "data": orjson.dumps({"error": str(e), "retry_after": 1}).decode()}
+            return
+        except Exception as e:
+            yield {"event": "error", "data": orjson.dumps({"error": f"上游调用失败: {e}"}).decode()}
+            return
+        yield {"event": "done", "data": orjson.dumps({
+            "result": _to_jsonable(flight.result),
+            "coalesced": coalesced,
+            "ttft": None if first_at is None else first_at - started,
+            "duration": time.perf_counter() - started,
+        }).decode()}
+
+    # 客户端长时间不读取时断开，避免慢客户端占住连接
+    send_timeout = float(os.getenv("SERVICE_SEND_TIMEOUT", "30"))
+    return EventSourceResponse(events(), ping=15, send_timeout=send_timeout)
+
+
+async def health(request):
+    state = request.app.state.service
+    status = 503 if state.draining else 200
+    return JSONResponse({"status": "draining" if state.draining else "ok"}, status_code=status)
+
+
+async def stats(request):
+    from rate_limiter import rate_limiter_stats
+    from prompt_cache import get_prompt_cache_stats
+    from model_cascade import cascade_stats
+    import real_world_example
+
+    state = request.app.state.service
+    return JSONResponse({
+        **state.counters,
+        "in_flight": len(state.flights),
+        "running": state.admission.running,
+        "queued": state.admission.waiting,
+        "rate_limiters": rate_limiter_stats(),
+        "intent_router": real_world_example.intent_router.stats(),
+        "prompt_cache": get_prompt_cache_stats().stats(),
+        "model_cascade": cascade_stats(),
+    })
+
+
+async def metrics_endpoint(request):
+    """Prometheus 文本格式；?format=json 时返回 JSON 快照"""
+    from metrics import get_metrics
+
+    registry = get_metrics()
+    if request.query_params.get("format") == "json":
+        return Response(orjson.dumps(registry.snapshot()), media_type="application/json")
+    return PlainTextResponse(registry.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    state = ServiceState(
+        scenarios=build_scenarios(),
+        admission=Admission(
+            max_concurrency=int(os.getenv("SERVICE_MAX_CONCURRENCY", "16")),
+            max_queue=int(os.getenv("SERVICE_MAX_QUEUE", "64")),
+            queue_timeout=float(os.getenv("SERVICE_QUEUE_TIMEOUT", "30")),
+        ),
+    )
+    app.state.service = state
+    if float(os.getenv("PROFILE_SAMPLE_RATE", "0")) > 0 and state.admission.max_concurrency > 1:
+        logger.warning("PROFILE_SAMPLE_RATE 只在 SERVICE_MAX_CONCURRENCY=1 时生效，并发处理请求时不做抽样分析")
+    try:
+        yield
+    finally:
+        # 优雅关闭：拒绝新请求，等待执行中的上游调用完成，超时后取消
+        state.draining = True
+        tasks = [flight.task for flight in list(state.flights.values()) if flight.task is not None]
+        if tasks:
+            timeout = float(os.getenv("SERVICE_SHUTDOWN_TIMEOUT", "30"))
+            logger.info("等待 %d 个执行中的调用完成", len(tasks))
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        from model_factory import aclose_http_clients
+
+        await aclose_http_clients()
+
+
+def create_app():
+    return Starlette(
+        routes=[
+            Route("/healthz", health, methods=["GET"]),
+            Route("/stats", stats, methods=["GET"]),
+            Route("/metrics", metrics_endpoint, methods=["GET"]),
+            Route("/v1/{scenario}", invoke_endpoint, methods=["POST"]),
+            Route("/v1/{scenario}/stream", stream_endpoint, methods=["POST"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
+
+
+def run(host=None, port=None):
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=host or os.getenv("SERVICE_HOST", "127.0.0.1"),
+        port=port or int(os.getenv("SERVICE_PORT", "8000")),
+        # uvicorn 收到退出信号后等待连接结束的时间，之后才执行 lifespan 的清理
+        timeout_graceful_shutdown=float(os.getenv("SERVICE_SHUTDOWN_TIMEOUT", "30")),
+        log_level="info",
+    )
+
+
+if __name__ == "__main__":
+    run()
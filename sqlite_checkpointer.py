@@ -0,0 +1,425 @@
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+from pathlib import Path
+import threading
+import asyncio
+import zstandard
+import random
+import time
+import os
+
+# 加载环境变量
+load_dotenv()
+
+# LangGraph 的 SQLite 持久化 checkpointer：每一步执行完都保存状态，进程崩溃或超时后
+# 用同一个 thread_id 可以从最后完成的步骤继续，已经完成的模型调用和工具调用不会重做。
+# 和内存版一样按通道版本单独存储通道值，每一步只写入发生变化的通道（通常只有新增的消息）；
+# 序列化沿用 JsonPlusSerializer 的 ormsgpack 编码，较大的值再用 zstd 压缩。
+# 每个会话只保留最近的若干个 checkpoint，长时间不活跃的会话整体删除
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        checkpoint_id TEXT NOT NULL,
+        parent_checkpoint_id TEXT,
+        type TEXT NOT NULL,
+        checkpoint BLOB NOT NULL,
+        metadata_type TEXT NOT NULL,
+        metadata BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        channel TEXT NOT NULL,
+        version TEXT NOT NULL,
+        type TEXT NOT NULL,
+        blob BLOB,
+        PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS checkpoint_writes (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        checkpoint_id TEXT NOT NULL,
+        task_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        channel TEXT NOT NULL,
+        type TEXT NOT NULL,
+        value BLOB,
+        task_path TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS checkpoints_created ON checkpoints (created_at)",
+]
+
+
+def _default_checkpoint_path():
+    return Path(os.getenv("CHECKPOINT_PATH", "") or Path.home() / ".cache" / "ai_agent" / "checkpoints.sqlite3")
+
+
+class ZstdSerializer(JsonPlusSerializer):
+    """在 JsonPlusSerializer（ormsgpack 编码）之上，对超过阈值的数据做 zstd 压缩"""
+
+    SUFFIX = "+zstd"
+
+    def __init__(self, level=None, min_size=None):
+        super().__init__()
+        self.min_size = min_size or int(os.getenv("CHECKPOINT_ZSTD_MIN_BYTES", "1024"))
+        self._compressor = zstandard.ZstdCompressor(level=level or int(os.getenv("CHECKPOINT_ZSTD_LEVEL", "3")))
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def dumps_typed(self, obj):
+        type_, data = super().dumps_typed(obj)
+        if len(data) >= self.min_size:
+            return type_ + self.SUFFIX, self._compressor.compress(data)
+        return type_, data
+
+    def loads_typed(self, data):
+        type_, payload = data
+        if type_.endswith(self.SUFFIX):
+            return super().loads_typed((type_[:-len(self.SUFFIX)], self._decompressor.decompress(payload)))
+        return super().loads_typed((type_, payload))
+
+
+def _thread_config(thread_id, checkpoint_ns, checkpoint_id):
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver):
+    """持久化到 SQLite 的 checkpointer，同时支持同步和异步接口"""
+
+    def __init__(self, path=None, keep_last=None, ttl=None, serde=None):
+        super().__init__(serde=serde or ZstdSerializer())
+        self.path = Path(path or _default_checkpoint_path())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 每个会话保留的 checkpoint 个数，以及会话最后一次更新后的保留时间
+        self.keep_last = keep_last or int(os.getenv("CHECKPOINT_KEEP_LAST", "20"))
+        self.ttl = ttl or float(os.getenv("CHECKPOINT_TTL", str(7 * 86400)))
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        self.engine = create_engine(
+            f"sqlite:///{self.path}",
+            connect_args={"check_same_thread": False},
+        )
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.exec_driver_sql(statement)
+
+    # --- 读取 ---
+
+    def _load_blobs(self, conn, thread_id, checkpoint_ns, versions):
+        values = {}
+        for channel, version in versions.items():
+            row = conn.execute(
+                text(
+                    "SELECT type, blob FROM checkpoint_blobs WHERE thread_id = :thread_id "
+                    "AND checkpoint_ns = :ns AND channel = :channel AND version = :version"
+                ),
+                {"thread_id": thread_id, "ns": checkpoint_ns, "channel": channel, "version": str(version)},
+            ).first()
+            if row is not None and row.type != "empty":
+                values[channel] = self.serde.loads_typed((row.type, row.blob))
+        return values
+
+    def _build_tuple(self, conn, row):
+        checkpoint = self.serde.loads_typed((row.type, row.checkpoint))
+        checkpoint["channel_values"] = self._load_blobs(
+            conn, row.thread_id, row.checkpoint_ns, checkpoint["channel_versions"]
+        )
+        writes = conn.execute(
+            text(
+                "SELECT task_id, channel, type, value FROM checkpoint_writes "
+                "WHERE thread_id = :thread_id AND checkpoint_ns = :ns AND checkpoint_id = :checkpoint_id "
+                "ORDER BY task_id, idx"
+            ),
+            {"thread_id": row.thread_id, "ns": row.checkpoint_ns, "checkpoint_id": row.checkpoint_id},
+        ).all()
+        return CheckpointTuple(
+            config=_thread_config(row.thread_id, row.checkpoint_ns, row.checkpoint_id),
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed((row.metadata_type, row.metadata)),
+            parent_config=(
+                _thread_config(row.thread_id, row.checkpoint_ns, row.parent_checkpoint_id)
+                if row.parent_checkpoint_id else None
+            ),
+            pending_writes=[
+                (write.task_id, write.channel, self.serde.loads_typed((write.type, write.value)))
+                for write in writes
+            ],
+        )
+
+    def get_tuple(self, config):
+        configurable = config["configurable"]
+        params = {"thread_id": configurable["thread_id"], "ns": configurable.get("checkpoint_ns", "")}
+        query = "SELECT * FROM checkpoints WHERE thread_id = :thread_id AND checkpoint_ns = :ns"
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = :checkpoint_id"
+            params["checkpoint_id"] = checkpoint_id
+        else:
+            # checkpoint_id 单调递增，取最新的一个
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self.engine.connect() as conn:
+            row = conn.execute(text(query), params).first()
+            return None if row is None else self._build_tuple(conn, row)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = "SELECT * FROM checkpoints WHERE 1 = 1"
+        params = {}
+        if config:
+            configurable = config["configurable"]
+            query += " AND thread_id = :thread_id"
+            params["thread_id"] = configurable["thread_id"]
+            if configurable.get("checkpoint_ns") is not None:
+                query += " AND checkpoint_ns = :ns"
+                params["ns"] = configurable["checkpoint_ns"]
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND checkpoint_id = :checkpoint_id"
+                params["checkpoint_id"] = checkpoint_id
+        if before and (before_id := get_checkpoint_id(before)):
+            query += " AND checkpoint_id < :before_id"
+            params["before_id"] = before_id
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(query), params).all()
+            for row in rows:
+                if limit is not None and limit <= 0:
+                    break
+                if filter:
+                    metadata = self.serde.loads_typed((row.metadata_type, row.metadata))
+                    if not all(metadata.get(key) == value for key, value in filter.items()):
+                        continue
+                if limit is not None:
+                    limit -= 1
+                yield self._build_tuple(conn, row)
+
+    # --- 写入 ---
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+
+        # 只写入这一步发生变化的通道
+        blobs = []
+        for channel, version in new_versions.items():
+            type_, blob = self.serde.dumps_typed(values[channel]) if channel in values else ("empty", None)
+            blobs.append({
+                "thread_id": thread_id, "ns": checkpoint_ns, "channel": channel,
+                "version": str(version), "type": type_, "blob": blob,
+            })
+        type_, payload = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_payload = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        with self.engine.begin() as conn:
+            if blobs:
+                conn.execute(
+                    text(
+                        "INSERT OR REPLACE INTO checkpoint_blobs (thread_id, checkpoint_ns, channel, version, type, blob) "
+                        "VALUES (:thread_id, :ns, :channel, :version, :type, :blob)"
+                    ),
+                    blobs,
+                )
+            conn.execute(
+                text(
+                    "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                    "type, checkpoint, metadata_type, metadata, created_at) "
+                    "VALUES (:thread_id, :ns, :checkpoint_id, :parent_id, :type, :checkpoint, :metadata_type, :metadata, :now)"
+                ),
+                {
+                    "thread_id": thread_id,
+                    "ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint["id"],
+                    "parent_id": configurable.get("checkpoint_id"),
+                    "type": type_,
+                    "checkpoint": payload,
+                    "metadata_type": metadata_type,
+                    "metadata": metadata_payload,
+                    "now": time.time(),
+                },
+            )
+
+        with self._lock:
+            self._puts += 1
+            # 每写入一定次数才清理一次旧 checkpoint，避免每一步都扫表
+            should_prune = self._puts % 50 == 0
+        if should_prune:
+            self.prune()
+        return _thread_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        configurable = config["configurable"]
+        rows = []
+        for index, (channel, value) in enumerate(writes):
+            type_, payload = self.serde.dumps_typed(value)
+            rows.append({
+                "thread_id": configurable["thread_id"],
+                "ns": configurable.get("checkpoint_ns", ""),
+                "checkpoint_id": configurable["checkpoint_id"],
+                "task_id": task_id,
+                "idx": WRITES_IDX_MAP.get(channel, index),
+                "channel": channel,
+                "type": type_,
+                "value": payload,
+                "task_path": task_path,
+            })
+        if not rows:
+            return
+        # 错误、中断等特殊写入（idx < 0）每次覆盖，普通写入已存在时保留原值
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"{verb} INTO checkpoint_writes "
+                    "(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path) "
+                    "VALUES (:thread_id, :ns, :checkpoint_id, :task_id, :idx, :channel, :type, :value, :task_path)"
+                ),
+                rows,
+            )
+
+    def delete_thread(self, thread_id):
+        with self.engine.begin() as conn:
+            for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+                conn.execute(text(f"DELETE FROM {table} WHERE thread_id = :thread_id"), {"thread_id": thread_id})
+
+    def prune(self, thread_id=None):
+        """删除过期会话，并让每个会话只保留最近 keep_last 个 checkpoint，返回删除的 checkpoint 数"""
+        removed = 0
+        with self.engine.begin() as conn:
+            # 最后一次更新早于 TTL 的会话整体删除
+            expired = conn.execute(
+                text("SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < :deadline"),
+                {"deadline": time.time() - self.ttl},
+            ).scalars().all()
+            for expired_id in expired:
+                for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+                    result = conn.execute(
+                        text(f"DELETE FROM {table} WHERE thread_id = :thread_id"), {"thread_id": expired_id}
+                    )
+                    if table == "checkpoints":
+                        removed += result.rowcount
+
+            scope = "WHERE thread_id = :thread_id" if thread_id else ""
+            stale = conn.execute(
+                text(
+                    "SELECT thread_id, checkpoint_ns, checkpoint_id FROM ("
+                    " SELECT thread_id, checkpoint_ns, checkpoint_id,"
+                    "  ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rank"
+                    f" FROM checkpoints {scope}"
+                    ") WHERE rank > :keep_last"
+                ),
+                {"thread_id": thread_id, "keep_last": self.keep_last},
+            ).all()
+            if stale:
+                keys = [{"thread_id": row[0], "ns": row[1], "checkpoint_id": row[2]} for row in stale]
+                for table in ("checkpoints", "checkpoint_writes"):
+                    conn.execute(
+                        text(
+                            f"DELETE FROM {table} WHERE thread_id = :thread_id "
+                            "AND checkpoint_ns = :ns AND checkpoint_id = :checkpoint_id"
+                        ),
+                        keys,
+                    )
+                removed += len(stale)
+                for thread_ns in {(row[0], row[1]) for row in stale}:
+                    self._prune_blobs(conn, *thread_ns)
+        return removed
+
+    def _prune_blobs(self, conn, thread_id, checkpoint_ns):
+        """删除剩余 checkpoint 都不再引用的通道版本"""
+        referenced = set()
+        rows = conn.execute(
+            text("SELECT type, checkpoint FROM checkpoints WHERE thread_id = :thread_id AND checkpoint_ns = :ns"),
+            {"thread_id": thread_id, "ns": checkpoint_ns},
+        ).all()
+        for row in rows:
+            checkpoint = self.serde.loads_typed((row.type, row.checkpoint))
+            referenced.update((channel, str(version)) for channel, version in checkpoint["channel_versions"].items())
+        blobs = conn.execute(
+            text("SELECT channel, version FROM checkpoint_blobs WHERE thread_id = :thread_id AND checkpoint_ns = :ns"),
+            {"thread_id": thread_id, "ns": checkpoint_ns},
+        ).all()
+        orphans = [
+            {"thread_id": thread_id, "ns": checkpoint_ns, "channel": channel, "version": version}
+            for channel, version in blobs if (channel, version) not in referenced
+        ]
+        if orphans:
+            conn.execute(
+                text(
+                    "DELETE FROM checkpoint_blobs WHERE thread_id = :thread_id AND checkpoint_ns = :ns "
+                    "AND channel = :channel AND version = :version"
+                ),
+                orphans,
+            )
+
+    def get_next_version(self, current, channel):
+        # 与内存版相同的字符串版本号：整数部分递增，可以直接按字符串排序
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # --- 异步接口：SQLite 操作放到线程池执行，不阻塞事件循环 ---
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def stats(self):
+        with self.engine.connect() as conn:
+            threads, checkpoints = conn.execute(
+                text("SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints")
+            ).one()
+            blobs = conn.execute(text("SELECT COUNT(*) FROM checkpoint_blobs")).scalar()
+        return {"threads": threads, "checkpoints": checkpoints, "blobs": blobs}
+
+
+_shared_checkpointer = None
+_shared_lock = threading.Lock()
+
+
+def get_checkpointer():
+    """进程内共享的 checkpointer，CHECKPOINT_ENABLED=false 时返回 None"""
+    global _shared_checkpointer
+    if os.getenv("CHECKPOINT_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    with _shared_lock:
+        if _shared_checkpointer is None:
+            _shared_checkpointer = SQLiteCheckpointSaver()
+        return _shared_checkpointer
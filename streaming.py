@@ -0,0 +1,128 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from dataclasses import dataclass, field
+import time
+
+# 链的流式执行：用 astream 逐块获取输出，JsonOutputParser 会随着字段到达
+# 产出不断完善的部分结果。每次调用记录首 token 时间（TTFT）和 token 速率
+
+
+@dataclass
+class StreamMetrics:
+    """一次流式调用的时延和吞吐数据"""
+
+    started_at: float = field(default_factory=time.perf_counter)
+    first_token_at: float = None
+    first_output_at: float = None
+    finished_at: float = None
+    chunks: int = 0
+    output_tokens: int = None
+
+    @property
+    def ttft(self):
+        """首 token 时间（秒）。命中响应缓存时没有 token 回调，取首个输出的时间"""
+        first = self.first_token_at or self.first_output_at
+        return None if first is None else first - self.started_at
+
+    @property
+    def duration(self):
+        return None if self.finished_at is None else self.finished_at - self.started_at
+
+    @property
+    def tokens(self):
+        # 优先使用服务端返回的 usage，没有时按流式分片数估算
+        return self.output_tokens if self.output_tokens is not None else self.chunks
+
+    @property
+    def tokens_per_sec(self):
+        first = self.first_token_at or self.first_output_at
+        # 命中响应缓存时没有 token 回调，不计算速率
+        if not self.tokens or first is None or self.finished_at is None or self.finished_at <= first:
+            return None
+        return self.tokens / (self.finished_at - first)
+
+    def as_dict(self):
+        return {
+            "ttft": self.ttft,
+            "duration": self.duration,
+            "tokens": self.tokens,
+            "tokens_per_sec": self.tokens_per_sec,
+        }
+
+
+class StreamMetricsHandler(BaseCallbackHandler):
+    """在模型回调里记录首 token 时间和 token 数"""
+
+    # 直接在事件循环里执行，避免每个 token 都切换到线程池
+    run_inline = True
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def on_llm_new_token(self, token, **kwargs):
+        if not token:
+            return
+        if self.metrics.first_token_at is None:
+            self.metrics.first_token_at = time.perf_counter()
+        self.metrics.chunks += 1
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage and "output_tokens" in usage:
+                    self.metrics.output_tokens = (self.metrics.output_tokens or 0) + usage["output_tokens"]
+
+
+async def astream_chain(chain, inputs, schema=None, on_partial=None, on_field=None, config=None):
+    """流式执行链，返回 (最终结果, StreamMetrics)
+
+    on_partial(partial)：每次输出变化时调用。JSON 链传入 schema 时，
+        partial 是未经校验的 schema 实例（model_construct），字段可能还不完整，
+        返回的最终结果是校验过的 schema 实例
+    on_field(name, value)：JSON 链中某个字段确定完整时调用一次，
+        不必等整个响应结束就可以根据 intent、action 等字段开始处理
+    """
+    metrics = StreamMetrics()
+    config = dict(config or {})
+    config["callbacks"] = [*(config.get("callbacks") or []), StreamMetricsHandler(metrics)]
+
+    final = None
+    completed = set()
+    async for chunk in chain.astream(inputs, config):
+        if metrics.first_output_at is None:
+            metrics.first_output_at = time.perf_counter()
+        if hasattr(chunk, "model_dump"):
+            # 不经过模型的分支（如本地预路由）直接产出完整的模型实例
+            chunk = chunk.model_dump()
+
+        if isinstance(chunk, dict):
+            # JsonOutputParser 每次产出累积的完整对象，出现新键说明前面的键已经解析完
+            final = chunk
+            if on_field is not None:
+                for key in list(chunk)[:-1]:
+                    if key not in completed:
+                        completed.add(key)
+                        on_field(key, chunk[key])
+            if on_partial is not None:
+                on_partial(schema.model_construct(**chunk) if schema else chunk)
+        else:
+            final = chunk if final is None else final + chunk
+            if on_partial is not None:
+                on_partial(chunk)
+
+    metrics.finished_at = time.perf_counter()
+    if isinstance(final, dict) and on_field is not None:
+        for key, value in final.items():
+            if key not in completed:
+                on_field(key, value)
+    if isinstance(final, dict) and schema is not None:
+        # 流式输出结束时对象已经完整，校验成 schema 实例，与 invoke 的结果一致
+        final = schema.model_validate(final)
+    return final, metrics
+
+
+def format_metrics(metrics):
+    """把流式指标格式化成一行便于打印的文本"""
+    ttft = "-" if metrics.ttft is None else f"{metrics.ttft * 1000:.0f}ms"
+    rate = "-" if metrics.tokens_per_sec is None else f"{metrics.tokens_per_sec:.1f} tokens/s"
+    return f"TTFT {ttft}，总耗时 {metrics.duration:.2f}s，{metrics.tokens} tokens，{rate}"
@@ -0,0 +1,400 @@
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers.transform import BaseCumulativeTransformOutputParser
+from langchain_core.outputs import Generation
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, SystemMessagePromptTemplate
+from langchain_core.runnables import RunnableLambda
+from dotenv import load_dotenv
+import threading
+import logging
+import openai
+import orjson
+import os
+import re
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 结构化输出：提示里不再手写 JSON 示例，而是把 Pydantic 模型的 JSON Schema 交给服务端
+# （response_format=json_schema 或强制工具调用），输出用 orjson 直接解析成模型实例。
+# 输出被截断或格式有小错误时在本地补全，不重新请求；服务端不支持时自动退回到
+# 「提示里附带字段说明 + 本地解析」，并记住该地址不支持，之后的请求直接走退回路径
+#
+# STRUCTURED_OUTPUT_MODE：
+#   auto            优先 json_schema，服务端拒绝时退回 prompt（默认）
+#   json_schema     只用 response_format=json_schema
+#   function_calling 强制调用一个以 schema 为参数的工具
+#   json_mode       response_format=json_object，字段说明写在提示里
+#   prompt          不使用服务端能力，字段说明写在提示里
+
+MODES = ("auto", "json_schema", "function_calling", "json_mode", "prompt")
+
+# 服务端不支持结构化输出时返回的错误类型；还要看错误信息是否和这些参数有关，
+# 上下文超长、内容审核、其他工具参数等同样是 400 的错误不能让整个地址退回提示解析
+UNSUPPORTED_ERRORS = (openai.BadRequestError, openai.UnprocessableEntityError)
+_UNSUPPORTED_HINTS = ("response_format", "json_schema", "tool_choice")
+
+_FENCE_PATTERN = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+
+# with_fallbacks 把原调用的异常放在输入的这个键里交给退回路径
+_ERROR_KEY = "__structured_output_error"
+
+
+def is_unsupported_error(error):
+    """服务端拒绝的是结构化输出参数本身"""
+    message = f"{getattr(error, 'message', '')} {getattr(error, 'body', '') or ''}".lower()
+    return isinstance(error, UNSUPPORTED_ERRORS) and any(hint in message for hint in _UNSUPPORTED_HINTS)
+
+
+# 超过这个长度的输出不做本地修复，避免在事件循环上长时间占用 CPU
+_MAX_REPAIR_CHARS = 200_000
+
+
+def _strip_trailing_commas(text):
+    """去掉 } 和 ] 前多余的逗号，字符串里的内容保持不变
+
+    >>> _strip_trailing_commas('{"a": "x", "b": [1,2,],}')
+    '{"a": "x", "b": [1,2]}'
+    >>> _strip_trailing_commas('{"a": "x,]", "b": 1,}')
+    '{"a": "x,]", "b": 1}'
+    """
+    result = []
+    pending = None
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            result.append(char)
+            continue
+        if pending is not None:
+            if char.isspace():
+                pending.append(char)
+                continue
+            if char not in "}]":
+                result.append(",")
+            result.extend(pending)
+            pending = None
+        if char == ",":
+            pending = []
+            continue
+        if char == '"':
+            in_string = True
+        result.append(char)
+    if pending is not None:
+        result.append(",")
+        result.extend(pending)
+    return "".join(result)
+
+
+def _scan(text):
+    """扫描一遍 JSON 文本，返回 (结束位置, 闭合符, 截断位置, 截断处的闭合符, 最后一个键的起点)
+
+    顶层的括号闭合时结束位置是闭合符之后，后面的说明文字不再扫描，闭合符为空；
+    否则结束位置是文本末尾，闭合符用来补全未闭合的字符串和括号（字符串停在转义符后时丢掉转义符）。
+    截断位置是最后一个完整的值（或刚打开的括号）之后，截断处的闭合符是那时未闭合的括号
+    """
+    closers = []
+    # 每层对象是否在等待键
+    expect_key = []
+    in_string = escaped = is_key = False
+    literal = False
+    cut, cut_closers, key_start = 0, "", -1
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if not is_key:
+                    cut, cut_closers = index + 1, "".join(reversed(closers))
+            continue
+        if literal and (char.isspace() or char in ",}]"):
+            literal = False
+            cut, cut_closers = index, "".join(reversed(closers))
+        if char == '"':
+            in_string = True
+            is_key = bool(expect_key) and expect_key[-1] is True
+            if is_key:
+                key_start = index
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+            expect_key.append(char == "{" or None)
+            cut, cut_closers = index + 1, "".join(reversed(closers))
+        elif char in "}]":
+            if closers:
+                closers.pop()
+                expect_key.pop()
+            if not closers:
+                return index + 1, "", index + 1, "", key_start
+            cut, cut_closers = index + 1, "".join(reversed(closers))
+        elif char == ":":
+            if expect_key and expect_key[-1] is not None:
+                expect_key[-1] = False
+        elif char == ",":
+            if expect_key and expect_key[-1] is not None:
+                expect_key[-1] = True
+        elif not char.isspace():
+            literal = True
+    tail = "".join(reversed(closers))
+    if in_string:
+        tail = '"' + tail
+    end = len(text) - 1 if escaped else len(text)
+    if in_string and is_key:
+        # 停在键里，这个键只能丢掉
+        end, tail = cut, cut_closers
+    return end, tail, cut, cut_closers, key_start
+
+
+def loads_lenient(text, partial=False):
+    """解析模型输出的 JSON，失败时在本地修复后再解析，仍然失败返回 None
+
+    能处理：代码块围栏、JSON 前后的说明文字、多余的尾逗号、
+    输出被截断导致的未闭合字符串和括号、最后一个不完整的键值对。
+    修复只扫描一遍文本；修复时丢掉了键（截断在键或键值对中间）时，
+    除非 partial（流式输出的中间结果），返回 None，不返回缺字段的对象
+
+    >>> loads_lenient('{"a": ["p", "q",], "b": 1,}')
+    {'a': ['p', 'q'], 'b': 1}
+    >>> loads_lenient('{"a": "x", "b": "Sav')
+    {'a': 'x', 'b': 'Sav'}
+    >>> loads_lenient('{"a": 1, "b') is None, loads_lenient('{"a": 1, "b', partial=True)
+    (True, {'a': 1})
+    """
+    if not isinstance(text, str):
+        return text
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+
+    text = _FENCE_PATTERN.sub("", text)
+    start = min((index for index in (text.find("{"), text.find("[")) if index >= 0), default=-1)
+    if start < 0 or len(text) - start > _MAX_REPAIR_CHARS:
+        return None
+    candidate = _strip_trailing_commas(text[start:])
+    end, tail, cut, cut_tail, key_start = _scan(candidate)
+    # 先按原样补全（截断的字符串值、完整的最后一个数字都能保留），不行再退到最后一个完整的值
+    for position, closers in ((end, tail), (cut, cut_tail)):
+        if not partial and key_start >= position:
+            return None
+        try:
+            return orjson.loads(candidate[:position].rstrip().rstrip(",:") + closers)
+        except orjson.JSONDecodeError:
+            continue
+    return None
+
+
+def format_instructions(schema):
+    """不支持 json_schema 时写进提示的字段说明，比手写的 JSON 示例更短"""
+    fields = {
+        name: field.description or name
+        for name, field in schema.model_fields.items()
+    }
+    return "只输出一个JSON对象，字段如下：\n" + orjson.dumps(fields, option=orjson.OPT_INDENT_2).decode()
+
+
+def _strict(json_schema):
+    """strict 模式要求每个对象都禁止额外字段、列出全部字段为必填，嵌套模型在 $defs 里"""
+    for definition in [json_schema, *json_schema.get("$defs", {}).values()]:
+        if definition.get("type") == "object":
+            definition["additionalProperties"] = False
+            definition["required"] = list(definition.get("properties", {}))
+    return json_schema
+
+
+def response_format(schema):
+    """Pydantic 模型对应的 response_format=json_schema 参数（strict 模式）"""
+    json_schema = _strict(schema.model_json_schema())
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.__name__, "schema": json_schema, "strict": True},
+    }
+
+
+def tool_spec(schema):
+    return {
+        "type": "function",
+        "function": {
+            "name": schema.__name__,
+            "description": (schema.__doc__ or schema.__name__).strip(),
+            "parameters": schema.model_json_schema(),
+        },
+    }
+
+
+class StructuredOutputStats:
+    """按链名统计走服务端结构化输出、退回提示解析和本地修复的次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chains = {}
+
+    def record(self, name, key):
+        with self._lock:
+            stats = self._chains.setdefault(name, {"native": 0, "fallback": 0, "repaired": 0, "failed": 0})
+            stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._chains.items()}
+
+    def reset(self):
+        with self._lock:
+            self._chains.clear()
+
+
+_shared_stats = StructuredOutputStats()
+
+
+def get_structured_output_stats():
+    """进程内共享的结构化输出统计"""
+    return _shared_stats
+
+
+class StructuredOutputParser(BaseCumulativeTransformOutputParser):
+    """把模型输出解析成 Pydantic 模型
+
+    完整输出解析为 schema 实例；流式执行时产出累积的部分 dict，
+    与 JsonOutputParser 一致，astream_chain 可以按字段回调
+    """
+
+    pydantic_object: type
+    name: str = "structured"
+    from_tool_call: bool = False
+
+    def _text(self, generation):
+        message = getattr(generation, "message", None)
+        if message is None:
+            return generation.text
+        if not self.from_tool_call:
+            return message.content
+        for call in message.tool_calls:
+            return call["args"]
+        # 参数不是合法 JSON 时 langchain 放进 invalid_tool_calls，保留了原始字符串
+        for call in message.invalid_tool_calls:
+            return call["args"]
+        for chunk in getattr(message, "tool_call_chunks", None) or []:
+            return chunk["args"]
+        return ""
+
+    def parse_result(self, result, *, partial=False):
+        text = self._text(result[0])
+        if partial:
+            data = loads_lenient(text, partial=True) if text else None
+            return data if isinstance(data, dict) else None
+
+        data = text
+        if isinstance(text, str):
+            try:
+                data = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                data = loads_lenient(text)
+                if data is not None:
+                    _shared_stats.record(self.name, "repaired")
+        if not isinstance(data, dict):
+            _shared_stats.record(self.name, "failed")
+            raise OutputParserException(f"无法解析 {self.pydantic_object.__name__}: {str(text)[:200]}", llm_output=str(text))
+        return self.pydantic_object.model_validate(data)
+
+    def parse(self, text):
+        return self.parse_result([Generation(text=text)])
+
+    @property
+    def _type(self):
+        return "structured_output"
+
+
+def with_format_instructions(prompt, schema):
+    """在提示的系统消息末尾附上字段说明，前缀仍然保持静态"""
+    instructions = "\n\n" + format_instructions(schema).replace("{", "{{").replace("}", "}}")
+    if isinstance(prompt, PromptTemplate):
+        return prompt + instructions
+
+    messages = list(prompt.messages)
+    for index, message in enumerate(messages):
+        if isinstance(message, SystemMessagePromptTemplate):
+            messages[index] = SystemMessagePromptTemplate(prompt=message.prompt + instructions)
+            break
+    else:
+        messages.insert(0, SystemMessagePromptTemplate.from_template(instructions.strip()))
+    return ChatPromptTemplate.from_messages(messages)
+
+
+# 已知不支持 json_schema 的服务地址，auto 模式下直接走退回路径
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+
+def _base_url(model):
+    return getattr(model, "openai_api_base", None) or os.getenv("OPENAI_API_BASE", "")
+
+
+def structured_chain(prompt, model, schema, name=None, mode=None):
+    """组装 prompt | model | 解析器，输出 schema 实例
+
+    mode 默认取环境变量 STRUCTURED_OUTPUT_MODE
+    """
+    mode = mode or os.getenv("STRUCTURED_OUTPUT_MODE", "auto")
+    if mode not in MODES:
+        raise ValueError(f"未知的结构化输出模式: {mode}，可选 {', '.join(MODES)}")
+    name = name or schema.__name__
+    parser = StructuredOutputParser(pydantic_object=schema, name=name)
+
+    def counted(key):
+        def record(value):
+            _shared_stats.record(name, key)
+            return value
+        return RunnableLambda(record, name=f"{name}_{key}")
+
+    fallback = counted("fallback") | with_format_instructions(prompt, schema) | model | parser
+    if mode == "prompt":
+        return fallback
+    if mode == "json_mode":
+        return (
+            counted("native") | with_format_instructions(prompt, schema)
+            | model.bind(response_format={"type": "json_object"}) | parser
+        )
+    if mode == "function_calling":
+        return (
+            counted("native") | prompt
+            | model.bind(tools=[tool_spec(schema)], tool_choice={"type": "function", "function": {"name": schema.__name__}})
+            | StructuredOutputParser(pydantic_object=schema, name=name, from_tool_call=True)
+        )
+
+    native = counted("native") | prompt | model.bind(response_format=response_format(schema)) | parser
+    if mode == "json_schema":
+        return native
+
+    base_url = _base_url(model)
+
+    def mark_unsupported(inputs):
+        error = inputs[_ERROR_KEY]
+        if not is_unsupported_error(error):
+            # 与结构化输出无关的 400（上下文超长、内容审核等）照常抛出
+            raise error
+        with _unsupported_lock:
+            if base_url not in _unsupported:
+                logger.warning("%s 不支持 json_schema 结构化输出，退回提示解析", base_url or "当前服务")
+                _unsupported.add(base_url)
+        return {key: value for key, value in inputs.items() if key != _ERROR_KEY}
+
+    # with_fallbacks 会把异常写进输入字典，先复制一份，不改动调用方传入的字典
+    native_with_fallback = RunnableLambda(dict, name=f"{name}_inputs") | native.with_fallbacks(
+        [RunnableLambda(mark_unsupported, name=f"{name}_unsupported") | fallback],
+        exceptions_to_handle=UNSUPPORTED_ERRORS,
+        exception_key=_ERROR_KEY,
+    )
+
+    # 返回的是 Runnable 时 RunnableLambda 会继续执行它，流式输出也会逐块传递
+    def route(inputs):
+        return fallback if base_url in _unsupported else native_with_fallback
+
+    return RunnableLambda(route, name=name)
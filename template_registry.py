@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import functools
+import threading
+import inspect
+import os
+
+# 加载环境变量
+load_dotenv()
+
+# 编译后模板的注册表：动态模板构建函数的结果按选择参数（语言对、级别、上下文类别等）缓存，
+# 相同参数不再重复拼接字符串、解析模板和提取变量。缓存有上限，按 LRU 淘汰，
+# 启动时可以预编译已知的组合，并统计命中/未命中次数
+
+
+class TemplateRegistry:
+    """带 LRU 淘汰的模板缓存"""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or int(os.getenv("TEMPLATE_CACHE_SIZE", "256"))
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _record(self, namespace, hit):
+        stats = self._stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+
+    def get_or_build(self, namespace, key, builder):
+        """返回缓存的模板，未命中时调用 builder() 构建并缓存"""
+        cache_key = (namespace, key)
+        with self._lock:
+            template = self._templates.get(cache_key)
+            if template is not None:
+                self._templates.move_to_end(cache_key)
+                self._record(namespace, True)
+                return template
+            self._record(namespace, False)
+
+        template = builder()
+        with self._lock:
+            self._templates[cache_key] = template
+            self._templates.move_to_end(cache_key)
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def cached(self, namespace, key=None):
+        """装饰模板构建函数
+
+        key 为可选的函数，参数与被装饰函数相同，返回真正决定模板内容的选择参数；
+        不传时使用补全默认值后的全部参数
+        """
+
+        def decorator(builder):
+            signature = inspect.signature(builder)
+
+            @functools.wraps(builder)
+            def wrapper(*args, **kwargs):
+                if key is not None:
+                    cache_key = key(*args, **kwargs)
+                else:
+                    bound = signature.bind(*args, **kwargs)
+                    bound.apply_defaults()
+                    cache_key = tuple(bound.arguments.values())
+                return self.get_or_build(namespace, cache_key, lambda: builder(*args, **kwargs))
+
+            wrapper.namespace = namespace
+            return wrapper
+
+        return decorator
+
+    def precompile(self, builder, variants):
+        """预编译已知的参数组合，variants 中每一项是位置参数元组"""
+        for args in variants:
+            builder(*args)
+
+    def stats(self):
+        with self._lock:
+            namespaces = {name: dict(stats) for name, stats in self._stats.items()}
+            size = len(self._templates)
+        hits = sum(stats["hits"] for stats in namespaces.values())
+        misses = sum(stats["misses"] for stats in namespaces.values())
+        return {
+            "size": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "namespaces": namespaces,
+        }
+
+
+# 进程内共享的模板注册表
+template_registry = TemplateRegistry()
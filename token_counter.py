@@ -0,0 +1,63 @@
+from functools import lru_cache
+import logging
+import re
+import os
+
+import tiktoken
+
+# 基于 tiktoken 的 token 计数。编码器按模型名缓存，未知模型（或兼容接口的自定义模型名）
+# 退回 cl100k_base，计数只用于预算和统计，和服务端的精确值有少量偏差可以接受。
+# 离线环境下 tiktoken 无法下载编码文件时，退回按字符估算
+
+logger = logging.getLogger(__name__)
+
+# 每条聊天消息除内容外的固定开销（角色、分隔符等），参考 OpenAI 的计数规则
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=16)
+def get_encoding(model=None):
+    model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("无法加载 tiktoken 编码，按字符估算 token 数: %s", e)
+        return None
+
+
+# 中日韩字符大致一个字一个 token，其余文本大致四个字符一个 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    # disallowed_special=() 让用户输入里的 <|endoftext|> 等当普通文本计数，不抛异常
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_text(message):
+    """取出消息的文本内容，多段内容只统计文本部分"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+
+
+def count_message_tokens(message, model=None):
+    tokens = MESSAGE_OVERHEAD + count_tokens(message_text(message), model)
+    # 工具调用的参数同样占用上下文
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(tool_call["name"], model) + count_tokens(str(tool_call["args"]), model)
+    return tokens
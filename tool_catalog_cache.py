@@ -0,0 +1,148 @@
+from mcp.types import Tool as MCPTool
+from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+from pathlib import Path
+import importlib.metadata
+import contextlib
+import hashlib
+import logging
+import asyncio
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+# MCP 工具目录的磁盘缓存：按 Server 启动命令和包版本区分缓存文件，
+# 文件里保存 list_tools 的原始结果和 schema 哈希。
+# 启动时懒加载缓存，直接用缓存的定义构建 LangChain 工具，
+# 再在后台做一次 list_tools 比对哈希，有变化才更新缓存
+
+
+def _default_cache_dir():
+    return Path(os.getenv("MCP_TOOL_CACHE_DIR", "") or Path.home() / ".cache" / "ai_agent" / "mcp_tools")
+
+
+def _package_version(server_params):
+    """尽量解析出 MCP Server 包的版本，解析不到时返回 unknown"""
+    for token in server_params.args:
+        if token.startswith("-"):
+            continue
+        for sep in ("==", "@"):
+            if sep in token:
+                return token.split(sep, 1)[1]
+        with contextlib.suppress(importlib.metadata.PackageNotFoundError, ValueError):
+            return importlib.metadata.version(token)
+    return "unknown"
+
+
+def schema_hash(tools):
+    """计算工具定义列表的稳定哈希"""
+    payload = json.dumps(tools, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def list_all_tools(session):
+    """分页获取 Server 的全部工具定义"""
+    tools = []
+    cursor = None
+    while True:
+        page = await session.list_tools(cursor=cursor)
+        tools.extend(page.tools)
+        if not page.nextCursor:
+            return tools
+        cursor = page.nextCursor
+
+
+class ToolCatalogCache:
+    """持久化的 MCP 工具目录缓存"""
+
+    def __init__(self, server_params, cache_dir=None):
+        self.command = " ".join([server_params.command, *server_params.args])
+        self.package_version = _package_version(server_params)
+        key = hashlib.sha256(f"{self.command}\0{self.package_version}".encode("utf-8")).hexdigest()[:16]
+        self.path = Path(cache_dir or _default_cache_dir()) / f"{key}.json"
+        # 每次目录内容变化时递增，会话据此判断是否需要重建工具
+        self.version = 0
+        self._catalog = None
+        self._loaded = False
+        self._revalidate_task = None
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            try:
+                catalog = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                catalog = None
+            if catalog and catalog.get("schema_hash") == schema_hash(catalog.get("tools", [])):
+                self._catalog = catalog
+                self.version += 1
+        return self._catalog
+
+    def _save(self, mcp_tools, server_version):
+        tools = [tool.model_dump(mode="json", exclude_none=True) for tool in mcp_tools]
+        digest = schema_hash(tools)
+        changed = self._catalog is None or self._catalog["schema_hash"] != digest
+        if not changed and self._catalog.get("server_version") == server_version:
+            return False
+
+        self._catalog = {
+            "command": self.command,
+            "package_version": self.package_version,
+            "server_version": server_version,
+            "schema_hash": digest,
+            "tools": tools,
+        }
+        self._loaded = True
+        if changed:
+            self.version += 1
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self._catalog, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            logger.warning("写入工具目录缓存失败: %s", self.path, exc_info=True)
+        return changed
+
+    def tool_specs(self):
+        """返回缓存的 OpenAI 格式工具定义，握手完成前就可以直接 bind_tools"""
+        catalog = self._load()
+        if catalog is None:
+            return None
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool["name"],
+                    "description": tool.get("description", ""),
+                    "parameters": tool["inputSchema"],
+                },
+            }
+            for tool in catalog["tools"]
+        ]
+
+    def build_tools(self, session):
+        """用当前缓存的工具定义为指定会话构建 LangChain 工具"""
+        return [
+            convert_mcp_tool_to_langchain_tool(session, MCPTool.model_validate(tool))
+            for tool in self._catalog["tools"]
+        ]
+
+    async def load_tools(self, session, server_version=None):
+        """优先使用缓存加载工具，缓存缺失或 Server 版本变化时才请求 list_tools"""
+        catalog = self._load()
+        if catalog is not None and server_version in (None, catalog.get("server_version")):
+            if self._revalidate_task is None:
+                # 每个进程只在后台校验一次，校验期间会话已经可以正常使用
+                self._revalidate_task = asyncio.create_task(self._revalidate(session, server_version))
+            return self.build_tools(session)
+
+        self._save(await list_all_tools(session), server_version)
+        return self.build_tools(session)
+
+    async def _revalidate(self, session, server_version):
+        try:
+            if self._save(await list_all_tools(session), server_version):
+                logger.info("MCP 工具目录已变化，缓存已更新: %s", self.path)
+        except Exception:
+            logger.warning("后台校验工具目录失败", exc_info=True)
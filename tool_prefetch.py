@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import contextlib
+import threading
+import logging
+import asyncio
+import orjson
+import time
+import re
+import os
+
+from tool_result_cache import ToolResultCache, get_tool_result_cache
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 工具调用的投机预取：agent 第一轮模型调用几乎总是先查当前用户参与的项目，
+# 等模型返回后再调用 TAPD，两段耗时是串行的。这里在第一轮模型调用的同时，
+# 按查询内容启动配置好的只读工具调用；模型请求了相同的工具和参数时直接交出预取结果，
+# 没有请求的预取在查询结束时丢弃。统计预取命中率和节省的等待时间
+
+
+@dataclass
+class PrefetchRule:
+    tool: str
+    # 参数模板，字符串值里可以使用 {nick}（CURRENT_USER_NICK）
+    args: dict
+    # 查询匹配任一正则时才预取，为空表示总是预取
+    patterns: tuple = ()
+
+
+DEFAULT_RULES = [
+    PrefetchRule("get_user_participant_projects", {"nick": "{nick}"}, patterns=(r"项目", r"project")),
+]
+
+
+def load_rules():
+    """TOOL_PREFETCH_RULES 为 JSON 列表，例如 [{"tool": "...", "args": {...}, "patterns": ["..."]}]"""
+    value = os.getenv("TOOL_PREFETCH_RULES", "").strip()
+    if not value:
+        return list(DEFAULT_RULES)
+    return [
+        PrefetchRule(item["tool"], item.get("args") or {}, tuple(item.get("patterns") or ()))
+        for item in orjson.loads(value)
+    ]
+
+
+class Prefetch:
+    """一次查询的预取任务，按工具名和规范化参数交给对应的工具调用"""
+
+    def __init__(self, prefetcher):
+        self.prefetcher = prefetcher
+        self._tasks = {}
+
+    def start(self, tool, args):
+        key = ToolResultCache.make_key(tool.name, args)
+        if key not in self._tasks:
+            task = asyncio.create_task(tool.coroutine(**args), name=f"prefetch-{tool.name}")
+            # [任务, 开始时间, 完成时间]
+            entry = [task, time.perf_counter(), None]
+            task.add_done_callback(lambda _: entry.__setitem__(2, time.perf_counter()))
+            self._tasks[key] = entry
+            self.prefetcher._record("started")
+
+    def wrap_tool(self, tool):
+        """返回先查预取结果的工具副本"""
+        coroutine = tool.coroutine
+
+        async def prefetched_call(**arguments):
+            entry = self._tasks.pop(ToolResultCache.make_key(tool.name, arguments), None)
+            if entry is None:
+                return await coroutine(**arguments)
+            task, started, _ = entry
+            requested = time.perf_counter()
+            try:
+                result = await task
+            except Exception as e:
+                # 预取失败时按正常流程重新调用，错误由正常调用报告
+                logger.info("预取 %s 失败，重新调用：%s", tool.name, e)
+                self.prefetcher._record("failed")
+                return await coroutine(**arguments)
+            # 预取在模型调用期间已经完成的部分就是节省的等待时间
+            self.prefetcher._record("hits", min(requested, entry[2] or requested) - started)
+            return result
+
+        return tool.model_copy(update={"coroutine": prefetched_call})
+
+    def wrap_tools(self, tools):
+        return [self.wrap_tool(tool) for tool in tools]
+
+    async def discard(self):
+        """取消并丢弃没有被用到的预取"""
+        tasks, self._tasks = self._tasks, {}
+        for task, _, _ in tasks.values():
+            task.cancel()
+            self.prefetcher._record("wasted")
+        # 等取消完成后再归还会话，避免预取请求和下一次查询共用会话时交错
+        await asyncio.gather(*(task for task, _, _ in tasks.values()), return_exceptions=True)
+
+
+class ToolPrefetcher:
+    """按查询内容选择要预取的只读工具调用"""
+
+    def __init__(self, rules=None, cache=None, nick=None, enabled=None):
+        self.rules = rules if rules is not None else load_rules()
+        self.cache = cache or get_tool_result_cache()
+        self.nick = os.getenv("CURRENT_USER_NICK", "") if nick is None else nick
+        if enabled is None:
+            enabled = os.getenv("TOOL_PREFETCH_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+        self.enabled = enabled
+        self._patterns = [[re.compile(pattern, re.IGNORECASE) for pattern in rule.patterns] for rule in self.rules]
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "hits": 0, "wasted": 0, "failed": 0, "saved_seconds": 0.0}
+
+    def _args(self, rule):
+        """填充参数模板，模板需要的值（例如 nick）为空时返回 None"""
+        args = {}
+        for name, value in rule.args.items():
+            if isinstance(value, str) and "{nick}" in value:
+                if not self.nick:
+                    return None
+                value = value.format(nick=self.nick)
+            args[name] = value
+        return args
+
+    def plan(self, tool_names, query):
+        """返回这次查询要预取的 (工具名, 参数) 列表"""
+        if not self.enabled:
+            return []
+        calls = []
+        for rule, patterns in zip(self.rules, self._patterns):
+            # 写操作不能投机执行
+            if rule.tool not in tool_names or self.cache.is_write(rule.tool):
+                continue
+            if patterns and not any(pattern.search(query) for pattern in patterns):
+                continue
+            args = self._args(rule)
+            if args is not None:
+                calls.append((rule.tool, args))
+        return calls
+
+    @contextlib.asynccontextmanager
+    async def start(self, tools, query):
+        """在 tools（已包装好缓存和埋点的工具）上启动预取，退出时丢弃未使用的预取
+
+        用法：async with prefetcher.start(tools, query) as prefetch: tools = prefetch.wrap_tools(tools)
+        """
+        prefetch = Prefetch(self)
+        index = {tool.name: tool for tool in tools}
+        for name, args in self.plan(index, query):
+            prefetch.start(index[name], args)
+        try:
+            yield prefetch
+        finally:
+            await prefetch.discard()
+
+    def _record(self, name, saved=0.0):
+        with self._lock:
+            self._stats[name] += 1
+            self._stats["saved_seconds"] += saved
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["hits"] / stats["started"] if stats["started"] else 0.0
+        return stats
+
+
+_shared_prefetcher = None
+
+
+def get_tool_prefetcher():
+    """进程内共享的预取器，两个 MCP 客户端复用同一份统计"""
+    global _shared_prefetcher
+    if _shared_prefetcher is None:
+        _shared_prefetcher = ToolPrefetcher()
+    return _shared_prefetcher
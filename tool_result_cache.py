@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from dotenv import load_dotenv
+import orjson
+import time
+import os
+
+# 加载环境变量
+load_dotenv()
+
+# MCP 工具结果缓存：只读工具（按白名单/通配符匹配）的结果按
+# 工具名 + 规范化参数缓存，支持按工具设置 TTL、LRU 淘汰，
+# 调用写工具时主动清空缓存。通过包装工具实现，
+# 手写的 agent 循环和 create_react_agent 都可以直接使用包装后的工具
+
+
+def _split_patterns(value):
+    return [pattern.strip() for pattern in value.split(",") if pattern.strip()]
+
+
+def _parse_ttls(value):
+    """解析 "tool_a=600,get_*=120" 形式的按工具 TTL 配置"""
+    ttls = {}
+    for item in _split_patterns(value):
+        pattern, _, seconds = item.partition("=")
+        ttls[pattern.strip()] = float(seconds)
+    return ttls
+
+
+class ToolResultCache:
+    """带 TTL 和 LRU 淘汰的工具结果缓存"""
+
+    def __init__(self, read_patterns=None, write_patterns=None, default_ttl=None, ttls=None, max_size=None):
+        self.read_patterns = read_patterns or _split_patterns(
+            os.getenv("TOOL_CACHE_READ_PATTERNS", "") or "get_*,list_*,query_*,search_*"
+        )
+        self.write_patterns = write_patterns or _split_patterns(
+            os.getenv("TOOL_CACHE_WRITE_PATTERNS", "") or "create_*,update_*,delete_*,add_*,edit_*,send_*"
+        )
+        # 0 表示不缓存
+        self.default_ttl = default_ttl if default_ttl is not None else float(os.getenv("TOOL_CACHE_TTL", "300"))
+        self.ttls = ttls if ttls is not None else _parse_ttls(os.getenv("TOOL_CACHE_TTLS", ""))
+        self.max_size = max_size or int(os.getenv("TOOL_CACHE_MAX_SIZE", "256"))
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def is_cacheable(self, tool_name):
+        return any(fnmatchcase(tool_name, pattern) for pattern in self.read_patterns)
+
+    def is_write(self, tool_name):
+        return any(fnmatchcase(tool_name, pattern) for pattern in self.write_patterns)
+
+    def ttl_for(self, tool_name):
+        if tool_name in self.ttls:
+            return self.ttls[tool_name]
+        for pattern, ttl in self.ttls.items():
+            if fnmatchcase(tool_name, pattern):
+                return ttl
+        return self.default_ttl
+
+    @staticmethod
+    def make_key(tool_name, args):
+        # 参数按键排序后序列化，保证参数顺序不同的相同调用命中同一条缓存
+        return tool_name, orjson.dumps(args or {}, option=orjson.OPT_SORT_KEYS, default=str)
+
+    def get(self, tool_name, args):
+        """返回 (是否命中, 缓存值)"""
+        key = self.make_key(tool_name, args)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._entries[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, tool_name, args, value):
+        ttl = self.ttl_for(tool_name)
+        if ttl <= 0:
+            return
+        key = self.make_key(tool_name, args)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tool_name=None):
+        """清空缓存；指定 tool_name 时只清空该工具的结果"""
+        if tool_name is None:
+            self._entries.clear()
+        else:
+            for key in [key for key in self._entries if key[0] == tool_name]:
+                del self._entries[key]
+        self.invalidations += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+    def wrap_tool(self, tool):
+        """返回带缓存的工具副本；既不是只读也不是写工具时原样返回"""
+        cacheable = self.is_cacheable(tool.name)
+        write = self.is_write(tool.name)
+        if not (cacheable or write):
+            return tool
+
+        coroutine = tool.coroutine
+
+        async def cached_call(**arguments):
+            if write:
+                # 写操作可能改变任意只读结果，先执行再整体失效
+                result = await coroutine(**arguments)
+                self.invalidate()
+                return result
+
+            hit, value = self.get(tool.name, arguments)
+            if hit:
+                return value
+            result = await coroutine(**arguments)
+            self.set(tool.name, arguments, result)
+            return result
+
+        return tool.model_copy(update={"coroutine": cached_call})
+
+    def wrap_tools(self, tools):
+        return [self.wrap_tool(tool) for tool in tools]
+
+
+_shared_cache = None
+
+
+def get_tool_result_cache():
+    """进程内共享的工具结果缓存，两个 MCP 客户端复用同一份"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = ToolResultCache()
+    return _shared_cache
@@ -0,0 +1,211 @@
+from fnmatch import fnmatchcase
+from dataclasses import dataclass, replace
+from dotenv import load_dotenv
+import threading
+import orjson
+import os
+
+from token_counter import count_tokens
+
+# 加载环境变量
+load_dotenv()
+
+# 工具结果压缩：TAPD 返回的 JSON 每个项目、需求都带几十个字段，原样放进 ToolMessage 会让
+# 后续每一轮的提示多出几千个 token。这里按工具配置保留的字段、列表最多条数和长字符串上限，
+# 压缩后用 orjson 紧凑序列化再交给模型，并统计每个工具压缩前后的 token 数。
+# 通过包装工具实现，手写的 agent 循环和 create_react_agent 都可以直接使用
+
+
+@dataclass
+class CompactionRule:
+    # 记录只保留这些字段；为空表示保留全部字段
+    fields: tuple = ()
+    # 列表最多保留的条数，超出部分替换为省略说明
+    max_items: int = 30
+    # 单个字符串值的最大长度
+    max_string: int = 200
+    # 所在列表至少有这么多条时才投影字段；单条记录（例如需求详情）保留全部字段
+    min_records: int = 5
+
+
+# 按工具名（支持通配符）配置，先精确匹配，再按顺序匹配通配符
+DEFAULT_RULES = {
+    "get_user_participant_projects": CompactionRule(fields=("id", "name", "status"), max_items=100),
+    "get_stories_or_tasks": CompactionRule(fields=("id", "name", "status", "owner", "priority", "iteration_id")),
+    "*": CompactionRule(),
+}
+
+# 压缩说明的键：列出被省略的字段、截断的字符串个数，模型需要时可以再查询详情
+NOTE_KEY = "_compacted"
+
+
+def load_rules():
+    """TOOL_COMPACT_RULES 为 JSON 对象，例如 {"get_*": {"fields": ["id", "name"], "max_items": 20}}"""
+    value = os.getenv("TOOL_COMPACT_RULES", "").strip()
+    if not value:
+        return dict(DEFAULT_RULES)
+    rules = {}
+    for pattern, item in orjson.loads(value).items():
+        item = dict(item)
+        item["fields"] = tuple(item.get("fields") or ())
+        rules[pattern] = CompactionRule(**item)
+    # 没有配置的工具仍然按默认规则截断长列表和长字符串
+    rules.setdefault("*", DEFAULT_RULES["*"])
+    return rules
+
+
+def project(value, rule, note=None, records=0):
+    """按规则递归投影字段、截断列表和长字符串
+
+    note 收集被省略的字段名和截断的字符串个数；records 是所在列表的条数
+    """
+    note = note if note is not None else {"omitted_fields": set(), "truncated_strings": 0}
+    if isinstance(value, dict):
+        # 包含至少一半目标字段的字典视为一条记录，只保留配置的字段；
+        # 外层的 {"status": 1, "data": [...]} 只碰巧有个别同名字段，不会被误当成记录
+        if (
+            rule.fields
+            and records >= rule.min_records
+            and 2 * sum(field in value for field in rule.fields) >= len(rule.fields)
+        ):
+            note["omitted_fields"].update(key for key in value if key not in rule.fields)
+            return {key: project(value[key], rule, note, records) for key in rule.fields if key in value}
+        return {key: project(item, rule, note, records) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [project(item, rule, note, len(value)) for item in value[:rule.max_items]]
+        if len(value) > rule.max_items:
+            # 告诉模型还有多少条没有返回，需要时可以用工具的分页参数继续查询
+            items.append(f"...（省略 {len(value) - rule.max_items} 条，共 {len(value)} 条）")
+        return items
+    if isinstance(value, str) and len(value) > rule.max_string:
+        note["truncated_strings"] += 1
+        return value[:rule.max_string] + f"…（已截断，原长 {len(value)} 字符）"
+    return value
+
+
+def _with_note(value, note):
+    """把压缩说明附在结果上；结果不是字典时包成 {"data": ..., "_compacted": ...}"""
+    summary = {}
+    if note["omitted_fields"]:
+        summary["omitted_fields"] = sorted(note["omitted_fields"])
+    if note["truncated_strings"]:
+        summary["truncated_strings"] = note["truncated_strings"]
+    if not summary:
+        return value
+    if isinstance(value, dict):
+        return {**value, NOTE_KEY: summary}
+    return {"data": value, NOTE_KEY: summary}
+
+
+class ToolResultCompactor:
+    """按工具压缩结果文本，统计压缩前后的 token 数"""
+
+    def __init__(self, rules=None, max_chars=None, enabled=None):
+        self.rules = rules if rules is not None else load_rules()
+        # 压缩后仍然过长的结果：JSON 减少列表条数，非 JSON 文本按字符截断
+        self.max_chars = max_chars or int(os.getenv("TOOL_COMPACT_MAX_CHARS", "8000"))
+        if enabled is None:
+            enabled = os.getenv("TOOL_COMPACT_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def rule_for(self, tool_name):
+        if tool_name in self.rules:
+            return self.rules[tool_name]
+        for pattern, rule in self.rules.items():
+            if fnmatchcase(tool_name, pattern):
+                return rule
+        return None
+
+    def compact(self, tool_name, text):
+        """返回压缩后的文本；没有匹配的规则时原样返回"""
+        rule = self.rule_for(tool_name)
+        if rule is None or not isinstance(text, str):
+            return text
+        try:
+            value = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            value = None
+            compacted = text
+        else:
+            compacted = self._dumps(value, rule)
+        if len(compacted) > self.max_chars:
+            if value is None or not isinstance(value, (dict, list)):
+                # 非 JSON 文本只能按字符截断
+                compacted = compacted[:self.max_chars] + f"…（已截断，原长 {len(text)} 字符）"
+            else:
+                compacted = self._shrink(value, rule)
+        self._record(tool_name, text, compacted)
+        return compacted
+
+    @staticmethod
+    def _dumps(value, rule):
+        note = {"omitted_fields": set(), "truncated_strings": 0}
+        return orjson.dumps(_with_note(project(value, rule, note), note)).decode()
+
+    def _shrink(self, value, rule):
+        """减少列表条数（不够再缩短字符串）直到不超过 max_chars，结果仍然是合法的 JSON"""
+        compacted = self._dumps(value, rule)
+        max_items, max_string = min(rule.max_items, 64), rule.max_string
+        while True:
+            if max_items > 1:
+                max_items //= 2
+            elif max_string > 20:
+                max_string //= 2
+            else:
+                # 已经缩到最小仍然超长，返回最小的结果
+                return compacted
+            compacted = self._dumps(value, replace(rule, max_items=max_items, max_string=max_string))
+            if len(compacted) <= self.max_chars:
+                return compacted
+
+    def _record(self, tool_name, before, after):
+        before_tokens, after_tokens = count_tokens(before), count_tokens(after)
+        with self._lock:
+            stats = self._stats.setdefault(tool_name, {"calls": 0, "tokens_before": 0, "tokens_after": 0})
+            stats["calls"] += 1
+            stats["tokens_before"] += before_tokens
+            stats["tokens_after"] += after_tokens
+
+    def stats(self):
+        """按工具返回调用次数、压缩前后的 token 数和节省比例"""
+        with self._lock:
+            stats = {tool_name: dict(item) for tool_name, item in self._stats.items()}
+        for item in stats.values():
+            before = item["tokens_before"]
+            item["saved_ratio"] = 1 - item["tokens_after"] / before if before else 0.0
+        return stats
+
+    def wrap_tool(self, tool):
+        """返回压缩结果的工具副本；没有匹配的规则或未启用时原样返回"""
+        if not self.enabled or self.rule_for(tool.name) is None:
+            return tool
+
+        coroutine = tool.coroutine
+
+        async def compacted_call(**arguments):
+            result = await coroutine(**arguments)
+            # MCP 工具的返回值是 (内容, 非文本内容)，内容可能是字符串或字符串列表
+            content, artifact = result if isinstance(result, tuple) else (result, None)
+            if isinstance(content, list):
+                content = [self.compact(tool.name, item) for item in content]
+            else:
+                content = self.compact(tool.name, content)
+            return (content, artifact) if isinstance(result, tuple) else content
+
+        return tool.model_copy(update={"coroutine": compacted_call})
+
+    def wrap_tools(self, tools):
+        return [self.wrap_tool(tool) for tool in tools]
+
+
+_shared_compactor = None
+
+
+def get_tool_result_compactor():
+    """进程内共享的结果压缩器，两个 MCP 客户端复用同一份统计"""
+    global _shared_compactor
+    if _shared_compactor is None:
+        _shared_compactor = ToolResultCompactor()
+    return _shared_compactor
@@ -0,0 +1,237 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from dotenv import load_dotenv
+import threading
+import orjson
+import math
+import re
+import os
+
+from token_counter import count_tokens
+
+# 加载环境变量
+load_dotenv()
+
+# 按查询选择工具子集：mcp-server-tapd 的全部工具连同完整的 JSON Schema 每轮都要发给模型，
+# 是一笔固定的提示开销。工具加载后在本地用 BM25 对工具名和描述建索引（不调用向量接口），
+# 每个查询只绑定最相关的 top-k 个工具；拿到工具结果后，按结果内容再选一组相关工具并入，
+# 模型请求了没有绑定的工具时，之后的轮次改为绑定全部工具。
+# 统计每次模型调用绑定的工具数和节省的提示 token
+
+# 英文单词和数字按词切分（工具名里的下划线也作为分隔），中日韩文本切成单字和相邻双字
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[\u3000-\u9fff\uac00-\ud7af]+")
+_CJK_PATTERN = re.compile(r"[\u3000-\u9fff\uac00-\ud7af]")
+# 每条工具结果只取开头这么多字符参与打分
+_CONTEXT_CHARS = 2000
+
+
+def tokenize(text):
+    tokens = []
+    for word in _WORD_PATTERN.findall((text or "").lower()):
+        if not _CJK_PATTERN.match(word):
+            tokens.append(word)
+            continue
+        tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 打分"""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.frequencies = []
+        for document in documents:
+            counts = {}
+            for token in document:
+                counts[token] = counts.get(token, 0) + 1
+            self.frequencies.append(counts)
+        self.lengths = [len(document) for document in documents]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = {}
+        for counts in self.frequencies:
+            for token in counts:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        total = len(documents)
+        self.idf = {
+            token: math.log(1 + (total - count + 0.5) / (count + 0.5))
+            for token, count in document_frequency.items()
+        }
+
+    def scores(self, query_tokens):
+        result = []
+        for counts, length in zip(self.frequencies, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            for token in set(query_tokens):
+                frequency = counts.get(token)
+                if frequency:
+                    score += self.idf[token] * frequency * (self.k1 + 1) / (frequency + norm)
+            result.append(score)
+        return result
+
+
+def _tool_spec(tool):
+    """工具可以是 LangChain 工具或 OpenAI 格式的定义，统一成 OpenAI 格式"""
+    if isinstance(tool, dict) and "function" in tool:
+        return tool
+    return convert_to_openai_tool(tool)
+
+
+def tool_name(tool):
+    return tool["function"]["name"] if isinstance(tool, dict) else tool.name
+
+
+class ToolSelector:
+    """一份工具目录的检索索引，工具加载后建一次"""
+
+    def __init__(self, tools, top_k=None, always=None):
+        specs = [_tool_spec(tool) for tool in tools]
+        self.names = [spec["function"]["name"] for spec in specs]
+        self.top_k = top_k or int(os.getenv("TOOL_SELECT_TOP_K", "5"))
+        # 总是绑定的工具，默认是几乎每个查询都要用的 get_user_participant_projects
+        if always is None:
+            always = os.getenv("TOOL_SELECT_ALWAYS", "get_user_participant_projects").split(",")
+        self.always = {name.strip() for name in always if name.strip()}
+        self.index = BM25Index([
+            # 工具名重复一次，提高名称命中的权重
+            tokenize(name.replace("_", " ")) * 2 + tokenize(spec["function"].get("description", ""))
+            for name, spec in zip(self.names, specs)
+        ])
+        # 每个工具的定义在提示中占用的 token 数
+        self.tokens = {
+            name: count_tokens(orjson.dumps(spec).decode())
+            for name, spec in zip(self.names, specs)
+        }
+        self.full_tokens = sum(self.tokens.values())
+        self._lock = threading.Lock()
+        self._stats = {
+            "model_calls": 0, "fallback_calls": 0, "rescored_calls": 0, "bound_tools": 0, "prompt_tokens_saved": 0,
+        }
+
+    def _top(self, text):
+        """按相关度取前 top_k 个工具，相关的不足 top_k 个时按目录顺序补齐；和任何工具都不相关时返回 None"""
+        scores = self.index.scores(tokenize(text))
+        if not any(score > 0 for score in scores):
+            return None
+        # sorted 是稳定排序，得分相同（包括为 0）的工具保持目录顺序
+        ranked = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)
+        return {self.names[index] for index in ranked[:self.top_k]}
+
+    def select(self, query, context=None):
+        """返回要绑定的工具名集合；工具数不超过 top_k 或查询和任何工具都不相关时返回 None（绑定全部）
+
+        context 是查询之后拿到的工具结果，按它选出的工具一并绑定，后续轮次可以用上查询里没有提到的工具
+        """
+        if len(self.names) <= self.top_k:
+            return None
+        names = self._top(query)
+        if names is None:
+            return None
+        if context:
+            extra = (self._top(context) or set()) - names
+            if extra:
+                names |= extra
+                with self._lock:
+                    self._stats["rescored_calls"] += 1
+        return names | (self.always & set(self.names))
+
+    def select_messages(self, messages):
+        """按会话中最新的用户问题和之后的工具结果选择工具"""
+        turn = current_turn(messages)
+        context = " ".join(
+            str(message.content)[:_CONTEXT_CHARS] for message in turn if isinstance(message, ToolMessage)
+        )
+        return self.select(turn[0].content if turn else "", context)
+
+    @staticmethod
+    def subset(tools, names):
+        """按工具名过滤，保持原来的顺序；names 为 None 时返回全部"""
+        if names is None:
+            return list(tools)
+        return [tool for tool in tools if tool_name(tool) in names]
+
+    @staticmethod
+    def missing(tool_calls, names):
+        """模型请求了没有绑定的工具"""
+        return names is not None and any(tool_call["name"] not in names for tool_call in tool_calls)
+
+    def record_call(self, names, fallback=False):
+        """记录一次模型调用绑定的工具"""
+        bound = self.full_tokens if names is None else sum(self.tokens.get(name, 0) for name in names)
+        with self._lock:
+            self._stats["model_calls"] += 1
+            self._stats["fallback_calls"] += fallback
+            self._stats["bound_tools"] += len(self.names) if names is None else len(names)
+            self._stats["prompt_tokens_saved"] += self.full_tokens - bound
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        bound = stats.pop("bound_tools")
+        stats["catalog_tools"] = len(self.names)
+        stats["catalog_tokens"] = self.full_tokens
+        stats["avg_bound_tools"] = bound / stats["model_calls"] if stats["model_calls"] else None
+        return stats
+
+
+def current_turn(messages):
+    """从最新的用户问题开始的消息"""
+    start = max((index for index, message in enumerate(messages) if isinstance(message, HumanMessage)), default=0)
+    return messages[start:]
+
+
+def selecting_model(model, tools, selector):
+    """create_react_agent 的动态模型：按会话中最新的用户问题和已有的工具结果绑定工具子集
+
+    本次问题之后模型请求过没有绑定的工具时，绑定全部工具
+    """
+    bound_models = {}
+
+    def bind(names):
+        key = None if names is None else frozenset(names)
+        if key not in bound_models:
+            bound_models[key] = model.bind_tools(selector.subset(tools, names))
+        return bound_models[key]
+
+    def select(state, runtime):
+        messages = state["messages"]
+        names = selector.select_messages(messages)
+        tool_calls = [
+            tool_call
+            for message in current_turn(messages)
+            if isinstance(message, AIMessage)
+            for tool_call in message.tool_calls
+        ]
+        fallback = selector.missing(tool_calls, names)
+        if fallback:
+            names = None
+        selector.record_call(names, fallback)
+        return bind(names)
+
+    return select
+
+
+_selectors = {}
+_selectors_lock = threading.Lock()
+
+
+def get_tool_selector(tools):
+    """按工具目录（工具名列表）缓存索引，同一份目录只建一次"""
+    key = tuple(tool_name(tool) for tool in tools)
+    with _selectors_lock:
+        selector = _selectors.get(key)
+    if selector is None:
+        selector = ToolSelector(tools)
+        with _selectors_lock:
+            selector = _selectors.setdefault(key, selector)
+    return selector
+
+
+def tool_selector_stats():
+    """各工具目录的选择统计"""
+    with _selectors_lock:
+        selectors = list(_selectors.values())
+    return [selector.stats() for selector in selectors]